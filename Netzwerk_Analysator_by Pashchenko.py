@@ -6,10 +6,20 @@ import time
 import socket
 import random
 import os
-import json
+import argparse
 import math
+import struct
+import ipaddress
+import re
+import webbrowser
 from datetime import datetime
+from pathlib import Path
 from collections import defaultdict, deque
+from itertools import chain
+from operator import itemgetter
+
+# Отсчет для замера времени до готовности окна (time-to-interactive)
+_STARTUP_T0 = time.perf_counter()
 
 # Попытка импорта requests для GeoIP
 try:
@@ -17,73 +27,448 @@ try:
 except ImportError:
     requests = None
 
-# Настройка логирования Scapy, чтобы не спамил в консоль
-import logging
-
-logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
-
-from scapy.all import (
-    sniff, IP, TCP, UDP, ARP, Ether, send, srp, conf, wrpcap,
-    DNS, DNSQR, DNSRR, getmacbyip, hexdump
+from netzwerk_engine import (
+    TOP_PEERS, TOP_DNS, DNS_RESOLVER_ROWS, FLOW_COLUMNS, GEOIP_DIR, GEOIP_CACHE_SIZE, RAW_RECV_SIZE,
+    RING_SPEC_DEFAULT, scapy_all, _detect_local_ip, _detect_gateway, ETH_P_IP, ETH_P_ARP, IPPROTO_TCP, IPPROTO_UDP,
+    _ARP, decode_frame, parse_dns_qname, CaptureFileReader, PacketFilter, DNS_QUERIES, DNS_ANSWERED,
+    DNS_NXDOMAIN, DNS_SERVFAIL, DNS_LOST, dns_percentile, new_analytics_state, merge_analytics_delta,
+    TrafficAggregator, lookup_vendor, GEO_UNKNOWN, GeoIpDb, history_charts, ReportWriter,
+    REPORT_FLOW_COLUMNS, REPORT_PEER_COLUMNS, REPORT_DNS_COLUMNS, REPORT_RESOLVER_COLUMNS,
+    REPORT_PACKET_COLUMNS, REPORT_HISTORY_COLUMNS, REPORT_HISTORY_PEER_COLUMNS, REPORT_IFACE_COLUMNS, report_dns_stats, report_packet_rows, report_flow_rows,
+    _SLOT_HDR, flow_shard, CapturePipeline, fmt_bytes, fmt_duration, AnalyzerEngine, AnomalyDetector
 )
 
 # --- КОНСТАНТЫ ---
-MAX_CAPTURED_PACKETS = 500
 MAX_CONSOLE_LINES = 800
+GUI_QUEUE_MAX = 5000  # строк лога; сверх лимита теряются DATA-строки
+GUI_QUEUE_RESERVE = 500  # запас для INFO/ALERT поверх GUI_QUEUE_MAX, дальше теряются и они
+GUI_TICK_MS = 100
+GUI_FRAME_BUDGET_MS = 16.0  # цель по длительности одного тика process_queue
+GUI_DRAIN_MIN = 20
+GUI_DRAIN_MAX = 2000
 ANALYTICS_REFRESH_MS = 2000
-BANDWIDTH_WINDOW_SEC = 10
-
-# --- ГЛОБАЛЬНЫЕ НАСТРОЙКИ ---
-conf.verb = 0
-conf.use_pcap = True
+FLOW_VIEW_ROWS = 30
+FLOW_SCROLL_UNITS = 3
+GEOIP_ONLINE_TIMEOUT_SEC = 5  # только кнопка GEOIP без локальной базы
+BENCH_GEOIP_LOOKUPS = 200000
+ARP_SWEEP_MAX_HOSTS = 1 << 16
+ARP_SWEEP_RATE_PPS = 2000
+ARP_SWEEP_WINDOW = 2048  # запросов без ответа одновременно
+ARP_SWEEP_BATCH = 64
+ARP_SWEEP_TIMEOUT_SEC = 1.0
+ARP_SWEEP_RETRIES = 2  # повторные проходы только по молчавшим адресам
+ARP_SWEEP_PUBLISH_SEC = 0.25
+ARP_REPLY_BPF = "arp and arp[6:2] = 2"
+MAP_LAYOUT_COLD_ITERS = 50
+MAP_LAYOUT_WARM_ITERS = 20  # когда большинство узлов уже на кэшированных позициях
+MAP_FADE_SCANS = 3  # сканов без ответа до удаления узла с карты
+MAP_LABELS_FULL = 150  # до стольких узлов подписи IP + MAC
+MAP_LABELS_IP = 400  # до стольких — только IP; дальше подпись по наведению
+MAP_NODE_RADIUS = (12, 7, 4)  # по уровню детализации
+MAP_MOVE_EPS_PX = 1.0
+REPORT_DIR = "reports"
+REPORT_HISTORY_SEC = 86400
+PKT_VIEW_ROWS = 20
+PKT_SCROLL_UNITS = 3
+PKT_COLUMNS = [
+    ("no", "No.", 90, "e"), ("time", "Time", 110, "w"), ("src", "Source", 240, "w"),
+    ("dst", "Destination", 240, "w"), ("proto", "Proto", 60, "w"), ("sport", "Sport", 60, "e"),
+    ("dport", "Dport", 60, "e"), ("len", "Length", 70, "e"),
+]
+# Фиксированные строки панели аналитики (обновляются по разнице со снимком)
+ANALYTICS_LINES = ("status", "filter", "totals", "rates", "capture", "interfaces", "protocols", "apps", "flags")
+PEER_COLUMNS = [
+    ("ip", "Peer", 200, "w"), ("host", "Host", 220, "w"), ("bytes", "Bytes", 90, "e"), ("pkts", "Pkts", 70, "e"),
+    ("in", "In", 60, "e"), ("out", "Out", 60, "e"), ("router", "Router", 60, "e"),
+    ("geo", "Geo / ASN", 240, "w"),
+]
+DNS_COLUMNS = [
+    ("name", "Domain", 220, "w"), ("count", "Queries", 60, "e"), ("p50", "p50 ms", 60, "e"),
+    ("p95", "p95 ms", 60, "e"), ("p99", "p99 ms", 60, "e"), ("nx", "NX %", 50, "e"), ("fail", "FAIL %", 55, "e"),
+]
+RESOLVER_COLUMNS = [
+    ("ip", "Resolver", 140, "w"), ("count", "Queries", 60, "e"), ("p50", "p50 ms", 60, "e"),
+    ("p95", "p95 ms", 60, "e"), ("p99", "p99 ms", 60, "e"), ("nx", "NX %", 50, "e"), ("fail", "FAIL %", 55, "e"),
+    ("lost", "Lost", 50, "e"),
+]
+# По номеру колонки FLOW_COLUMNS; App стоит после Proto, а в Flow.row() — последним
+FLOW_SORT_KEYS = [itemgetter(i) for i in range(3)] + [itemgetter(12)] + [itemgetter(i) for i in range(3, 10)] + [
+    lambda row: row[11] - row[10],  # длительность
+    lambda row: -row[11],  # простой: чем раньше последний пакет, тем больше
+]
+APP_SHARE_TOP = 8  # приложений в строке долей трафика
+BENCH_DEFAULT_LIMIT = 200000
+BENCH_STRESS_PPS = 100000
+BENCH_STRESS_SEC = 5
+BENCH_SNAPSHOT_SEC = 0.05
+BENCH_PEERS = 5000
+BENCH_PIPELINE_FRAMES = 200000
+BENCH_TARGET_IP = "10.0.0.5"
+BENCH_ROUTER_IP = "10.0.0.1"
+BENCH_DETECT_PEERS = 64  # фон ниже порогов детектора: тревоги дают только подмешанные атаки
+BENCH_SCANNER_IP = "10.66.0.1"
+BENCH_ARP_STORM_IP = "10.0.0.99"
+
+# --- ARP-СКАНЕР ---
+
+
+def parse_sweep_targets(text, limit=ARP_SWEEP_MAX_HOSTS):
+    # "10.0.0.0/22, 10.0.8.0/22 192.168.1.7" -> адреса хостов (int) без повторов
+    seen = set()
+    targets = []
+    for part in re.split(r"[\s,;]+", text.strip()):
+        if not part:
+            continue
+        try:
+            net = ipaddress.IPv4Network(part, strict=False)
+        except ValueError:
+            raise ValueError(f"not an IPv4 address or CIDR: {part}") from None
+        first, last = int(net.network_address), int(net.broadcast_address)
+        if net.prefixlen < 31:
+            first, last = first + 1, last - 1  # без адреса сети и broadcast
+        if len(targets) + last - first + 1 > limit:
+            raise ValueError(f"sweep is limited to {limit} hosts")
+        for ip in range(first, last + 1):
+            if ip not in seen:
+                seen.add(ip)
+                targets.append(ip)
+    if not targets:
+        raise ValueError("no targets to scan")
+    return targets
+
+
+class ArpSweeper:
+    """Параллельный ARP-опрос произвольного списка адресов.
+
+    Запросы уходят пачками по ARP_SWEEP_BATCH с ограничением скорости
+    (rate_pps) и числа запросов без ответа (window). Ответы разбираются по
+    мере прихода и сразу передаются в on_reply. Каждый следующий проход
+    опрашивает только адреса, не ответившие за timeout.
+    """
+
+    def __init__(self, targets, src_ip, src_mac, rate_pps=ARP_SWEEP_RATE_PPS, window=ARP_SWEEP_WINDOW,
+                 retries=ARP_SWEEP_RETRIES, timeout=ARP_SWEEP_TIMEOUT_SEC):
+        self.targets = targets
+        self._target_set = set(targets)
+        self.rate_pps = max(1, rate_pps)
+        self.window = max(1, window)
+        self.retries = retries
+        self.timeout = timeout
+        self.sent = 0
+        self.rounds = 0
+        mac = bytes.fromhex(src_mac.replace(":", "").replace("-", ""))
+        # Общий префикс кадра: Ethernet broadcast + ARP who-has без адреса цели
+        self._prefix = (b"\xff" * 6 + mac + struct.pack("!H", ETH_P_ARP)
+                        + _ARP.pack(1, ETH_P_IP, 6, 4, 1, mac, socket.inet_aton(src_ip), bytes(6), bytes(4))[:-4])
+
+    def run(self, sock, on_reply=None, stop=None):
+        # -> {ip: mac}; sock — L2-сокет scapy (send/select/recv_raw)
+        found = {}
+        for _ in range(self.retries + 1):
+            todo = deque(ip for ip in self.targets if ip not in found)
+            if not todo or (stop is not None and stop.is_set()):
+                break
+            self.rounds += 1
+            self._round(sock, todo, found, on_reply, stop)
+        return found
+
+    def _round(self, sock, todo, found, on_reply, stop):
+        inflight = set()
+        deadlines = deque()  # (срок, ip) в порядке отправки
+        start = time.monotonic()
+        sent = 0
+        while todo or inflight:
+            if stop is not None and stop.is_set():
+                return
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                inflight.discard(deadlines.popleft()[1])
+            # Бюджет: скорость (с запасом в одну пачку) и окно
+            budget = min(ARP_SWEEP_BATCH, self.window - len(inflight),
+                         int((now - start) * self.rate_pps) + ARP_SWEEP_BATCH - sent, len(todo))
+            for _ in range(max(0, budget)):
+                ip = todo.popleft()
+                if ip in found:
+                    continue
+                sock.send(self._prefix + ip.to_bytes(4, "big"))
+                inflight.add(ip)
+                deadlines.append((now + self.timeout, ip))
+                sent += 1
+                self.sent += 1
+            # Ждем ответов до следующего разрешенного отправления
+            wake = deadlines[0][0] if deadlines else now
+            if todo and len(inflight) < self.window:
+                wake = min(wake, start + (sent + 1 - ARP_SWEEP_BATCH) / self.rate_pps)
+            self._receive(sock, max(0.0, wake - time.monotonic()), found, inflight, on_reply)
+
+    def _receive(self, sock, wait, found, inflight, on_reply):
+        until = time.monotonic() + wait
+        while True:
+            if not sock.select([sock], max(0.0, until - time.monotonic())):
+                return
+            _cls, frame, _ts = sock.recv_raw(RAW_RECV_SIZE)
+            reply = self.parse_reply(frame)
+            if reply is not None and reply[0] not in found:
+                ip, mac = reply
+                if ip in self._target_set:
+                    found[ip] = mac
+                    inflight.discard(ip)
+                    if on_reply is not None:
+                        on_reply(socket.inet_ntoa(ip.to_bytes(4, "big")), mac)
+            if time.monotonic() >= until:
+                return
 
+    @staticmethod
+    def parse_reply(frame):
+        # -> (ip, "aa:bb:..") для ARP is-at, иначе None
+        if not frame:
+            return None
+        rec = decode_frame(frame, 0.0)  # смещение ARP с учетом VLAN-тегов
+        if rec.ethertype != ETH_P_ARP or len(frame) < rec.l3_offset + _ARP.size:
+            return None
+        _, ptype, _, _, op, sha, spa, _, _ = _ARP.unpack_from(frame, rec.l3_offset)
+        if op != 2 or ptype != ETH_P_IP:
+            return None
+        return int.from_bytes(spa, "big"), sha.hex(":")
+
+
+# --- РАСКЛАДКА КАРТЫ СЕТИ ---
+class MapLayout:
+    """Силовая раскладка (Fruchterman-Reingold) узлов вокруг шлюза в (0, 0).
+
+    Позиции кэшируются по MAC: повторный скан с теми же узлами начинается с
+    прежней раскладки. Отталкивание обрезано на 1.5 идеальных расстояния и
+    считается только по соседним клеткам сетки, поэтому итерация — O(n);
+    слабое линейное притяжение к шлюзу дает равномерный диск радиуса ~1.
+    """
+
+    def __init__(self):
+        self.pos = {}  # mac -> [x, y]
+
+    def update(self, macs):
+        # -> число добавленных и удаленных узлов
+        wanted = set(macs)
+        changed = 0
+        for mac in wanted:
+            if mac not in self.pos:
+                rnd = random.Random(mac)  # стартовая точка зависит только от MAC
+                angle = rnd.random() * 2 * math.pi
+                r = 0.5 + 0.5 * rnd.random()
+                self.pos[mac] = [r * math.cos(angle), r * math.sin(angle)]
+                changed += 1
+        for mac in [m for m in self.pos if m not in wanted]:
+            del self.pos[mac]
+            changed += 1
+        return changed
+
+    def run(self, iterations, temperature=0.1):
+        points = list(self.pos.values())
+        if not points:
+            return
+        k = math.sqrt(math.pi / len(points))  # идеальное расстояние в единичном круге
+        k2 = k * k
+        cell = 1.5 * k
+        cell2 = cell * cell
+        for _ in range(iterations):
+            grid = defaultdict(list)
+            for p in points:
+                grid[(int(p[0] // cell), int(p[1] // cell))].append(p)
+            moves = []
+            for p in points:
+                x, y = p
+                cx, cy = int(x // cell), int(y // cell)
+                dx = dy = 0.0
+                for gx in (cx - 1, cx, cx + 1):
+                    for gy in (cy - 1, cy, cy + 1):
+                        for q in grid.get((gx, gy), ()):
+                            if q is p:
+                                continue
+                            ddx = x - q[0]
+                            ddy = y - q[1]
+                            d2 = ddx * ddx + ddy * ddy or 1e-9
+                            if d2 < cell2:
+                                f = k2 / d2
+                                dx += ddx * f
+                                dy += ddy * f
+                # Шлюз: отталкивание k^2/d и притяжение, растущее с расстоянием
+                d2 = x * x + y * y or 1e-9
+                f = k2 / d2 - k
+                dx += x * f
+                dy += y * f
+                moves.append((dx, dy))
+            for p, (dx, dy) in zip(points, moves):
+                length = math.hypot(dx, dy) or 1e-9
+                step = min(length, temperature) / length
+                p[0] += dx * step
+                p[1] += dy * step
+            temperature *= 0.95
+
+
+class MapLayoutWorker:
+    """Фоновый поток раскладки: принимает набор MAC, отдает позиции в publish.
+
+    Пока набор узлов не меняется, раскладка не пересчитывается, так что
+    частые повторные сканы ничего не стоят.
+    """
+
+    def __init__(self, publish):
+        self.layout = MapLayout()
+        self.publish = publish
+        self._pending = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, macs):
+        with self._cond:
+            self._pending = list(macs)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                macs, self._pending = self._pending, None
+            changed = self.layout.update(macs)
+            if not changed:
+                continue
+            warm = changed * 2 < len(self.layout.pos)
+            if warm:
+                self.layout.run(MAP_LAYOUT_WARM_ITERS, temperature=0.03)
+            else:
+                self.layout.run(MAP_LAYOUT_COLD_ITERS)
+            self.publish({mac: (p[0], p[1]) for mac, p in self.layout.pos.items()})
+
+
+class FlowSortWorker:
+    """Фоновая сортировка строк вкладки Flows для publish(колонка, по убыванию, строки).
+
+    Tk-поток только собирает список строк; как и у MapLayoutWorker, из
+    нескольких ожидающих запросов выполняется последний.
+    """
+
+    def __init__(self, publish):
+        self.publish = publish
+        self._pending = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, rows, column, reverse):
+        with self._cond:
+            self._pending = (rows, column, reverse)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                (rows, column, reverse), self._pending = self._pending, None
+            rows.sort(key=FLOW_SORT_KEYS[column], reverse=reverse)
+            self.publish((column, reverse, rows))
+
+
+# --- GUI ОЧЕРЕДЬ СОБЫТИЙ ---
+class GuiEventQueue:
+    """Ограниченная очередь событий для Tk-потока.
+
+    Интерфейс совместим с queue.Queue (put/get_nowait). События-состояния
+    (COALESCE) схлопываются до последнего значения каждого вида. Строки лога
+    идут по порядку: DATA теряются сверх maxsize, INFO/ALERT — сверх
+    maxsize + reserve. Потери считаются по тегу лога или виду события.
+    """
+
+    LOSSY_TAGS = ("DATA",)
+    COALESCE = ("PROGRESS", "DRAW_MAP", "MAP_LAYOUT", "FLOWS_SORTED", "PKT_QUERY", "ADDRESSES", "SCAN_DONE", "REPLAY_DONE")
+
+    def __init__(self, maxsize=GUI_QUEUE_MAX, reserve=GUI_QUEUE_RESERVE):
+        self.maxsize = maxsize
+        self.reserve = reserve
+        self._items = deque()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.dropped_by = defaultdict(int)
+        self._dropped_unreported = defaultdict(int)
+
+    def put(self, task):
+        kind = task[0]
+        with self._lock:
+            if kind in self.COALESCE:
+                # Переставляем в конец: схлопнутые события отдаются в порядке последнего прихода
+                self._latest.pop(kind, None)
+                self._latest[kind] = task
+                return
+            label = task[1][1] if kind == "LOG" else kind
+            limit = self.maxsize if label in self.LOSSY_TAGS else self.maxsize + self.reserve
+            if len(self._items) >= limit:
+                self.dropped += 1
+                self.dropped_by[label] += 1
+                self._dropped_unreported[label] += 1
+                return
+            self._items.append(task)
 
-def _detect_local_ip():
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(('8.8.8.8', 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return '192.168.1.100'
+    def get_nowait(self):
+        with self._lock:
+            if self._items:
+                return self._items.popleft()
+            if self._latest:
+                return self._latest.popitem()[1]
+        raise queue.Empty
 
+    def drain(self, budget):
+        """До budget событий в порядке поступления плюс последние схлопнутые.
 
-def _detect_gateway(local_ip):
-    parts = local_ip.rsplit('.', 1)
-    if len(parts) == 2:
-        return parts[0] + '.1'
-    return '192.168.1.1'
+        -> (события, {тег/вид: потеряно с прошлого drain})
+        """
+        with self._lock:
+            items = self._items
+            n = min(budget, len(items))
+            batch = [items.popleft() for _ in range(n)]
+            batch.extend(self._latest.values())
+            self._latest.clear()
+            dropped, self._dropped_unreported = self._dropped_unreported, defaultdict(int)
+        return batch, dropped
 
+    def qsize(self):
+        return len(self._items) + len(self._latest)
 
-_LOCAL_IP = _detect_local_ip()
-_GATEWAY_IP = _detect_gateway(_LOCAL_IP)
 
 class PashchenkoCyberSuite:
-    def __init__(self, root):
+    def __init__(self, root, intro=True, on_ready=None):
         self.root = root
         self.root.title("PASHCHENKO CYBER SUITE v7.0 [ULTIMATE]")
         self.root.geometry("1400x950")
         self.root.configure(bg="#000000")
 
         # Очередь для потокобезопасного общения
-        self.gui_queue = queue.Queue()
+        self.gui_queue = GuiEventQueue()
+        self._drain_budget = GUI_DRAIN_MIN * 5
 
         # Состояние
-        self.is_sniffing = False
         self.is_flooding = False
-        self.captured_packets = deque(maxlen=MAX_CAPTURED_PACKETS)
         self.network_nodes = []
-        self.analytics_lock = threading.Lock()
-        self.analytics = self._new_analytics_state()
+        # Захват и аналитика — в движке; состоянием аналитики владеет Tk-поток
+        # (engine.drain() вызывается только отсюда), сообщения движка идут в gui_queue
+        self.engine = AnalyzerEngine(emit=lambda kind, data: self.gui_queue.put((kind, data)))
         self._analytics_refresh_id = None
-        self._sniff_start_time = None
+        self._hosts_drawn = 0
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # on_ready(секунды) — вызывается, когда окно готово к вводу (--bench-startup)
+        self.on_ready = on_ready
+        self.local_ip = None
+        self.scapy_load_sec = None
+        self._startup_probe = threading.Thread(target=self._startup_probe_thread, daemon=True)
+        self._startup_probe.start()
 
         # Стили
         self.setup_styles()
 
         # Запуск Интро
-        self.show_intro()
+        if intro:
+            self.show_intro()
+        else:
+            self.init_main_ui()
 
     def setup_styles(self):
         style = ttk.Style()
@@ -94,6 +479,10 @@ class PashchenkoCyberSuite:
         style.map("TNotebook.Tab", background=[("selected", "#00FF00")],
                   foreground=[("selected", "black")])
         style.configure("TProgressbar", thickness=10, background="#00FF00", troughcolor="#111")
+        style.configure("Treeview", background="#080808", fieldbackground="#080808", foreground="#88ff88",
+                        font=("Consolas", 10), rowheight=18, borderwidth=0)
+        style.configure("Treeview.Heading", background="#111", foreground="#00FF00", font=("Consolas", 9, "bold"))
+        style.map("Treeview", background=[("selected", "#004400")])
 
     # --- 0. КИНЕМАТОГРАФИЧНОЕ ИНТРО ---
     def show_intro(self):
@@ -158,16 +547,19 @@ class PashchenkoCyberSuite:
         self.tab_map = tk.Frame(self.notebook, bg="black")  # Feature 1
         self.tab_attack = tk.Frame(self.notebook, bg="black")  # Feature 2
         self.tab_inspector = tk.Frame(self.notebook, bg="black")  # Feature 4
+        self.tab_flows = tk.Frame(self.notebook, bg="black")
 
         self.notebook.add(self.tab_dashboard, text=" [ DASHBOARD ] ")
         self.notebook.add(self.tab_map, text=" [ NET VISUALIZER ] ")
         self.notebook.add(self.tab_attack, text=" [ STRESS TEST ] ")
         self.notebook.add(self.tab_inspector, text=" [ PACKET INSPECTOR ] ")
+        self.notebook.add(self.tab_flows, text=" [ FLOWS ] ")
 
         self.setup_dashboard()
         self.setup_visualizer()
         self.setup_attack_module()
         self.setup_inspector()
+        self.setup_flows()
 
         # Запуск обработчика очереди GUI
         self.process_queue()
@@ -175,6 +567,29 @@ class PashchenkoCyberSuite:
         # Запуск авто-обновления аналитики
         self._schedule_analytics_refresh()
 
+        # after_idle срабатывает после первой отрисовки окна
+        self.root.after_idle(self._on_interactive)
+
+    def _on_interactive(self):
+        tti = time.perf_counter() - _STARTUP_T0
+        self.log(f"Time to interactive: {tti * 1000:.0f} ms", "INFO")
+        if self.on_ready:
+            self.on_ready(tti)
+
+    def _startup_probe_thread(self):
+        # UDP connect для адреса и импорт scapy (~1 с) идут фоном, окно их не ждет;
+        # поля TARGET/ROUTER заполняются, когда адрес известен
+        local_ip = _detect_local_ip()
+        self.gui_queue.put(("ADDRESSES", (local_ip, _detect_gateway(local_ip))))
+        started = time.perf_counter()
+        try:
+            iface = scapy_all().conf.iface
+        except Exception as e:
+            self.log(f"Scapy unavailable: {e}", "ALERT")
+            return
+        self.scapy_load_sec = time.perf_counter() - started
+        self.log(f"Scapy loaded in {self.scapy_load_sec:.2f}s, interface: {iface}", "INFO")
+
     # --- ТАБ 1: DASHBOARD ---
     def setup_dashboard(self):
         # Сетка
@@ -186,14 +601,37 @@ class PashchenkoCyberSuite:
 
         # Контролы
         tk.Label(left_panel, text="TARGET SETTINGS", fg="white", bg="#111", font=("Consolas", 12, "bold")).pack(pady=10)
-        self.entry_ip = self.create_input(left_panel, "TARGET IP:", _LOCAL_IP)
-        self.entry_router_ip = self.create_input(left_panel, "ROUTER IP:", _GATEWAY_IP)
+        # Адреса подставит _startup_probe_thread (событие ADDRESSES)
+        self.entry_ip = self.create_input(left_panel, "TARGET IP:", "")
+        self.entry_router_ip = self.create_input(left_panel, "ROUTER IP:", "")
+        self.entry_bpf = self.create_input(left_panel, "BPF FILTER (optional):", "")
+        self.entry_ifaces = self.create_input(left_panel, "INTERFACES (comma-separated, empty = default):", "")
+        self.entry_workers = self.create_input(left_panel, "PIPELINE WORKERS (0 = in-process):", "0")
+        self.entry_ring = self.create_input(left_panel, "PCAP RING (files x MB, rotate sec):", RING_SPEC_DEFAULT)
+        self.var_ring = tk.BooleanVar(value=True)
+        tk.Checkbutton(left_panel, text="Write capture ring to disk", variable=self.var_ring,
+                       bg="#111", fg="#888", selectcolor="#222", activebackground="#111").pack(anchor="w", padx=10)
+        self.var_discovery = tk.BooleanVar(value=True)
+        tk.Checkbutton(left_panel, text="Passive host discovery (ARP/DHCP/mDNS)", variable=self.var_discovery,
+                       bg="#111", fg="#888", selectcolor="#222", activebackground="#111").pack(anchor="w", padx=10)
+        self.var_rdns = tk.BooleanVar(value=True)
+        tk.Checkbutton(left_panel, text="Resolve peer names (PTR queries)", variable=self.var_rdns,
+                       bg="#111", fg="#888", selectcolor="#222", activebackground="#111").pack(anchor="w", padx=10)
 
         # Кнопки действий
         self.btn_sniff = tk.Button(left_panel, text="START SNIFFER", bg="#003300", fg="lime",
                                    command=self.toggle_sniffer, font=("Consolas", 10, "bold"), relief=tk.FLAT)
         self.btn_sniff.pack(fill=tk.X, padx=10, pady=5)
 
+        self.btn_replay = tk.Button(left_panel, text="REPLAY PCAP FILE", bg="#002233", fg="#66ccff",
+                                    command=self.toggle_replay, font=("Consolas", 10), relief=tk.FLAT)
+        self.btn_replay.pack(fill=tk.X, padx=10, pady=5)
+        self.var_realtime = tk.BooleanVar(value=False)
+        tk.Checkbutton(left_panel, text="Real-time replay speed", variable=self.var_realtime,
+                       bg="#111", fg="#888", selectcolor="#222", activebackground="#111").pack(anchor="w", padx=10)
+        self.replay_progress = ttk.Progressbar(left_panel, style="TProgressbar", maximum=1.0)
+        self.replay_progress.pack(fill=tk.X, padx=10, pady=(0, 5))
+
         tk.Button(left_panel, text="RESET ANALYTICS", bg="#332200", fg="#ffcc66",
                   command=self.reset_analytics, font=("Consolas", 10)).pack(fill=tk.X, padx=10, pady=5)
 
@@ -203,23 +641,33 @@ class PashchenkoCyberSuite:
         tk.Button(left_panel, text="GENERATE HTML REPORT", bg="#331100", fg="orange",
                   command=self.generate_report, font=("Consolas", 10)).pack(fill=tk.X, padx=10, pady=5)
 
-        # Live analytics panel (сверху — важнее)
-        self.analytics_view = scrolledtext.ScrolledText(
-            right_panel,
-            height=14,
-            bg="#080808",
-            fg="#88ff88",
-            font=("Consolas", 10),
-            insertbackground="white"
-        )
-        self.analytics_view.pack(fill=tk.X, padx=5, pady=5)
-        self.analytics_view.insert(
-            tk.END,
-            "=== TRAFFIC ANALYTICS ===\n"
-            "Start sniffer to begin collecting data.\n"
-            "Filters: TARGET IP + ROUTER IP.\n"
-        )
-        self.analytics_view.config(state=tk.DISABLED)
+        # Live analytics panel (сверху — важнее): фиксированные виджеты,
+        # каждый обновляется только если его текст/строка изменились
+        panel = tk.Frame(right_panel, bg="#080808")
+        panel.pack(fill=tk.X, padx=5, pady=5)
+        self._analytics_labels = {}
+        self._analytics_texts = {}
+        for key in ANALYTICS_LINES:
+            self._analytics_labels[key] = self._analytics_label(panel)
+        self._set_analytics_text("status", "=== TRAFFIC ANALYTICS ===  Start sniffer to begin collecting data.")
+        self._set_analytics_text("filter", "Filters: TARGET IP + ROUTER IP (+ BPF) compiled into a kernel filter.")
+
+        lists = tk.Frame(panel, bg="#080808")
+        lists.pack(fill=tk.X, pady=(5, 0))
+        peers_box = tk.Frame(lists, bg="#080808")
+        peers_box.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        dns_box = tk.Frame(lists, bg="#080808")
+        dns_box.pack(side=tk.LEFT, fill=tk.BOTH, padx=(5, 0))
+        self._analytics_labels["peers_title"] = self._analytics_label(peers_box)
+        self.peer_tree, self._peer_items = self._fixed_tree(peers_box, PEER_COLUMNS, TOP_PEERS)
+        self._peer_values = [None] * TOP_PEERS
+        self._analytics_labels["dns_title"] = self._analytics_label(dns_box)
+        self.dns_tree, self._dns_items = self._fixed_tree(dns_box, DNS_COLUMNS, TOP_DNS)
+        self._dns_values = [None] * TOP_DNS
+        self._analytics_labels["resolvers_title"] = self._analytics_label(dns_box)
+        self.resolver_tree, self._resolver_items = self._fixed_tree(dns_box, RESOLVER_COLUMNS, DNS_RESOLVER_ROWS)
+        self._resolver_values = [None] * DNS_RESOLVER_ROWS
+        self._render_ms = 0.0
 
         # Лог (Терминал)
         self.console = scrolledtext.ScrolledText(right_panel, bg="black", fg="#00FF00", font=("Consolas", 10),
@@ -229,67 +677,251 @@ class PashchenkoCyberSuite:
         self.console.tag_config("INFO", foreground="cyan")
         self.console.tag_config("DATA", foreground="#FFFF00")
 
+    @staticmethod
+    def _analytics_label(parent):
+        label = tk.Label(parent, text="", fg="#88ff88", bg="#080808", font=("Consolas", 10),
+                         anchor="w", justify=tk.LEFT)
+        label.pack(fill=tk.X)
+        return label
+
+    @staticmethod
+    def _fixed_tree(parent, columns, rows):
+        tree = ttk.Treeview(parent, columns=[c[0] for c in columns], show="headings", height=rows,
+                            selectmode="none")
+        for cid, title, width, anchor in columns:
+            tree.heading(cid, text=title)
+            tree.column(cid, width=width, anchor=anchor, stretch=cid == columns[0][0])
+        tree.pack(fill=tk.BOTH, expand=True)
+        return tree, [tree.insert("", tk.END, values=()) for _ in range(rows)]
+
+    def _set_analytics_text(self, key, text):
+        if self._analytics_texts.get(key) != text:
+            self._analytics_texts[key] = text
+            self._analytics_labels[key].config(text=text)
+
+    @staticmethod
+    def _update_fixed_rows(tree, items, cache, rows):
+        # Строки дерева не пересоздаются: меняются значения только изменившихся
+        for i, item in enumerate(items):
+            values = rows[i] if i < len(rows) else ()
+            if values != cache[i]:
+                cache[i] = values
+                tree.item(item, values=values)
+
     # --- ТАБ 2: NETWORK VISUALIZER (НОВОВВЕДЕНИЕ 1) ---
     def setup_visualizer(self):
         control_frame = tk.Frame(self.tab_map, bg="#111")
         control_frame.pack(fill=tk.X)
-        tk.Button(control_frame, text="SCAN & MAP NETWORK", bg="#004400", fg="white", command=self.run_map_scan).pack(
-            pady=5)
+        tk.Label(control_frame, text="SUBNETS (CIDR, comma-separated):", bg="#111", fg="#888").pack(
+            side=tk.LEFT, padx=(10, 5))
+        self.entry_subnets = tk.Entry(control_frame, bg="#222", fg="white", insertbackground="white", width=40)
+        self.entry_subnets.pack(side=tk.LEFT)
+        tk.Label(control_frame, text="RATE pps:", bg="#111", fg="#888").pack(side=tk.LEFT, padx=(10, 5))
+        self.entry_scan_rate = tk.Entry(control_frame, bg="#222", fg="white", insertbackground="white", width=7)
+        self.entry_scan_rate.insert(0, str(ARP_SWEEP_RATE_PPS))
+        self.entry_scan_rate.pack(side=tk.LEFT)
+        tk.Label(control_frame, text="WINDOW:", bg="#111", fg="#888").pack(side=tk.LEFT, padx=(10, 5))
+        self.entry_scan_window = tk.Entry(control_frame, bg="#222", fg="white", insertbackground="white", width=6)
+        self.entry_scan_window.insert(0, str(ARP_SWEEP_WINDOW))
+        self.entry_scan_window.pack(side=tk.LEFT)
+        self.btn_scan = tk.Button(control_frame, text="SCAN & MAP NETWORK", bg="#004400", fg="white",
+                                  command=self.run_map_scan)
+        self.btn_scan.pack(side=tk.LEFT, padx=10, pady=5)
+        self._scan_stop = None
 
         self.map_canvas = tk.Canvas(self.tab_map, bg="#050505", highlightthickness=0)
         self.map_canvas.pack(fill=tk.BOTH, expand=True)
         # Легенда
         self.map_canvas.create_text(100, 20, text="ROUTER (GATEWAY)", fill="red", font=("Consolas", 10))
         self.map_canvas.create_text(100, 40, text="DEVICE (NODE)", fill="#00FF00", font=("Consolas", 10))
+        self.map_canvas.create_text(100, 60, text="NOT ANSWERING", fill="#335533", font=("Consolas", 10))
+
+        # Карта обновляется по разнице: элементы узлов живут между сканами,
+        # позиции считает MapLayoutWorker в фоне
+        self._map_nodes = {}  # mac -> {"ip", "name", "vendor", "missed", "items": (oval, line, ip, mac), "xy"}
+        self._map_item_mac = {}  # id овала -> mac (для подсказки)
+        self._map_pos = {}  # mac -> (x, y) в [-1, 1]
+        self._map_lod = 0
+        self._map_center = None
+        self.map_layout = MapLayoutWorker(lambda pos: self.gui_queue.put(("MAP_LAYOUT", pos)))
+        self.map_canvas.tag_bind("map_node", "<Enter>", self._map_hover)
+        self.map_canvas.tag_bind("map_node", "<Leave>", lambda e: self.map_canvas.delete("map_hover"))
+        self.map_canvas.bind("<Configure>", lambda e: self._place_map_nodes(force=True))
+
+    def _default_subnet(self):
+        parts = self.entry_router_ip.get().strip().rsplit('.', 1)
+        return f"{parts[0]}.0/24" if len(parts) == 2 else "192.168.1.0/24"
 
     def run_map_scan(self):
-        self.log("Starting ARP Scan for Map...", "INFO")
-        threading.Thread(target=self._scan_thread, daemon=True).start()
-
-    def _scan_thread(self):
+        if self._scan_stop is not None:
+            self._scan_stop.set()
+            return
+        try:
+            targets = parse_sweep_targets(self.entry_subnets.get() or self._default_subnet())
+            rate = int(self.entry_scan_rate.get())
+            window = int(self.entry_scan_window.get())
+        except ValueError as e:
+            self.log(f"Scan Error: {e}", "ALERT")
+            return
+        self._scan_stop = threading.Event()
+        self.btn_scan.config(text="STOP SCAN", bg="red")
+        self.log(f"Starting ARP sweep of {len(targets)} hosts ({rate} pps, window {window})...", "INFO")
+        threading.Thread(target=self._scan_thread, args=(targets, rate, window, self._scan_stop),
+                         daemon=True).start()
+
+    def _scan_thread(self, targets, rate, window, stop):
+        sock = None
+        nodes = []
+        complete = False
         try:
-            router_ip = self.entry_router_ip.get().strip()
-            parts = router_ip.rsplit('.', 1)
-            gw = f"{parts[0]}.0/24" if len(parts) == 2 else "192.168.1.0/24"
-            self.gui_queue.put(("LOG", (f"Scanning subnet: {gw}", "INFO")))
-            ans, _ = srp(Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=gw), timeout=2, verbose=False)
-            nodes = []
-            for _, rcv in ans:
-                nodes.append({"ip": rcv.psrc, "mac": rcv.hwsrc})
-
-            self.gui_queue.put(("DRAW_MAP", nodes))
+            scapy = scapy_all()
+            conf = scapy.conf
+            local_ip = self.local_ip or _detect_local_ip()
+            sweeper = ArpSweeper(targets, local_ip, scapy.get_if_hwaddr(conf.iface), rate, window)
+            try:
+                sock = conf.L2socket(filter=ARP_REPLY_BPF)
+            except Exception:
+                sock = conf.L2socket()  # ответы все равно отбираются parse_reply
+            next_draw = 0.0
+
+            def on_reply(ip, mac):
+                nonlocal next_draw
+                nodes.append({"ip": ip, "mac": mac})
+                now = time.monotonic()
+                if now >= next_draw:
+                    # Промежуточная карта, пока идет опрос
+                    next_draw = now + ARP_SWEEP_PUBLISH_SEC
+                    self.gui_queue.put(("DRAW_MAP", list(nodes)))
+
+            started = time.monotonic()
+            sweeper.run(sock, on_reply, stop)
+            complete = not stop.is_set()
+            self.gui_queue.put(("LOG", (
+                f"ARP sweep {'stopped' if stop.is_set() else 'done'}: {len(nodes)}/{len(targets)} hosts answered, "
+                f"{sweeper.sent} requests in {sweeper.rounds} passes, {time.monotonic() - started:.1f}s", "INFO")))
         except Exception as e:
             self.gui_queue.put(("LOG", (f"Scan Error: {e}", "ALERT")))
+        finally:
+            if sock is not None:
+                sock.close()
+            # Полный проход: не ответившие узлы гаснут; при остановке/ошибке — нет
+            self.gui_queue.put(("SCAN_DONE", (nodes, complete)))
+
+    def draw_network_map(self, nodes, final=False):
+        # nodes — ответившие узлы; final — скан завершен, остальные считаются молчащими
+        canvas = self.map_canvas
+        changed = False
+        seen = set()
+        for node in nodes:
+            mac = node["mac"]
+            seen.add(mac)
+            entry = self._map_nodes.get(mac)
+            name = node.get("name") or (entry and entry["name"])
+            if entry is None:
+                self._add_map_node(mac, node["ip"], name, node.get("vendor"))
+                changed = True
+                continue
+            if entry["ip"] != node["ip"] or entry["name"] != name:
+                entry["ip"] = node["ip"]
+                entry["name"] = name
+                canvas.itemconfig(entry["items"][2], text=self._map_label(node["ip"], name))
+            if entry["missed"]:
+                entry["missed"] = 0
+                canvas.itemconfig(entry["items"][0], fill="#00FF00")
+        if final:
+            for mac, entry in list(self._map_nodes.items()):
+                if mac in seen:
+                    continue
+                entry["missed"] += 1
+                if entry["missed"] >= MAP_FADE_SCANS:
+                    for item in entry["items"]:
+                        canvas.delete(item)
+                    del self._map_item_mac[entry["items"][0]]
+                    del self._map_nodes[mac]
+                    changed = True
+                else:
+                    canvas.itemconfig(entry["items"][0], fill="#335533")
+        if changed:
+            self._update_map_lod()
+            self.map_layout.submit(self._map_nodes)
 
-    def draw_network_map(self, nodes):
-        self.map_canvas.delete("node")
-        w = self.map_canvas.winfo_width()
-        h = self.map_canvas.winfo_height()
+    @staticmethod
+    def _map_label(ip, name):
+        return f"{name} ({ip})" if name else ip
+
+    def _add_map_node(self, mac, ip, name=None, vendor=None):
+        canvas = self.map_canvas
+        cx, cy = self._map_center or (canvas.winfo_width() / 2, canvas.winfo_height() / 2)
+        r = MAP_NODE_RADIUS[self._map_lod]
+        ip_state = tk.NORMAL if self._map_lod < 2 else tk.HIDDEN
+        mac_state = tk.NORMAL if self._map_lod < 1 else tk.HIDDEN
+        # Новый узел появляется у шлюза, позицию пришлет раскладка
+        line = canvas.create_line(cx, cy, cx, cy, fill="#333", dash=(2, 2), tags="node")
+        canvas.tag_lower(line)
+        oval = canvas.create_oval(cx - r, cy - r, cx + r, cy + r, fill="#00FF00", outline="black",
+                                  tags=("node", "map_node"))
+        ip_label = canvas.create_text(cx, cy + r + 10, text=self._map_label(ip, name), fill="#00FF00",
+                                      font=("Consolas", 9),
+                                      tags=("node", "map_ip"), state=ip_state)
+        mac_label = canvas.create_text(cx, cy + r + 23, text=mac, fill="#666", font=("Consolas", 7),
+                                       tags=("node", "map_mac"), state=mac_state)
+        self._map_nodes[mac] = {"ip": ip, "name": name, "vendor": vendor or lookup_vendor(mac), "missed": 0,
+                                "items": (oval, line, ip_label, mac_label), "xy": None}
+        self._map_item_mac[oval] = mac
+
+    def _update_map_lod(self):
+        # Уровень детализации подписей по числу узлов
+        count = len(self._map_nodes)
+        lod = 0 if count <= MAP_LABELS_FULL else 1 if count <= MAP_LABELS_IP else 2
+        if lod == self._map_lod:
+            return
+        self._map_lod = lod
+        self.map_canvas.itemconfig("map_ip", state=tk.NORMAL if lod < 2 else tk.HIDDEN)
+        self.map_canvas.itemconfig("map_mac", state=tk.NORMAL if lod < 1 else tk.HIDDEN)
+        self._place_map_nodes(force=True)
+
+    def _map_hover(self, event):
+        items = self.map_canvas.find_withtag("current")
+        mac = self._map_item_mac.get(items[0]) if items else None
+        if mac is None:
+            return
+        entry = self._map_nodes[mac]
+        text = "  ".join(filter(None, (self._map_label(entry["ip"], entry["name"]), mac, entry["vendor"])))
+        self.map_canvas.delete("map_hover")
+        self.map_canvas.create_text(event.x + 12, event.y - 12, text=text,
+                                    fill="white", anchor="sw", font=("Consolas", 9), tags="map_hover")
+
+    def _place_map_nodes(self, force=False):
+        canvas = self.map_canvas
+        w, h = canvas.winfo_width(), canvas.winfo_height()
         cx, cy = w / 2, h / 2
-
-        # Рисуем роутер
-        self.map_canvas.create_oval(cx - 20, cy - 20, cx + 20, cy + 20, fill="red", outline="white", width=2,
-                                    tags="node")
-        self.map_canvas.create_text(cx, cy + 35, text="GATEWAY", fill="white", font=("Consolas", 8), tags="node")
-
-        # Рисуем узлы по кругу
-        count = len(nodes)
-        if count == 0: return
-        radius = min(w, h) / 3
-        angle_step = 360 / count
-
-        for i, node in enumerate(nodes):
-            angle = math.radians(i * angle_step)
-            nx = cx + radius * math.cos(angle)
-            ny = cy + radius * math.sin(angle)
-
-            # Линия связи
-            self.map_canvas.create_line(cx, cy, nx, ny, fill="#333", dash=(2, 2), tags="node")
-            # Узел
-            self.map_canvas.create_oval(nx - 15, ny - 15, nx + 15, ny + 15, fill="#00FF00", outline="black",
-                                        tags="node")
-            self.map_canvas.create_text(nx, ny + 25, text=node['ip'], fill="#00FF00", font=("Consolas", 9), tags="node")
-            self.map_canvas.create_text(nx, ny + 38, text=node['mac'], fill="#666", font=("Consolas", 7), tags="node")
+        if force or self._map_center != (cx, cy):
+            self._map_center = (cx, cy)
+            canvas.delete("gateway")
+            canvas.create_oval(cx - 20, cy - 20, cx + 20, cy + 20, fill="red", outline="white", width=2,
+                               tags=("node", "gateway"))
+            canvas.create_text(cx, cy + 35, text="GATEWAY", fill="white", font=("Consolas", 8),
+                               tags=("node", "gateway"))
+            force = True
+        pos = self._map_pos
+        scale = (min(w, h) / 2 - 40) / max([math.hypot(*p) for p in pos.values()] + [1e-9])
+        r = MAP_NODE_RADIUS[self._map_lod]
+        for mac, entry in self._map_nodes.items():
+            p = pos.get(mac)
+            if p is None:
+                continue
+            x, y = cx + p[0] * scale, cy + p[1] * scale
+            old = entry["xy"]
+            # Двигаем только узлы, сместившиеся заметно
+            if (not force and old is not None
+                    and abs(old[0] - x) < MAP_MOVE_EPS_PX and abs(old[1] - y) < MAP_MOVE_EPS_PX):
+                continue
+            entry["xy"] = (x, y)
+            oval, line, ip_label, mac_label = entry["items"]
+            canvas.coords(oval, x - r, y - r, x + r, y + r)
+            canvas.coords(line, cx, cy, x, y)
+            canvas.coords(ip_label, x, y + r + 10)
+            canvas.coords(mac_label, x, y + r + 23)
 
     # --- ТАБ 3: STRESS TEST (НОВОВВЕДЕНИЕ 2) ---
     def setup_attack_module(self):
@@ -319,10 +951,11 @@ class PashchenkoCyberSuite:
 
     def _flood_thread(self, target_ip):
         # Оптимизация: Предварительное создание пакета
-        packet = IP(dst=target_ip) / TCP(dport=80, flags="S")
+        scapy = scapy_all()
+        packet = scapy.IP(dst=target_ip) / scapy.TCP(dport=80, flags="S")
         try:
             while self.is_flooding:
-                send(packet, verbose=0)
+                scapy.send(packet, verbose=0)
                 # Имитация нагрузки, но с задержкой, чтобы не положить свой же интерфейс
                 time.sleep(0.01)
         except Exception as e:
@@ -330,21 +963,268 @@ class PashchenkoCyberSuite:
 
     # --- ТАБ 4: PACKET INSPECTOR (НОВОВВЕДЕНИЕ 4) ---
     def setup_inspector(self):
+        top = tk.Frame(self.tab_inspector, bg="#111")
+        top.pack(fill=tk.X)
+        tk.Label(top, text="FILTER:", bg="#111", fg="#888").pack(side=tk.LEFT, padx=(10, 5), pady=5)
+        self.entry_pkt_filter = tk.Entry(top, bg="#222", fg="white", insertbackground="white")
+        self.entry_pkt_filter.pack(side=tk.LEFT, fill=tk.X, expand=True, pady=5)
+        self.entry_pkt_filter.bind("<Return>", lambda e: self.apply_packet_filter())
+        tk.Button(top, text="APPLY", command=self.apply_packet_filter, bg="#222", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(top, text="CLEAR", command=self.clear_packet_filter, bg="#222", fg="white").pack(side=tk.LEFT, padx=(0, 10))
+        self.pkt_status = tk.Label(self.tab_inspector, text="No packets captured yet.", fg="#88ff88", bg="#111",
+                                   font=("Consolas", 10), anchor="w")
+        self.pkt_status.pack(fill=tk.X, padx=10)
+
+        # Виртуальный список: PKT_VIEW_ROWS строк на любое число пакетов
+        body = tk.Frame(self.tab_inspector, bg="black")
+        body.pack(fill=tk.X)
+        self.pkt_tree = ttk.Treeview(body, columns=[c[0] for c in PKT_COLUMNS], show="headings",
+                                     height=PKT_VIEW_ROWS, selectmode="browse")
+        for cid, title, width, anchor in PKT_COLUMNS:
+            self.pkt_tree.heading(cid, text=title)
+            self.pkt_tree.column(cid, width=width, anchor=anchor, stretch=cid in ("src", "dst"))
+        self.pkt_scroll = tk.Scrollbar(body, orient=tk.VERTICAL, command=self._scroll_packets)
+        self.pkt_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.pkt_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.pkt_tree.bind("<MouseWheel>", lambda e: self._scroll_packets("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.pkt_tree.bind("<Button-4>", lambda e: self._scroll_packets("scroll", -1, "units"))
+        self.pkt_tree.bind("<Button-5>", lambda e: self._scroll_packets("scroll", 1, "units"))
+        self.pkt_tree.bind("<<TreeviewSelect>>", lambda e: self._show_selected_packet())
+        self._pkt_items = [self.pkt_tree.insert("", tk.END, values=()) for _ in range(PKT_VIEW_ROWS)]
+        self._pkt_item_values = [None] * PKT_VIEW_ROWS
+        self._pkt_item_seqs = [None] * PKT_VIEW_ROWS
+        self.pkt_source = None
+        self.pkt_filter = None
+        self.pkt_matches = None  # array номеров под фильтром; None — все пакеты
+        self.pkt_offset = 0
+        self.pkt_follow = True  # держаться конца списка, пока пользователь не прокрутил
+
         self.hex_view = scrolledtext.ScrolledText(self.tab_inspector, bg="#050505", fg="#00FF00", font=("Courier", 10))
         self.hex_view.pack(fill=tk.BOTH, expand=True)
         tk.Button(self.tab_inspector, text="REFRESH HEX DUMP (LAST PACKET)", command=self.show_last_packet_hex,
                   bg="#222", fg="white").pack(fill=tk.X)
 
+    def apply_packet_filter(self):
+        text = self.entry_pkt_filter.get().strip()
+        if not text:
+            self.clear_packet_filter()
+            return
+        try:
+            flt = PacketFilter(text)
+        except ValueError as e:
+            self.pkt_status.config(text=f"Filter error: {e}")
+            return
+        store = self.engine.packet_store()
+        self.pkt_status.config(text=f"Searching index for '{text}'...")
+        threading.Thread(target=self._packet_query_thread, args=(store, flt), daemon=True).start()
+
+    def _packet_query_thread(self, store, flt):
+        start = time.perf_counter()
+        matches = store.query(flt)
+        self.gui_queue.put(("PKT_QUERY", (store, flt, matches, (time.perf_counter() - start) * 1000)))
+
+    def _on_packet_query(self, store, flt, matches, elapsed_ms):
+        self.pkt_source = store
+        self.pkt_filter = flt
+        self.pkt_matches = matches
+        self.pkt_offset = 0
+        self.pkt_follow = False
+        self._pkt_query_ms = elapsed_ms
+        self._refresh_packets()
+
+    def clear_packet_filter(self):
+        self.pkt_filter = None
+        self.pkt_matches = None
+        self.pkt_follow = True
+        self._refresh_packets()
+
+    def _scroll_packets(self, *args):
+        total = self._packet_total()
+        offset = self.pkt_offset
+        if args[0] == "moveto":
+            offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = PKT_VIEW_ROWS if args[2] == "pages" else PKT_SCROLL_UNITS
+            offset += int(args[1]) * step
+        self.pkt_offset = min(max(0, offset), max(0, total - PKT_VIEW_ROWS))
+        self.pkt_follow = self.pkt_offset >= total - PKT_VIEW_ROWS
+        self._render_packet_window()
+
+    def _packet_total(self):
+        if self.pkt_matches is not None:
+            return len(self.pkt_matches)
+        return self.pkt_source.span()[1] if self.pkt_source is not None else 0
+
+    def _refresh_packets(self):
+        if self.pkt_matches is None:
+            # Без фильтра список следует за кольцом (или снимком памяти)
+            self.pkt_source = self.engine.packet_store()
+        total = self._packet_total()
+        if self.pkt_follow:
+            self.pkt_offset = max(0, total - PKT_VIEW_ROWS)
+        self.pkt_offset = min(self.pkt_offset, max(0, total - PKT_VIEW_ROWS))
+        self._render_packet_window()
+
+    def _render_packet_window(self):
+        store = self.pkt_source
+        if store is None:
+            return
+        start = self.pkt_offset
+        if self.pkt_matches is not None:
+            seqs = list(self.pkt_matches[start:start + PKT_VIEW_ROWS])
+            total = len(self.pkt_matches)
+        else:
+            first, total = store.span()
+            seqs = list(range(first + start, first + min(total, start + PKT_VIEW_ROWS)))
+        visible = []
+        for i, row in enumerate(store.rows(seqs)):
+            if row is None:
+                visible.append((seqs[i], "", "(evicted from ring)", "", "", "", "", ""))
+                continue
+            seq, ts, src, dst, proto, sport, dport, length = row
+            visible.append((seq, datetime.fromtimestamp(ts).strftime("%H:%M:%S.%f")[:-3], src, dst, proto,
+                            sport or "", dport or "", length))
+        self._pkt_item_seqs = seqs + [None] * (PKT_VIEW_ROWS - len(seqs))
+        self._update_fixed_rows(self.pkt_tree, self._pkt_items, self._pkt_item_values, visible)
+        if total:
+            self.pkt_scroll.set(start / total, min(1.0, (start + PKT_VIEW_ROWS) / total))
+        else:
+            self.pkt_scroll.set(0, 1)
+
+        if self.pkt_matches is not None:
+            status = (f"{total:,} of {store.span()[1]:,} packets match '{self.pkt_filter.text}'"
+                      f"  (index query {self._pkt_query_ms:.0f} ms)")
+        elif total:
+            status = f"{total:,} packets indexed" + ("" if self.engine.pcap_ring is not None else " (in memory)")
+        else:
+            status = "No packets captured yet."
+        self.pkt_status.config(text=status)
+
+    def _show_selected_packet(self):
+        selection = self.pkt_tree.selection()
+        if not selection or selection[0] not in self._pkt_items:
+            return
+        seq = self._pkt_item_seqs[self._pkt_items.index(selection[0])]
+        stored = self.pkt_source.read(seq) if seq is not None and self.pkt_source is not None else None
+        self._show_hex(stored[1] if stored else None)
+
     def show_last_packet_hex(self):
+        frame = None
+        if self.engine.captured_packets:
+            item = self.engine.captured_packets[-1]
+            if isinstance(item, int):
+                stored = self.engine.pcap_ring.read(item) if self.engine.pcap_ring else None
+                frame = stored[1] if stored else None
+            else:
+                frame = item.frame
+        self._show_hex(frame)
+
+    def _show_hex(self, frame):
         self.hex_view.delete(1.0, tk.END)
-        if self.captured_packets:
-            pkt = self.captured_packets[-1]
-            dump = hexdump(pkt, dump=True)
+        if frame is not None:
+            # Полный разбор scapy только здесь, а не в цикле захвата
+            scapy = scapy_all()
+            pkt = scapy.Ether(frame)
+            dump = scapy.hexdump(pkt, dump=True)
             self.hex_view.insert(tk.END, f"Packet Summary: {pkt.summary()}\n\n")
             self.hex_view.insert(tk.END, dump)
         else:
             self.hex_view.insert(tk.END, "No packets captured yet.")
 
+    # --- ТАБ 5: FLOWS ---
+    def setup_flows(self):
+        top = tk.Frame(self.tab_flows, bg="#111")
+        top.pack(fill=tk.X)
+        self.flow_status = tk.Label(top, text="No flows yet. Start the sniffer or replay a capture.",
+                                    fg="#88ff88", bg="#111", font=("Consolas", 10), anchor="w")
+        self.flow_status.pack(fill=tk.X, padx=10, pady=5)
+
+        body = tk.Frame(self.tab_flows, bg="black")
+        body.pack(fill=tk.BOTH, expand=True)
+        ids = [cid for cid, _, _, _ in FLOW_COLUMNS]
+        self.flow_tree = ttk.Treeview(body, columns=ids, show="headings", height=FLOW_VIEW_ROWS,
+                                      selectmode="browse")
+        for i, (cid, title, width, anchor) in enumerate(FLOW_COLUMNS):
+            self.flow_tree.heading(cid, text=title, command=lambda i=i: self._sort_flows(i))
+            self.flow_tree.column(cid, width=width, anchor=anchor, stretch=cid in ("client", "server"))
+        # Виртуальная прокрутка: в дереве всегда FLOW_VIEW_ROWS строк,
+        # при прокрутке меняются только их значения
+        self.flow_scroll = tk.Scrollbar(body, orient=tk.VERTICAL, command=self._scroll_flows)
+        self.flow_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.flow_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.flow_tree.bind("<MouseWheel>", lambda e: self._scroll_flows("scroll", -1 if e.delta > 0 else 1, "units"))
+        self.flow_tree.bind("<Button-4>", lambda e: self._scroll_flows("scroll", -1, "units"))
+        self.flow_tree.bind("<Button-5>", lambda e: self._scroll_flows("scroll", 1, "units"))
+        self._flow_items = [self.flow_tree.insert("", tk.END, values=()) for _ in range(FLOW_VIEW_ROWS)]
+        self._flow_item_values = [None] * FLOW_VIEW_ROWS
+        self.flow_rows = []
+        self.flow_offset = 0
+        self.flow_sort = (9, True)  # Total bytes, по убыванию
+        self.flow_sorter = FlowSortWorker(lambda result: self.gui_queue.put(("FLOWS_SORTED", result)))
+        self._flows_seen = -1
+
+    def _sort_flows(self, column):
+        col, reverse = self.flow_sort
+        self.flow_sort = (column, not reverse if column == col else True)
+        self._flows_seen = -1
+        self._refresh_flows()
+
+    def _scroll_flows(self, *args):
+        total = len(self.flow_rows)
+        offset = self.flow_offset
+        if args[0] == "moveto":
+            offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = FLOW_VIEW_ROWS if args[2] == "pages" else FLOW_SCROLL_UNITS
+            offset += int(args[1]) * step
+        self.flow_offset = min(max(0, offset), max(0, total - FLOW_VIEW_ROWS))
+        self._render_flow_window()
+
+    def _refresh_flows(self):
+        # Сортировка до 200k строк — в FlowSortWorker; результат придет событием FLOWS_SORTED
+        a = self.engine.analytics
+        if a["flows_version"] != self._flows_seen:
+            self._flows_seen = a["flows_version"]
+            rows = list(chain.from_iterable(table.values() for table in a["flows"].values()))
+            self.flow_sorter.submit(rows, *self.flow_sort)
+        self._render_flow_window()
+
+    def _flows_sorted(self, column, reverse, rows):
+        if (column, reverse) != self.flow_sort:
+            return  # порядок уже сменили, придет следующий результат
+        self.flow_rows = rows
+        self.flow_offset = min(self.flow_offset, max(0, len(rows) - FLOW_VIEW_ROWS))
+        self._render_flow_window()
+
+    def _render_flow_window(self):
+        rows = self.flow_rows
+        total = len(rows)
+        now = self.engine.now()
+        start = self.flow_offset
+        visible = [self._format_flow_row(row, now) for row in rows[start:start + FLOW_VIEW_ROWS]]
+        self._update_fixed_rows(self.flow_tree, self._flow_items, self._flow_item_values, visible)
+        if total:
+            self.flow_scroll.set(start / total, min(1.0, (start + FLOW_VIEW_ROWS) / total))
+        else:
+            self.flow_scroll.set(0, 1)
+
+        stats = self.engine.analytics["flow_stats"].values()
+        idle = sum(s[1] for s in stats)
+        full = sum(s[2] for s in stats)
+        col, reverse = self.flow_sort
+        order = "desc" if reverse else "asc"
+        shown = f"{start + 1}-{min(start + FLOW_VIEW_ROWS, total)}" if total else "0"
+        self.flow_status.config(
+            text=f"Active flows: {total:,}   showing {shown}   sorted by {FLOW_COLUMNS[col][1]} ({order})"
+                 f"   evicted idle: {idle:,}   evicted (table full): {full:,}"
+        )
+
+    def _format_flow_row(self, row, now):
+        client, server, proto, state, c_pkts, c_bytes, s_pkts, s_bytes, total, rtt, first, last, app = row
+        return (client, server, proto, app, state, c_pkts, self._fmt_bytes(c_bytes), s_pkts,
+                self._fmt_bytes(s_bytes), self._fmt_bytes(total), f"{rtt:.1f}" if rtt >= 0 else "-",
+                self._fmt_duration(last - first), self._fmt_duration(max(0, now - last)))
+
     # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ И ОЧЕРЕДИ ---
     def create_input(self, parent, label, default):
         tk.Label(parent, text=label, bg="#111", fg="#888").pack(anchor="w", padx=10)
@@ -362,74 +1242,134 @@ class PashchenkoCyberSuite:
             self.console.delete('1.0', f'{line_count - MAX_CONSOLE_LINES}.0')
 
     def process_queue(self):
+        start = time.perf_counter()
         try:
-            for _ in range(50):
-                task = self.gui_queue.get_nowait()
-                msg_type = task[0]
-                data = task[1]
-
+            batch, dropped = self.gui_queue.drain(self._drain_budget)
+            timestamp = datetime.now().strftime("[%H:%M:%S]")
+            console_args = []
+            if dropped:
+                counts = ", ".join(f"{n} {label}" for label, n in sorted(dropped.items()))
+                console_args += [f"{timestamp} ... {counts} events dropped (GUI queue full)\n", "ALERT"]
+
+            for msg_type, data in batch:
                 if msg_type == "LOG":
                     text, tag = data
-                    timestamp = datetime.now().strftime("[%H:%M:%S]")
-                    self.console.insert(tk.END, f"{timestamp} {text}\n", tag)
-                    self.console.see(tk.END)
+                    console_args += [f"{timestamp} {text}\n", tag]
+
+                elif msg_type == "PROGRESS":
+                    self.replay_progress.config(value=data)
+
+                elif msg_type == "ADDRESSES":
+                    self._fill_addresses(*data)
+
+                elif msg_type == "REPLAY_DONE":
+                    self.btn_replay.config(text="REPLAY PCAP FILE", bg="#002233")
 
                 elif msg_type == "DRAW_MAP":
                     self.draw_network_map(data)
-                    self.log(f"Map updated. Found {len(data)} nodes.", "INFO")
 
-        except queue.Empty:
-            pass
+                elif msg_type == "MAP_LAYOUT":
+                    self._map_pos = data
+                    self._place_map_nodes()
+
+                elif msg_type == "FLOWS_SORTED":
+                    self._flows_sorted(*data)
+
+                elif msg_type == "PKT_QUERY":
+                    self._on_packet_query(*data)
+
+                elif msg_type == "SCAN_DONE":
+                    self.draw_network_map(data[0], final=data[1])
+                    self._scan_stop = None
+                    self.btn_scan.config(text="SCAN & MAP NETWORK", bg="#004400")
+
+            # Одна вставка, одна прокрутка и одна обрезка на тик
+            if console_args:
+                self.console.insert(tk.END, *console_args)
+                self._trim_console()
+                self.console.see(tk.END)
         finally:
-            self._trim_console()
-            self.root.after(100, self.process_queue)
+            self._adapt_drain_budget((time.perf_counter() - start) * 1000)
+            self.root.after(GUI_TICK_MS, self.process_queue)
+
+    def _fill_addresses(self, local_ip, gateway_ip):
+        self.local_ip = local_ip
+        # Не затираем то, что пользователь успел ввести сам
+        for entry, value in ((self.entry_ip, local_ip), (self.entry_router_ip, gateway_ip),
+                             (self.entry_subnets, None)):
+            if not entry.get().strip():
+                entry.insert(0, value or self._default_subnet())
+
+    def _adapt_drain_budget(self, elapsed_ms):
+        # AIMD по длительности тика: укладываемся в бюджет кадра
+        if elapsed_ms > GUI_FRAME_BUDGET_MS:
+            self._drain_budget = max(GUI_DRAIN_MIN, self._drain_budget // 2)
+        elif elapsed_ms < GUI_FRAME_BUDGET_MS / 2 and self.gui_queue.qsize() > self._drain_budget:
+            self._drain_budget = min(GUI_DRAIN_MAX, self._drain_budget + GUI_DRAIN_MIN * 5)
 
     # --- ФУНКЦИОНАЛ (SNIFFER, GEOIP, REPORT) ---
     def toggle_sniffer(self):
-        if not self.is_sniffing:
-            self.is_sniffing = True
+        if not self.engine.is_sniffing:
+            if self.engine.is_replaying:
+                self.log("Replay in progress; stop it before sniffing live.", "ALERT")
+                return
+            self.engine.start_sniffer(
+                self.entry_ip.get().strip(), self.entry_router_ip.get().strip(), self.entry_bpf.get().strip(),
+                self._pipeline_workers(), self.entry_ring.get() if self.var_ring.get() else None,
+                self.var_discovery.get(), self._capture_ifaces())
             self.btn_sniff.config(text="STOP SNIFFER", bg="red")
-            threading.Thread(target=self._sniffer_thread, daemon=True).start()
         else:
-            self.is_sniffing = False
+            self.engine.stop_sniffer()
             self.btn_sniff.config(text="START SNIFFER", bg="#003300")
 
-    def _sniffer_thread(self):
-        self.log("Sniffer started...", "INFO")
-        target_ip = self.entry_ip.get().strip()
-        router_ip = self.entry_router_ip.get().strip()
-        self.log(f"Analytics filter: TARGET={target_ip} ROUTER={router_ip}", "INFO")
-
-        with self.analytics_lock:
-            self._sniff_start_time = time.time()
-
-        def handler(pkt):
-            if not self.is_sniffing:
-                return
-            self.captured_packets.append(pkt)
-            if IP in pkt:
-                relevant = self._collect_analytics(pkt, target_ip, router_ip)
-                if relevant:
-                    with self.analytics_lock:
-                        packet_count = self.analytics["total_packets"]
-                    if packet_count % 20 == 0:
-                        msg = f"{pkt[IP].src} -> {pkt[IP].dst} : {pkt.summary()}"
-                        self.gui_queue.put(("LOG", (msg, "DATA")))
+    def _capture_ifaces(self):
+        # "eth0, eth1" -> ["eth0", "eth1"]; повторы убираются, порядок сохраняется
+        return list(dict.fromkeys(name.strip() for name in self.entry_ifaces.get().split(",") if name.strip()))
 
+    def _pipeline_workers(self):
         try:
-            sniff(prn=handler, store=False, stop_filter=lambda x: not self.is_sniffing)
-        except Exception as e:
-            self.gui_queue.put(("LOG", (f"Sniffer error: {e}. Try running as Administrator.", "ALERT")))
-        self.log("Sniffer stopped.", "INFO")
+            return max(0, int(self.entry_workers.get().strip() or 0))
+        except ValueError:
+            self.log("PIPELINE WORKERS must be a number; using in-process capture.", "ALERT")
+            return 0
+
+    def toggle_replay(self):
+        if self.engine.is_replaying:
+            self.engine.stop_replay()
+            return
+        if self.engine.is_sniffing:
+            self.log("Stop the live sniffer before replaying a capture.", "ALERT")
+            return
+        path = filedialog.askopenfilename(
+            title="Open capture",
+            filetypes=[("Capture files", "*.pcap *.pcapng *.cap"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        if self.entry_bpf.get().strip():
+            self.log("BPF expression is ignored in replay; TARGET/ROUTER filter still applies.", "INFO")
+        self.engine.start_replay(path, self.entry_ip.get().strip(), self.entry_router_ip.get().strip(),
+                                 self.var_realtime.get())
+        self.btn_replay.config(text="STOP REPLAY", bg="red")
 
     def run_geoip(self):  # НОВОВВЕДЕНИЕ 3
-        target = self.entry_ip.get()
+        target = self.entry_ip.get().strip()
         self.log(f"Locating {target}...", "INFO")
+        if self.engine.geoip.loaded or self.engine.geoip.lookup(target) != GEO_UNKNOWN:
+            country, city, asn, org = self.engine.geoip.lookup(target)
+            if (country, city, asn, org) == GEO_UNKNOWN:
+                self.log(f"GeoIP: {target} not found in local database", "ALERT")
+            else:
+                info = f"Country: {country or '-'}\nCity: {city or '-'}\nASN: {asn or '-'}\nOrg: {org or '-'}"
+                self.log(f"\n[GEOIP RESULT]\n{info}\n", "INFO")
+            return
+        # Локальной базы нет: разовый онлайн-запрос с таймаутом
+        self.log(f"No offline GeoIP database in ./{GEOIP_DIR} (CSV/TSV ranges or .mmdb); querying ip-api.com.", "INFO")
 
         def _geo_thread():
             try:
                 if requests:
-                    response = requests.get(f"http://ip-api.com/json/{target}").json()
+                    response = requests.get(f"http://ip-api.com/json/{target}", timeout=GEOIP_ONLINE_TIMEOUT_SEC).json()
                     if response['status'] == 'success':
                         info = f"Country: {response['country']}\nCity: {response['city']}\nISP: {response['isp']}"
                         self.gui_queue.put(("LOG", (f"\n[GEOIP RESULT]\n{info}\n", "INFO")))
@@ -443,64 +1383,100 @@ class PashchenkoCyberSuite:
         threading.Thread(target=_geo_thread, daemon=True).start()
 
     def generate_report(self):  # НОВОВВЕДЕНИЕ 5
-        filename = f"report_{int(time.time())}.html"
-        analytics = self._snapshot_analytics()
-        top_peers_html = "".join(
-            f"<li>{ip}: packets={row['packets']}, bytes={row['bytes']}</li>"
-            for ip, row in analytics["top_peers"]
-        ) or "<li>No data</li>"
-        html = f"""
-        <html>
-        <body style="background:black; color:#00FF00; font-family:monospace;">
-            <h1>PASHCHENKO SECURITY REPORT</h1>
-            <hr>
-            <h2>Target: {self.entry_ip.get()}</h2>
-            <h2>Router: {self.entry_router_ip.get()}</h2>
-            <h3>Packets Captured: {len(self.captured_packets)}</h3>
-            <h3>Relevant Packets (Target/Router): {analytics['total_packets']}</h3>
-            <h3>Total Bytes: {analytics['total_bytes']}</h3>
-            <h3>Time: {datetime.now()}</h3>
-            <hr>
-            <h2>Protocols</h2>
-            <pre>{json.dumps(analytics['protocols'], indent=2)}</pre>
-            <h2>Top Peers</h2>
-            <ul>{top_peers_html}</ul>
-            <hr>
-            <p>Generated by Pashchenko Cyber Suite v7.0</p>
-        </body>
-        </html>
-        """
+        # Снимок состояния берется в Tk-потоке, запись на диск — в фоне
+        directory = os.path.join(REPORT_DIR, f"report_{datetime.now():%Y%m%d_%H%M%S}")
+        analytics = self.engine.snapshot()
+        summary = {
+            "Target": self.entry_ip.get(),
+            "Router": self.entry_router_ip.get(),
+            "Time": datetime.now().isoformat(" ", "seconds"),
+            "Packets Captured": len(self.engine.captured_packets),
+            "Relevant Packets (Target/Router)": analytics["total_packets"],
+            "Total Bytes": analytics["total_bytes"],
+            "Uptime": self._fmt_duration(analytics["uptime"]),
+            "Peak": f"{self._fmt_bytes(analytics['peak_bps'])}/s, {analytics['peak_pps']:.0f} pps",
+            "Protocols": analytics["protocols"],
+            "TCP Flags": analytics["tcp_flags"],
+            "Applications (bytes)": dict(sorted(((app, size) for app, (_, size) in analytics["apps"].items()),
+                                                key=itemgetter(1), reverse=True)),
+        }
+        a = self.engine.analytics
+        geoip = self.engine.geoip
+        peers = sorted(a["peers"].entries.items(), key=lambda kv: kv[1][0], reverse=True)
+        rdns = self.engine.rdns
+        peer_rows = [(ip, rdns.name(ip, False) or "", size, *(row or (0, 0, 0, 0)), err, geoip.describe(ip))
+                     for ip, (size, err, row) in peers]
+        domains = a["dns_domains"].entries
+        dns_rows = [(name, count, err) + report_dns_stats(domains[name][2] if name in domains else None)
+                    for name, (count, err, _) in
+                    sorted(a["dns_queries"].entries.items(), key=lambda kv: kv[1][0], reverse=True)]
+        resolver_rows = [(ip, stats[DNS_QUERIES]) + report_dns_stats(stats) for ip, stats in
+                         sorted(a["dns_resolvers"].items(), key=lambda kv: kv[1][DNS_QUERIES],
+                                reverse=True)]
+        flows = list(chain.from_iterable(table.values() for table in a["flows"].values()))
+        iface_counters = self.engine.capture_stats["ifaces"]
+        iface_rows = [(name, packets, size, *(iface_counters.get(name, {}).get(key, 0)
+                                              for key in ("delivered", "kernel_recv", "kernel_drops")),
+                       " ".join(f"{proto}:{count}" for proto, count in sorted(protocols.items())))
+                      for name, (packets, size, protocols) in sorted(analytics["ifaces"].items())]
+
+        # История читается в фоне отдельным читателем: запросы за сутки не держат Tk-поток
+        history = None
+        if self.engine.history is not None:
+            self.engine.flush_history()
+            history = self.engine.history.reader()
+
+        tables = [
+            ("flows", "Flows", REPORT_FLOW_COLUMNS, report_flow_rows(flows)),
+            ("peers", "Peers", REPORT_PEER_COLUMNS, peer_rows),
+            ("dns", "DNS Queries", REPORT_DNS_COLUMNS, dns_rows),
+            ("dns_resolvers", "DNS Resolvers", REPORT_RESOLVER_COLUMNS, resolver_rows),
+            ("interfaces", "Interfaces", REPORT_IFACE_COLUMNS, iface_rows),
+            ("packets", "Packets", REPORT_PACKET_COLUMNS, report_packet_rows(self.engine.packet_store())),
+        ]
+        self.log(f"Writing report to {directory}...", "INFO")
+        threading.Thread(target=self._report_thread, args=(directory, summary, history, tables), daemon=True).start()
+
+    def _history_report(self, history):
+        # -> (графики, таблицы истории); вызывается из потока отчета
+        if history is None:
+            return ["<p>History store disabled: no charts.</p>"], []
+        end = time.time()
+        start = end - REPORT_HISTORY_SEC
+        charts = history_charts(history, start, end)
+        rows = []
+        for name in history.series_names():
+            points = history.series(name, start, end)
+            rows.append((name, sum(p[1] for p in points), sum(p[2] for p in points)))
+        geoip = self.engine.geoip
+        peers = [(ip, b, p, geoip.describe(ip)) for ip, b, p in history.top("peer", start, end)]
+        return charts, [
+            ("history", "Last 24 Hours (history)", REPORT_HISTORY_COLUMNS, rows),
+            ("history_peers", "Last 24 Hours: Top Peers", REPORT_HISTORY_PEER_COLUMNS, peers),
+        ]
 
+    def _report_thread(self, directory, summary, history, tables):
+        started = time.perf_counter()
         try:
-            with open(filename, "w") as f:
-                f.write(html)
-            self.log(f"Report saved to {filename}", "INFO")
-            os.system(f"start {filename}")  # Открывает файл (для Windows)
+            charts, history_tables = self._history_report(history)
+            tables = tables + history_tables
+            writer = ReportWriter(directory)
+            writer.begin(summary, charts)
+            for name, title, columns, rows in tables:
+                writer.table(name, title, columns, rows)
+            writer.close()
         except Exception as e:
-            self.log(f"Error saving report: {e}", "ALERT")
+            self.gui_queue.put(("LOG", (f"Error saving report: {e}", "ALERT")))
+            return
+        counts = ", ".join(f"{name}={total:,}" for name, total in writer.tables)
+        self.gui_queue.put(("LOG", (f"Report saved to {writer.html_path} ({counts}) "
+                                    f"in {time.perf_counter() - started:.1f}s", "INFO")))
+        webbrowser.open(Path(writer.html_path).resolve().as_uri())
 
     # --- АНАЛИТИКА ---
-    def _new_analytics_state(self):
-        return {
-            "total_packets": 0,
-            "total_bytes": 0,
-            "protocols": defaultdict(int),
-            "tcp_flags": defaultdict(int),
-            "dns_queries": defaultdict(int),
-            "peers": defaultdict(lambda: {
-                "packets": 0,
-                "bytes": 0,
-                "to_target": 0,
-                "from_target": 0,
-                "via_router": 0,
-            }),
-            "bandwidth_log": deque(maxlen=300),
-        }
-
     def reset_analytics(self):
-        with self.analytics_lock:
-            self.analytics = self._new_analytics_state()
-            self._sniff_start_time = time.time() if self.is_sniffing else None
+        self.engine.reset()
+        self._flows_seen = -1
         self._do_render_analytics()
         self.log("Analytics reset.", "INFO")
 
@@ -510,191 +1486,487 @@ class PashchenkoCyberSuite:
             ANALYTICS_REFRESH_MS, self._schedule_analytics_refresh
         )
 
-    def _proto_name(self, pkt):
-        if TCP in pkt:
-            return "TCP"
-        if UDP in pkt:
-            return "UDP"
-        if ARP in pkt:
-            return "ARP"
-        return "OTHER"
-
-    @staticmethod
-    def _fmt_bytes(n):
-        for unit in ('B', 'KB', 'MB', 'GB'):
-            if abs(n) < 1024:
-                return f"{n:.1f} {unit}"
-            n /= 1024
-        return f"{n:.1f} TB"
-
-    @staticmethod
-    def _fmt_duration(sec):
-        sec = int(sec)
-        h, rem = divmod(sec, 3600)
-        m, s = divmod(rem, 60)
-        if h:
-            return f"{h}h {m}m {s}s"
-        if m:
-            return f"{m}m {s}s"
-        return f"{s}s"
-
-    def _collect_analytics(self, pkt, target_ip, router_ip):
-        if IP not in pkt:
-            return False
-
-        src = pkt[IP].src
-        dst = pkt[IP].dst
-        is_relevant = target_ip in (src, dst) or router_ip in (src, dst)
-        if not is_relevant:
-            return False
-
-        proto = self._proto_name(pkt)
-        size = len(pkt)
-        now = time.time()
-
-        with self.analytics_lock:
-            a = self.analytics
-            a["total_packets"] += 1
-            a["total_bytes"] += size
-            a["protocols"][proto] += 1
-            a["bandwidth_log"].append((now, size))
-
-            if TCP in pkt:
-                flags = str(pkt[TCP].flags)
-                a["tcp_flags"][flags] += 1
-
-            if pkt.haslayer(DNS) and pkt.haslayer(DNSQR):
-                try:
-                    qname = pkt[DNSQR].qname
-                    if isinstance(qname, bytes):
-                        qname = qname.decode(errors='ignore')
-                    qname = qname.rstrip('.')
-                    if qname:
-                        a["dns_queries"][qname] += 1
-                except Exception:
-                    pass
-
-            peer_ip = None
-            peer = None
-            if src == target_ip:
-                peer_ip = dst
-                peer = a["peers"][peer_ip]
-                peer["from_target"] += 1
-            elif dst == target_ip:
-                peer_ip = src
-                peer = a["peers"][peer_ip]
-                peer["to_target"] += 1
-            elif src == router_ip:
-                peer_ip = dst
-                peer = a["peers"][peer_ip]
-            elif dst == router_ip:
-                peer_ip = src
-                peer = a["peers"][peer_ip]
-
-            if peer is not None:
-                peer["packets"] += 1
-                peer["bytes"] += size
-                if router_ip in (src, dst):
-                    peer["via_router"] += 1
-
-        return True
-
-    def _calc_bandwidth(self):
-        now = time.time()
-        cutoff = now - BANDWIDTH_WINDOW_SEC
-        with self.analytics_lock:
-            bw_log = self.analytics["bandwidth_log"]
-            total = sum(size for ts, size in bw_log if ts >= cutoff)
-        elapsed = min(BANDWIDTH_WINDOW_SEC, now - (self._sniff_start_time or now))
-        if elapsed <= 0:
-            return 0.0
-        return total / elapsed
-
-    def _snapshot_analytics(self):
-        with self.analytics_lock:
-            protocols = dict(self.analytics["protocols"])
-            tcp_flags = dict(self.analytics["tcp_flags"])
-            dns_queries = dict(self.analytics["dns_queries"])
-            peers = {ip: dict(stats) for ip, stats in self.analytics["peers"].items()}
-            total_packets = self.analytics["total_packets"]
-            total_bytes = self.analytics["total_bytes"]
-            start_time = self._sniff_start_time
-
-        top_peers = sorted(peers.items(), key=lambda item: item[1]["bytes"], reverse=True)[:10]
-        top_dns = sorted(dns_queries.items(), key=lambda item: item[1], reverse=True)[:8]
-        bps = self._calc_bandwidth()
-        uptime = (time.time() - start_time) if start_time else 0
-
-        return {
-            "total_packets": total_packets,
-            "total_bytes": total_bytes,
-            "protocols": protocols,
-            "tcp_flags": tcp_flags,
-            "top_dns": top_dns,
-            "top_peers": top_peers,
-            "bandwidth_bps": bps,
-            "uptime": uptime,
-        }
+    _fmt_bytes = staticmethod(fmt_bytes)
+    _fmt_duration = staticmethod(fmt_duration)
+
+    def on_close(self):
+        self.engine.close()
+        self.root.destroy()
+
+    def _interfaces_text(self, rows, counters):
+        if not rows and not counters:
+            return f"Interface: {', '.join(self._capture_ifaces()) or 'default'}"
+        parts = []
+        for name in sorted(set(rows) | set(counters)):
+            packets, size, protocols = rows.get(name, (0, 0, {}))
+            top = sorted(protocols.items(), key=lambda x: x[1], reverse=True)[:2]
+            mix = " ".join(f"{proto} {count / packets * 100:.0f}%" for proto, count in top) if packets else "-"
+            c = counters.get(name, {})
+            parts.append(f"{name}: {packets:,} pkts {self._fmt_bytes(size)} [{mix}]"
+                         f" recv {c.get('kernel_recv', 0):,} drops {c.get('kernel_drops', 0):,}")
+        return "Interfaces: " + "  |  ".join(parts)
+
+    def _ring_status(self):
+        ring = self.engine.pcap_ring
+        if ring is None:
+            return ""
+        return f"   Ring: {ring.file_count} files, {ring.written} written, {ring.dropped} dropped"
 
     def _do_render_analytics(self):
-        data = self._snapshot_analytics()
+        start = time.perf_counter()
+        data = self.engine.snapshot()
         self.render_analytics(data)
+        self._refresh_flows()
+        self._refresh_packets()
+        if self.engine.host_inventory.version != self._hosts_drawn:
+            # Пассивно найденные хосты попадают на карту без единого отправленного пакета
+            self._hosts_drawn = self.engine.host_inventory.version
+            self.draw_network_map(self.engine.host_inventory.nodes())
+        self.engine.flush_history()
+        self._render_ms = (time.perf_counter() - start) * 1000
 
     def render_analytics(self, data):
-        sniffer_status = "ACTIVE" if self.is_sniffing else "STOPPED"
+        sniffer_status = "ACTIVE" if self.engine.is_sniffing else "REPLAY" if self.engine.is_replaying else "STOPPED"
+        stats = self.engine.capture_stats
         uptime_str = self._fmt_duration(data.get('uptime', 0))
         bw = self._fmt_bytes(data.get('bandwidth_bps', 0))
+        rate_parts = [f"{w}s {self._fmt_bytes(bps)}/s {pps:,.0f}pps"
+                      for w, (bps, pps) in sorted(data.get("rates", {}).items())]
+
+        texts = {
+            "status": f"=== LIVE TRAFFIC ANALYTICS  [{sniffer_status}]  Uptime: {uptime_str}"
+                      f"  |  last refresh {self._render_ms:.1f} ms ===",
+            "filter": f"Target: {self.entry_ip.get().strip()}   Router: {self.entry_router_ip.get().strip()}"
+                      f"   Hosts seen (passive): {len(self.engine.host_inventory)}"
+                      f"   Alerts: {sum(data.get('alerts', {}).values())}",
+            "totals": f"Packets: {data['total_packets']}   Bytes: {self._fmt_bytes(data['total_bytes'])}"
+                      f"   Bandwidth: {bw}/s",
+            "rates": f"Rates: {'  |  '.join(rate_parts)}   Peak: {self._fmt_bytes(data.get('peak_bps', 0))}/s"
+                     f" {data.get('peak_pps', 0):,.0f}pps",
+            "capture": f"Delivered: {stats['delivered']}   Kernel recv: {stats['kernel_recv']}"
+                       f"   Kernel drops: {stats['kernel_drops']}" + self._ring_status()
+                       + (f"   Pipeline ring full: {stats['ring_full']}" if stats['ring_full'] else "")
+                       + (f"   GUI dropped: {self.gui_queue.dropped}" if self.gui_queue.dropped else ""),
+        }
+
+        texts["interfaces"] = self._interfaces_text(data.get("ifaces", {}), stats.get("ifaces", {}))
 
-        lines = [
-            f"=== LIVE TRAFFIC ANALYTICS  [{sniffer_status}]  Uptime: {uptime_str} ===",
-            f"Target: {self.entry_ip.get().strip()}   Router: {self.entry_router_ip.get().strip()}",
-            f"Packets: {data['total_packets']}   Bytes: {self._fmt_bytes(data['total_bytes'])}   Bandwidth: {bw}/s",
-            "",
-            "--- Protocols ---",
-        ]
         if data["protocols"]:
             proto_parts = []
             for proto, count in sorted(data["protocols"].items(), key=lambda x: x[1], reverse=True):
                 pct = (count / data['total_packets'] * 100) if data['total_packets'] else 0
                 proto_parts.append(f"{proto}: {count} ({pct:.0f}%)")
-            lines.append("  " + "  |  ".join(proto_parts))
+            texts["protocols"] = "Protocols: " + "  |  ".join(proto_parts)
         else:
-            lines.append("  No data")
-
-        if data.get("tcp_flags"):
-            lines.append("")
-            lines.append("--- TCP Flags ---")
-            flag_parts = [f"{flag}: {cnt}" for flag, cnt in
-                          sorted(data["tcp_flags"].items(), key=lambda x: x[1], reverse=True)[:6]]
-            lines.append("  " + "  |  ".join(flag_parts))
-
-        if data.get("top_dns"):
-            lines.append("")
-            lines.append("--- DNS Queries (top) ---")
-            for domain, cnt in data["top_dns"]:
-                lines.append(f"  {domain}: {cnt}")
-
-        lines.append("")
-        lines.append("--- Top Peers (by traffic) ---")
-        if data["top_peers"]:
-            for ip, row in data["top_peers"]:
-                lines.append(
-                    f"  {ip:>15s}  {self._fmt_bytes(row['bytes']):>10s}  "
-                    f"pkts={row['packets']}  in={row['to_target']}  out={row['from_target']}  router={row['via_router']}"
-                )
-        else:
-            lines.append("  No data")
+            texts["protocols"] = "Protocols: No data"
+
+        # Доли приложений по байтам: классификатор потоков, не только порт
+        apps = sorted(data.get("apps", {}).items(), key=lambda x: x[1][1], reverse=True)
+        total_bytes = data["total_bytes"]
+        app_parts = [f"{app}: {self._fmt_bytes(size)} ({size / total_bytes * 100:.0f}%)"
+                     for app, (_packets, size) in apps[:APP_SHARE_TOP]] if total_bytes else []
+        if len(apps) > APP_SHARE_TOP:
+            app_parts.append(f"+{len(apps) - APP_SHARE_TOP} more")
+        texts["apps"] = "Applications: " + ("  |  ".join(app_parts) if app_parts else "No data")
+
+        flag_parts = [f"{flag}: {cnt}" for flag, cnt in
+                      sorted(data.get("tcp_flags", {}).items(), key=lambda x: x[1], reverse=True)[:6]]
+        texts["flags"] = "TCP Flags: " + ("  |  ".join(flag_parts) if flag_parts else "No data")
+
+        texts["peers_title"] = "--- Top Peers (by traffic) ---" + (
+            f"  [bytes may overstate by <= {self._fmt_bytes(data['peer_error'])}]" if data.get("peer_error") else "")
+        texts["dns_title"] = "--- DNS Queries (top) ---" + (
+            f"  [counts may overstate by <= {data['dns_error']}]" if data.get("dns_error") else "")
+
+        geoip = self.engine.geoip
+        rdns = self.engine.rdns
+        query = self.var_rdns.get()  # без PTR остаются имена из перехваченных ответов DNS
+        peer_rows = [
+            (ip, rdns.name(ip, query) or "", self._fmt_bytes(row['bytes']), row['packets'], row['to_target'],
+             row['from_target'], row['via_router'], geoip.describe(ip))
+            for ip, row in data["top_peers"]
+        ]
+        latency = data.get("dns_latency", {})
+        dns_rows = [(domain, cnt) + self._dns_stat_cells(latency[domain])[1:6] if domain in latency
+                    else (domain, cnt, "-", "-", "-", "-", "-") for domain, cnt in data.get("top_dns", [])]
+        resolver_rows = [(ip,) + self._dns_stat_cells(stats) for ip, stats in data.get("dns_resolvers", [])]
+        texts["resolvers_title"] = (f"--- DNS Resolvers (latency) ---  pending: {data.get('dns_pending', 0)}"
+                                    + (f"  evicted (table full): {data['dns_overflow']}"
+                                       if data.get("dns_overflow") else ""))
 
         try:
-            self.analytics_view.config(state=tk.NORMAL)
-            self.analytics_view.delete(1.0, tk.END)
-            self.analytics_view.insert(tk.END, "\n".join(lines))
-            self.analytics_view.config(state=tk.DISABLED)
+            for key, text in texts.items():
+                self._set_analytics_text(key, text)
+            self._update_fixed_rows(self.peer_tree, self._peer_items, self._peer_values, peer_rows)
+            self._update_fixed_rows(self.dns_tree, self._dns_items, self._dns_values, dns_rows)
+            self._update_fixed_rows(self.resolver_tree, self._resolver_items, self._resolver_values, resolver_rows)
         except tk.TclError:
             pass
 
+    @staticmethod
+    def _dns_stat_cells(stats):
+        # -> (запросы, p50, p95, p99, NX %, FAIL %, потеряно); проценты — от ответов
+        answered = stats[DNS_ANSWERED]
+        cells = [stats[DNS_QUERIES]]
+        for q in (0.5, 0.95, 0.99):
+            value = dns_percentile(stats, q)
+            cells.append("-" if value is None else f"{value:.1f}")
+        for i in (DNS_NXDOMAIN, DNS_SERVFAIL):
+            cells.append(f"{stats[i] / answered * 100:.0f}" if answered else "-")
+        cells.append(stats[DNS_LOST])
+        return tuple(cells)
+
+
+# --- БЕНЧМАРКИ ---
+def _measure_pps(fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed > 0 else float("inf")
+
+
+def bench_decode(path, limit=BENCH_DEFAULT_LIMIT):
+    # Кадры заранее читаются в память, чтобы сравнивать только декодирование
+    frames = []
+    for item in CaptureFileReader(path):
+        frames.append(item)
+        if len(frames) >= limit:
+            break
+    if not frames:
+        print(f"{path}: no frames")
+        return
+
+    scapy = scapy_all()
+    IP, TCP, Ether, DNS, DNSQR = scapy.IP, scapy.TCP, scapy.Ether, scapy.DNS, scapy.DNSQR
+
+    def scapy_path():
+        for ts, frame, _ in frames:
+            pkt = Ether(frame)
+            if IP in pkt:
+                _ = (pkt[IP].src, pkt[IP].dst, len(pkt))
+                if TCP in pkt:
+                    str(pkt[TCP].flags)
+                if pkt.haslayer(DNS) and pkt.haslayer(DNSQR):
+                    _ = pkt[DNSQR].qname
+
+    def fast_path():
+        for ts, frame, wirelen in frames:
+            rec = decode_frame(frame, ts, wirelen)
+            if rec.src is not None:
+                _ = rec.proto_name
+                parse_dns_qname(rec)
+
+    fast = _measure_pps(fast_path, len(frames))
+    slow = _measure_pps(scapy_path, len(frames))
+    print(f"Frames: {len(frames)} from {path}")
+    print(f"  scapy dissection : {slow:>12,.0f} pkt/s")
+    print(f"  header decoder   : {fast:>12,.0f} pkt/s   (x{fast / slow:.1f})")
+
+
+def bench_geoip(directory, lookups=BENCH_GEOIP_LOOKUPS):
+    started = time.perf_counter()
+    db = GeoIpDb().load_dir(directory)
+    print(f"Loaded {len(db)} ranges, {len(db._mmdb)} mmdb from {directory} in {time.perf_counter() - started:.2f}s")
+    for err in db.errors:
+        print(f"  {err}")
+    rnd = random.Random(1)
+    # Случайные публичные адреса; повторяющийся набор пиров — для попаданий в LRU
+    cold = [socket.inet_ntoa(rnd.getrandbits(32).to_bytes(4, "big")) for _ in range(lookups)]
+    peers = cold[:BENCH_PEERS]
+    hot = [rnd.choice(peers) for _ in range(lookups)]
+    db.cache_size = 0
+
+    def uncached():
+        for ip in cold:
+            db.lookup(ip)
+
+    miss = _measure_pps(uncached, lookups)
+    db.cache_size = GEOIP_CACHE_SIZE
+    hit = _measure_pps(lambda: [db.lookup(ip) for ip in hot], lookups)
+    print(f"  bisect lookups   : {miss:>12,.0f} lookups/s")
+    print(f"  peer set via LRU : {hit:>12,.0f} lookups/s")
+
+
+def _synthetic_frames(count, target_ip=BENCH_TARGET_IP, peers=BENCH_PEERS):
+    # Смесь TCP/UDP/DNS между TARGET и peers адресами 10.1.x.y
+    eth = b"\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02"
+    target = socket.inet_aton(target_ip)
+    frames = []
+    for i in range(count):
+        peer = socket.inet_aton(f"10.1.{(i % peers) // 250}.{(i % peers) % 250 + 1}")
+        src, dst = (target, peer) if i % 2 else (peer, target)
+        kind = i % 10
+        if kind < 7:
+            proto = IPPROTO_TCP
+            l4 = struct.pack("!HHIIBBHHH", 40000 + i % 1000, 443, i, 0, 5 << 4,
+                             (0x02, 0x12, 0x10, 0x18, 0x11)[i % 5], 1024, 0, 0) + b"\x00" * 64
+        elif kind < 9:
+            proto = IPPROTO_UDP
+            l4 = struct.pack("!HHHH", 50000 + i % 1000, 123, 56, 0) + b"\x00" * 48
+        else:
+            proto = IPPROTO_UDP
+            name = f"host{i % 500}.example.com".encode()
+            qname = b"".join(bytes([len(p)]) + p for p in name.split(b".")) + b"\x00"
+            dns = struct.pack("!HHHHHH", i & 0xFFFF, 0x0100, 1, 0, 0, 0) + qname + b"\x00\x01\x00\x01"
+            l4 = struct.pack("!HHHH", 50000 + i % 1000, 53, 8 + len(dns), 0) + dns
+        ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), i & 0xFFFF, 0, 64, proto, 0, src, dst)
+        frames.append(eth + struct.pack("!H", ETH_P_IP) + ip + l4)
+    return frames
+
+
+def _paced_run(records, rate, seconds, per_packet):
+    # Подает записи со скоростью rate пакетов/с; -> фактическая скорость
+    total = int(rate * seconds)
+    batch = max(1, rate // 100)
+    n = len(records)
+    sent = 0
+    start = time.perf_counter()
+    while sent < total:
+        upto = min(sent + batch, total)
+        for i in range(sent, upto):
+            per_packet(records[i % n])
+        sent = upto
+        ahead = sent / rate - (time.perf_counter() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+    return sent / (time.perf_counter() - start)
+
+
+class _WaitStats:
+    __slots__ = ("total", "worst", "count")
+
+    def __init__(self):
+        self.total = 0.0
+        self.worst = 0.0
+        self.count = 0
+
+    def add(self, sec):
+        self.total += sec
+        self.count += 1
+        if sec > self.worst:
+            self.worst = sec
+
+    def __str__(self):
+        return f"{self.total * 1e3:9.1f} ms total / {self.worst * 1e6:8.0f} us max"
+
+
+def bench_lock_contention(rate=BENCH_STRESS_PPS, seconds=BENCH_STRESS_SEC):
+    records = [decode_frame(f, time.time()) for f in _synthetic_frames(BENCH_PEERS * 4)]
+
+    def snapshot(peers, dns_queries):
+        # То же, что берет _snapshot_analytics
+        return peers.top(TOP_PEERS), dns_queries.top(TOP_DNS)
+
+    def run(mode):
+        stop = threading.Event()
+        packet_wait = _WaitStats()
+        gui_wait = _WaitStats()
+
+        if mode == "locked":
+            # Модель прежней схемы, а не прежний код: тот же агрегатор под одним общим Lock
+            # на каждый пакет и на каждый снимок GUI — сравнивается только цена блокировки
+            lock = threading.Lock()
+            agg = TrafficAggregator(BENCH_TARGET_IP, BENCH_ROUTER_IP, None)
+
+            def per_packet(rec):
+                t0 = time.perf_counter()
+                with lock:
+                    packet_wait.add(time.perf_counter() - t0)
+                    agg.add(rec)
+
+            def gui():
+                while not stop.wait(BENCH_SNAPSHOT_SEC):
+                    t0 = time.perf_counter()
+                    with lock:
+                        gui_wait.add(time.perf_counter() - t0)
+                        snapshot(agg.peers, agg.dns_queries)
+                        sum(size for size, _ in agg.bandwidth.values())
+        else:
+            deltas = queue.SimpleQueue()
+            state = new_analytics_state()
+
+            def sink(delta):
+                t0 = time.perf_counter()
+                deltas.put(delta)
+                packet_wait.add(time.perf_counter() - t0)
+
+            agg = TrafficAggregator(BENCH_TARGET_IP, BENCH_ROUTER_IP, sink)
+
+            def per_packet(rec):
+                agg.add(rec)
+                agg.maybe_publish()
+
+            def gui():
+                while not stop.wait(BENCH_SNAPSHOT_SEC):
+                    while True:
+                        try:
+                            merge_analytics_delta(state, deltas.get_nowait())
+                        except queue.Empty:
+                            break
+                    snapshot(state["peers"], state["dns_queries"])
+                    state["bandwidth"].rates(time.time())
+
+        gui_thread = threading.Thread(target=gui, daemon=True)
+        gui_thread.start()
+        achieved = _paced_run(records, rate, seconds, per_packet)
+        stop.set()
+        gui_thread.join()
+        return achieved, packet_wait, gui_wait
+
+    print(f"Lock stress: target {rate:,} pkt/s for {seconds}s, GUI snapshot every "
+          f"{BENCH_SNAPSHOT_SEC * 1e3:.0f} ms, {BENCH_PEERS} peers")
+    print("  'locked' is a simulation: the current aggregator behind one shared Lock, not the pre-delta code")
+    for mode in ("locked", "lock-free"):
+        achieved, packet_wait, gui_wait = run(mode)
+        gui = str(gui_wait) if gui_wait.count else "no lock"
+        label = "locked*" if mode == "locked" else mode
+        print(f"  {label:<9s} {achieved:>10,.0f} pkt/s | packet path: {packet_wait} | GUI: {gui}")
+
+
+def _attack_frames(count, target_ip=BENCH_TARGET_IP):
+    # SYN-скан портов TARGET с ответами RST-ACK и поток ARP-ответов от одного адреса
+    eth = b"\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02"
+    target = socket.inet_aton(target_ip)
+    scanner = socket.inet_aton(BENCH_SCANNER_IP)
+    arp = eth + struct.pack("!H", ETH_P_ARP) + _ARP.pack(1, ETH_P_IP, 6, 4, 2, eth[6:], socket.inet_aton(BENCH_ARP_STORM_IP),
+                                                         eth[:6], target)
+    frames = []
+    for i in range(count):
+        if i % 4 == 3:
+            frames.append(arp)
+            continue
+        port = 1 + i // 2 % 1024
+        src, dst, sport, dport, flags = ((scanner, target, 55555, port, 0x02) if i % 2 == 0
+                                         else (target, scanner, port, 55555, 0x14))
+        l4 = struct.pack("!HHIIBBHHH", sport, dport, i, 0, 5 << 4, flags, 1024, 0, 0)
+        ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), i & 0xFFFF, 0, 64, IPPROTO_TCP, 0, src, dst)
+        frames.append(eth + struct.pack("!H", ETH_P_IP) + ip + l4)
+    return frames
+
+
+def bench_detector(rate=BENCH_STRESS_PPS, seconds=BENCH_STRESS_SEC):
+    # Путь живого захвата: агрегатор в потоке захвата, детектор у владельца состояния.
+    # Каждый 20-й пакет — скан или ARP-шторм; время пакетов — текущее
+    normal = _synthetic_frames(BENCH_PEERS * 4, peers=BENCH_DETECT_PEERS)
+    attacks = _attack_frames(len(normal) // 20)
+    frames = [attacks[i // 20] if i % 20 == 19 else f for i, f in enumerate(normal)]
+    records = [decode_frame(f, time.time()) for f in frames]
+    deltas = queue.SimpleQueue()
+    detector = AnomalyDetector()
+    observe = _WaitStats()
+    alerts = []
+    agg = TrafficAggregator(BENCH_TARGET_IP, BENCH_ROUTER_IP, deltas.put)
+    stop = threading.Event()
+
+    def per_packet(rec):
+        rec.ts = time.time()
+        agg.add(rec)
+        agg.maybe_publish()
+
+    def drain(state):
+        while True:
+            try:
+                delta = deltas.get_nowait()
+            except queue.Empty:
+                return
+            merge_analytics_delta(state, delta)
+            t0 = time.perf_counter()
+            alerts.extend(detector.observe(delta))
+            observe.add(time.perf_counter() - t0)
+
+    def owner():
+        state = new_analytics_state()
+        while not stop.wait(BENCH_SNAPSHOT_SEC):
+            drain(state)
+        drain(state)  # последняя дельта закрывает окно: доля SYN без ответа
+
+    owner_thread = threading.Thread(target=owner, daemon=True)
+    owner_thread.start()
+    achieved = _paced_run(records, rate, seconds, per_packet)
+    agg.publish(final=True)
+    stop.set()
+    owner_thread.join()
+    print(f"Anomaly detection: target {rate:,} pkt/s for {seconds}s, {len(records):,} distinct frames,"
+          f" 1 in 20 from a port scan / ARP storm")
+    print(f"  capture path     : {achieved:>10,.0f} pkt/s ({achieved / rate:.0%} of target)")
+    print(f"  detector         : {observe} over {observe.count} deltas"
+          f" ({observe.total / seconds:.2%} of one core)")
+    print(f"  alerts           : {dict((k, n) for k, n in detector.counts.items() if n)}")
+    for text in alerts:
+        print(f"    {text}")
+
+
+def bench_pipeline(max_workers=None, count=BENCH_PIPELINE_FRAMES):
+    # Кольца заполняются заранее, чтобы мерить только воркеры, а не генератор
+    frames = _synthetic_frames(BENCH_PEERS * 4)
+    max_workers = max_workers or os.cpu_count() or 1
+    worker_counts = sorted({n for n in (1, 2, 4, 8, 16) if n <= max_workers} | {max_workers})
+    slot = (_SLOT_HDR.size + max(len(f) for f in frames) + 15) & ~15
+    ts = time.time()
+    print(f"Pipeline: {count:,} synthetic frames, {os.cpu_count()} CPUs")
+    for n in worker_counts:
+        done = []
+        packets = [0]
+
+        def on_message(kind, data):
+            if kind == "DELTA":
+                packets[0] += data["packets"]
+            elif kind == "DONE":
+                done.append(data)
+
+        ring_bytes = slot * count // n * 2 + (1 << 20)
+        pipe = CapturePipeline(n, BENCH_TARGET_IP, BENCH_ROUTER_IP, None, on_message, ring_bytes)
+        for i in range(count):
+            frame = frames[i % len(frames)]
+            pipe.rings[flow_shard(frame, n)].push(frame, ts, len(frame))
+        pipe.start(with_capture=False)
+        pipe.stop(timeout=None)
+        busy = [d for d in done if d[2] is not None]
+        elapsed = max(d[3] for d in busy) - min(d[2] for d in busy) if busy else 0
+        pps = count / elapsed if elapsed > 0 else 0
+        spread = "/".join(str(d[1]) for d in sorted(done))
+        print(f"  workers={n:<3d} {pps:>12,.0f} pkt/s   relevant={packets[0]:,}   per-shard={spread}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pashchenko Cyber Suite")
+    parser.add_argument("--no-intro", action="store_true", help="skip the intro animation")
+    parser.add_argument("--bench-startup", action="store_true",
+                        help="print time-to-interactive and background scapy load time, then exit")
+    parser.add_argument("--bench-decode", metavar="PCAP",
+                        help="compare scapy dissection vs header decoder on a pcap and exit")
+    parser.add_argument("--bench-limit", type=int, default=BENCH_DEFAULT_LIMIT,
+                        help="max frames loaded for benchmarks")
+    parser.add_argument("--bench-locks", action="store_true",
+                        help="stress analytics aggregation: shared lock vs per-thread deltas")
+    parser.add_argument("--bench-pipeline", type=int, nargs="?", const=0, metavar="MAX_WORKERS",
+                        help="measure multi-process pipeline throughput for 1..MAX_WORKERS workers")
+    parser.add_argument("--bench-geoip", metavar="DIR", nargs="?", const=GEOIP_DIR,
+                        help="measure offline GeoIP lookups per second over a database directory")
+    parser.add_argument("--bench-detect", action="store_true",
+                        help="stress the anomaly detector with background traffic plus a scan and an ARP storm")
+    parser.add_argument("--bench-rate", type=int, default=BENCH_STRESS_PPS,
+                        help="packets per second for stress benchmarks")
+    parser.add_argument("--bench-seconds", type=float, default=BENCH_STRESS_SEC,
+                        help="duration of stress benchmarks")
+    args = parser.parse_args()
+
+    if args.bench_decode:
+        bench_decode(args.bench_decode, args.bench_limit)
+        return
+    if args.bench_locks:
+        bench_lock_contention(args.bench_rate, args.bench_seconds)
+        return
+    if args.bench_detect:
+        bench_detector(args.bench_rate, args.bench_seconds)
+        return
+    if args.bench_pipeline is not None:
+        bench_pipeline(args.bench_pipeline or None)
+        return
+    if args.bench_geoip:
+        bench_geoip(args.bench_geoip)
+        return
 
-if __name__ == "__main__":
     root = tk.Tk()
     # DPI Fix
     try:
@@ -704,5 +1976,18 @@ if __name__ == "__main__":
     except:
         pass
 
-    app = PashchenkoCyberSuite(root)
-    root.mainloop()
\ No newline at end of file
+    def print_startup(tti):
+        # Вызывается из mainloop, app к этому моменту уже создан
+        print(f"Time to interactive: {tti * 1000:.0f} ms")
+        app._startup_probe.join()
+        if app.scapy_load_sec is not None:
+            print(f"Scapy import (background): {app.scapy_load_sec * 1000:.0f} ms")
+        app.on_close()
+
+    app = PashchenkoCyberSuite(root, intro=not (args.no_intro or args.bench_startup),
+                               on_ready=print_startup if args.bench_startup else None)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,4235 @@
+"""Ядро Pashchenko Cyber Suite: захват, аналитика и экспорт метрик без GUI.
+
+Импортируется GUI (Netzwerk_Analysator_by Pashchenko.py) и запускается
+отдельно на серверах без дисплея:
+
+    python netzwerk_engine.py --target 10.0.0.5 --metrics 127.0.0.1:9108 --socket /run/netzwerk.sock
+
+Метрики Prometheus — GET /metrics, статус в JSON — GET /status и по одной
+строке JSON на каждое подключение к Unix-сокету.
+"""
+import threading
+import queue
+import time
+import socket
+import os
+import argparse
+import json
+import heapq
+import bisect
+import struct
+import ipaddress
+import multiprocessing
+import zlib
+import hashlib
+import math
+import operator
+import re
+import csv
+import html
+import signal
+import socketserver
+import stat
+import sys
+from datetime import datetime
+from string import Template
+from multiprocessing import shared_memory
+from array import array
+from collections import defaultdict, deque, OrderedDict
+from itertools import chain, compress, islice
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Необязательный читатель MMDB (MaxMind/DB-IP) для офлайн GeoIP
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+# Настройка логирования Scapy, чтобы не спамил в консоль
+import logging
+
+logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
+
+# --- КОНСТАНТЫ ---
+MAX_CAPTURED_PACKETS = 500
+BANDWIDTH_WINDOW_SEC = 10
+RATE_BUCKET_SEC = 0.1
+RATE_WINDOWS_SEC = (1, BANDWIDTH_WINDOW_SEC, 60)
+TOP_PEERS = 10
+TOP_DNS = 8
+PEER_SKETCH_CAPACITY = 512  # ключей в Space-Saving; ошибка <= total / capacity
+DNS_SKETCH_CAPACITY = 512
+DNS_TX_TIMEOUT_SEC = 5.0  # запрос без ответа дольше этого считается потерянным
+DNS_TX_PENDING_MAX = 10000  # открытых транзакций на поток захвата
+DNS_RESOLVERS_MAX = 64  # остальные серверы складываются в "(other)"
+DNS_RESOLVER_ROWS = 3
+# Границы корзин гистограммы задержки DNS, мс: 0.1 мс .. ~11 с, шаг 2^(1/4)
+DNS_LATENCY_EDGES_MS = tuple(0.1 * 2 ** (i / 4) for i in range(68))
+DELTA_SKETCH_CAPACITY = 2048  # на интервал публикации в потоке захвата
+FLOW_TABLE_MAX = 200000
+FLOW_IDLE_SEC = 120
+FLOW_CLOSED_IDLE_SEC = 10  # после FIN/FIN или RST
+FLOW_WHEEL_SLOTS = 256
+FLOW_WHEEL_TICK_SEC = 1.0
+FLOW_PUBLISH_SEC = 2.0
+APP_INSPECT_BYTES = 2048  # байт первой полезной нагрузки потока, просматриваемых сигнатурами
+# (id, заголовок, ширина, выравнивание); приложение — последнее поле Flow.row()
+FLOW_COLUMNS = [
+    ("client", "Client", 190, "w"), ("server", "Server", 190, "w"), ("proto", "Proto", 60, "center"),
+    ("app", "App", 170, "w"), ("state", "State", 100, "center"), ("c_pkts", "Pkts ->", 70, "e"), ("c_bytes", "Bytes ->", 85, "e"),
+    ("s_pkts", "Pkts <-", 70, "e"), ("s_bytes", "Bytes <-", 85, "e"), ("total", "Total", 85, "e"),
+    ("rtt", "RTT ms", 70, "e"), ("duration", "Duration", 85, "e"), ("idle", "Idle", 70, "e"),
+]
+# Детектор аномалий: окна по времени пакетов, одна тревога на (вид, источник) за окно
+DETECT_WINDOW_SEC = 10
+DETECT_SCAN_PORTS = 100  # разных портов от одного инициатора за окно
+DETECT_SCAN_HOSTS = 100  # разных хостов от одного инициатора за окно
+DETECT_SYN_MIN = 50  # SYN за окно, с которых оценивается доля оставшихся без SYN-ACK
+DETECT_SYN_UNANSWERED = 0.8
+DETECT_ARP_REPLIES = 100  # ARP-ответов от одного адреса за окно (видны только с discovery)
+DETECT_BW_Z = 4.0  # z-оценка секунды трафика против EWMA
+DETECT_BW_ALPHA = 0.05  # вес новой секунды в EWMA среднего и дисперсии
+DETECT_BW_WARMUP_SEC = 30  # секунд до первой тревоги о всплеске
+DETECT_BW_MIN_BPS = 125000  # всплески ниже 1 Мбит/с не интересны
+DETECT_BW_LAG_SEC = 2  # секунда закрывается, когда дельты ушли на столько вперед
+DETECT_BW_GAP_MAX = 60  # пустых секунд, досчитываемых нулями после паузы
+DETECT_TRACK_MAX = 4096  # инициаторов в интервале потока захвата и в окне детектора
+DETECT_RECENT_ALERTS = 50
+ALERT_KINDS = ("port_scan", "host_sweep", "syn_unanswered", "arp_storm", "bandwidth_spike")
+HLL_PRECISION = 7  # 128 регистров по байту, ошибка ~9%
+DISCOVERY_PORTS = (67, 68, 5353)  # DHCP сервер/клиент, mDNS
+DISCOVERY_BPF = "arp or (udp and (port 67 or port 68 or port 5353))"
+OUI_FILE = "oui.csv"  # необязательная выгрузка IEEE MA-L, если в scapy нет manuf-базы
+GEOIP_DIR = "geoip"  # *.csv/*.tsv диапазонов и *.mmdb (если установлен maxminddb)
+GEOIP_CACHE_SIZE = 4096
+RDNS_WORKERS = 8  # одновременных PTR-запросов
+RDNS_QUEUE_MAX = 1024  # сверх этого адреса не ставятся в очередь до следующего обращения
+RDNS_TTL_SEC = 3600
+RDNS_NEGATIVE_TTL_SEC = 300  # повтор для адресов без PTR
+RDNS_CACHE_SIZE = 8192
+HISTORY_DIR = "history"
+HISTORY_TIERS = (1, 60, 3600)  # секунды на интервал: 1 с / 1 мин / 1 ч
+HISTORY_CHUNK_ROWS = 86400  # интервалов в чанке: 1 с -> сутки, 1 мин -> 60 суток
+HISTORY_RETENTION_SEC = {1: 7 * 86400}  # старые чанки уровня удаляются; нет ключа — хранить всё
+HISTORY_TOP_TIERS = (60, 3600)  # top-K пиров/DNS пишется только в грубые уровни
+HISTORY_TOPK = 10
+HISTORY_GRACE_SEC = 5  # дельты приходят с задержкой: интервал закрывается позже
+HISTORY_MAX_POINTS = 1500  # уровень для графика выбирается под это число точек
+HISTORY_CACHE_CHUNKS = 32
+REPORT_PAGE_ROWS = 100  # строк на страницу клиентского пейджера
+REPORT_CHUNK_ROWS = 2000  # строк в одном <script>-блоке и в одном чтении индекса
+REPORT_HTML_MAX_ROWS = 250000  # больше в HTML не встраивается, полная таблица — в CSV/JSON
+REPORT_CHART_WIDTH = 900
+REPORT_CHART_HEIGHT = 220
+REPORT_CHART_PROTOCOLS = 6  # остальные протоколы складываются в "other"
+ANALYTICS_PUBLISH_SEC = 0.25
+SNIFF_POLL_SEC = 1
+RAW_RECV_SIZE = 65535
+REPLAY_PROGRESS_SEC = 0.25
+REPLAY_MAX_SLEEP_SEC = 0.5
+MAX_CAPTURED_INDEX = 100000  # при записи в кольцо в памяти только номера пакетов
+RING_DIR = "captures"
+RING_SPEC_DEFAULT = "10x100,0"  # файлов x МБ, ротация по времени (0 = выкл.)
+RING_MAX_FILES = 10
+RING_FILE_MB = 100
+RING_ROTATE_SEC = 0
+RING_QUEUE_SIZE = 50000
+RING_BATCH = 512
+RING_CLOSE_POLL_SEC = 0.1  # close(): как часто проверять, жив ли поток записи
+RING_WRITE_BUFFER = 1 << 20
+PIPELINE_RING_BYTES = 32 << 20  # на каждого воркера
+PIPELINE_IDLE_SEC = 0.001
+PIPELINE_POLL_SEC = 0.5
+PIPELINE_JOIN_SEC = 3
+METRICS_HOST = "127.0.0.1"  # Prometheus-эндпоинт только локально, наружу — через прокси/SSH
+METRICS_PORT = 9108
+HEADLESS_TICK_SEC = 0.5  # как часто headless-цикл сливает дельты и пишет историю
+# getsockopt(SOL_PACKET, PACKET_STATISTICS) для AF_PACKET сокетов Linux
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+# --- ГЛОБАЛЬНЫЕ НАСТРОЙКИ ---
+_scapy = None
+_scapy_lock = threading.Lock()
+
+
+def scapy_all():
+    """Модуль scapy.all, импортированный при первом обращении.
+
+    Импорт scapy занимает порядка секунды; горячий путь работает на
+    decode_frame, так что scapy нужен только для сокетов, отправки
+    пакетов и инспектора, и старт окна его не ждет.
+    """
+    global _scapy
+    with _scapy_lock:
+        if _scapy is None:
+            import scapy.all as scapy
+
+            scapy.conf.verb = 0
+            scapy.conf.use_pcap = True
+            _scapy = scapy
+    return _scapy
+
+
+def _detect_local_ip():
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(('8.8.8.8', 80))
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except Exception:
+        return '192.168.1.100'
+
+
+def _detect_gateway(local_ip):
+    parts = local_ip.rsplit('.', 1)
+    if len(parts) == 2:
+        return parts[0] + '.1'
+    return '192.168.1.1'
+
+
+def _build_bpf_filter(target_ip, router_ip, extra="", discovery=False):
+    # TARGET/ROUTER -> "host a or host b", пользовательское выражение через "and";
+    # discovery добавляет ARP/DHCP/mDNS любых хостов для пассивного обнаружения
+    hosts = []
+    for ip in (target_ip, router_ip):
+        ip = ip.strip()
+        if not ip:
+            continue
+        ipaddress.ip_address(ip)  # ValueError вместо битого BPF
+        if ip not in hosts:
+            hosts.append(ip)
+    parts = []
+    if hosts:
+        parts.append(" or ".join(f"host {ip}" for ip in hosts))
+    extra = extra.strip()
+    if extra:
+        parts.append(extra)
+    if len(parts) > 1:
+        expr = " and ".join(f"({p})" for p in parts)
+    else:
+        expr = parts[0] if parts else None
+    if discovery and expr:
+        return f"({expr}) or {DISCOVERY_BPF}"
+    return expr
+
+
+class KernelDropCounter:
+    """Счетчики ядра/libpcap для открытого L2listen-сокета."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = 0
+        self.dropped = 0
+        self.supported = True
+
+    def poll(self):
+        if not self.supported:
+            return
+        ins = getattr(self.sock, "ins", None)
+        try:
+            stats = getattr(ins, "stats", None)
+            if callable(stats):
+                # libpcap: pcap_stats() отдает накопительные значения
+                recv, drop = stats()[:2]
+                self.received, self.dropped = recv, drop
+            elif isinstance(ins, socket.socket) and ins.family == getattr(socket, "AF_PACKET", None):
+                # AF_PACKET: tpacket_stats обнуляется при каждом чтении
+                raw = ins.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8)
+                recv, drop = struct.unpack("II", raw)
+                self.received += recv
+                self.dropped += drop
+            else:
+                self.supported = False
+        except (OSError, struct.error, ValueError):
+            self.supported = False
+
+
+# --- БЫСТРЫЙ ДЕКОДЕР ЗАГОЛОВКОВ (без scapy в горячем цикле) ---
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86DD
+ETH_VLAN_TYPES = (0x8100, 0x88A8)
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+PROTO_NAMES = {1: "ICMP", IPPROTO_TCP: "TCP", IPPROTO_UDP: "UDP", 58: "ICMPv6"}
+IPV6_EXT_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+DNS_PORTS = (53, 5353)
+
+_ETH = struct.Struct("!6s6sH")
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_PORTS = struct.Struct("!HH")
+_DNS_HDR = struct.Struct("!HHHHHH")
+_ARP = struct.Struct("!HHBBH6s4s6s4s")
+
+# Порядок букв как у str(scapy TCP.flags): младший бит первым
+_TCP_FLAG_LETTERS = "FSRPAUEC"
+_TCP_FLAG_STR = tuple(
+    "".join(ch for bit, ch in enumerate(_TCP_FLAG_LETTERS) if value & (1 << bit))
+    for value in range(256)
+)
+
+
+class PacketRecord:
+    """Компактная запись о кадре: только то, что нужно аналитике."""
+
+    __slots__ = ("ts", "frame", "wirelen", "ethertype", "l3_offset", "src", "dst",
+                 "proto", "sport", "dport", "tcp_flags", "l4_payload")
+
+    def __init__(self, ts, frame, wirelen):
+        self.ts = ts
+        self.frame = frame
+        self.wirelen = wirelen
+        self.ethertype = 0
+        self.l3_offset = 14  # после VLAN-тегов: начало IP/ARP заголовка
+        self.src = None
+        self.dst = None
+        self.proto = 0
+        self.sport = 0
+        self.dport = 0
+        self.tcp_flags = None
+        self.l4_payload = -1  # смещение полезной нагрузки TCP/UDP в кадре
+
+    @property
+    def proto_name(self):
+        if self.proto == IPPROTO_TCP:
+            return "TCP"
+        if self.proto == IPPROTO_UDP:
+            return "UDP"
+        if self.ethertype == ETH_P_ARP:
+            return "ARP"
+        return "OTHER"
+
+    def payload(self):
+        if self.l4_payload < 0:
+            return b""
+        return memoryview(self.frame)[self.l4_payload:]
+
+    def summary(self):
+        if self.src is None:
+            return f"Ether type=0x{self.ethertype:04x} len={self.wirelen}"
+        if self.proto in (IPPROTO_TCP, IPPROTO_UDP):
+            flags = f" {self.tcp_flags}" if self.tcp_flags is not None else ""
+            return (f"{self.proto_name} {self.src}:{self.sport} > "
+                    f"{self.dst}:{self.dport}{flags} len={self.wirelen}")
+        return f"IP proto={self.proto} {self.src} > {self.dst} len={self.wirelen}"
+
+
+def decode_frame(frame, ts, wirelen=None):
+    rec = PacketRecord(ts, frame, len(frame) if wirelen is None else wirelen)
+    if len(frame) < 14:
+        return rec
+    ethertype = _ETH.unpack_from(frame, 0)[2]
+    off = 14
+    while ethertype in ETH_VLAN_TYPES and len(frame) >= off + 4:
+        ethertype = _PORTS.unpack_from(frame, off)[1]
+        off += 4
+    rec.ethertype = ethertype
+    rec.l3_offset = off
+
+    if ethertype == ETH_P_IP:
+        if len(frame) < off + 20:
+            return rec
+        ver_ihl, _, _, _, frag, _, proto, _, src, dst = _IPV4.unpack_from(frame, off)
+        rec.src = socket.inet_ntoa(src)
+        rec.dst = socket.inet_ntoa(dst)
+        rec.proto = proto
+        if frag & 0x1FFF:
+            return rec  # не первый фрагмент: L4-заголовка нет
+        off += (ver_ihl & 0x0F) * 4
+    elif ethertype == ETH_P_IPV6:
+        if len(frame) < off + 40:
+            return rec
+        proto = frame[off + 6]
+        rec.src = socket.inet_ntop(socket.AF_INET6, frame[off + 8:off + 24])
+        rec.dst = socket.inet_ntop(socket.AF_INET6, frame[off + 24:off + 40])
+        off += 40
+        while len(frame) >= off + 8:
+            if proto in IPV6_EXT_HEADERS:
+                proto, ext_len = frame[off], frame[off + 1]
+                off += (ext_len + 1) * 8
+            elif proto == IPV6_FRAGMENT:
+                if _PORTS.unpack_from(frame, off + 2)[0] & 0xFFF8:
+                    rec.proto = frame[off]
+                    return rec
+                proto = frame[off]
+                off += 8
+            else:
+                break
+        rec.proto = proto
+    else:
+        return rec
+
+    if proto == IPPROTO_TCP and len(frame) >= off + 20:
+        rec.sport, rec.dport = _PORTS.unpack_from(frame, off)
+        rec.tcp_flags = _TCP_FLAG_STR[frame[off + 13]]
+        rec.l4_payload = off + (frame[off + 12] >> 4) * 4
+    elif proto == IPPROTO_UDP and len(frame) >= off + 8:
+        rec.sport, rec.dport = _PORTS.unpack_from(frame, off)
+        rec.l4_payload = off + 8
+    return rec
+
+
+def parse_dns_qname(rec):
+    # Первое имя из секции вопросов; None, если это не DNS-запрос/ответ
+    if rec.l4_payload < 0 or (rec.sport not in DNS_PORTS and rec.dport not in DNS_PORTS):
+        return None
+    data = rec.frame
+    off = rec.l4_payload
+    if rec.proto == IPPROTO_TCP:
+        off += 2  # DNS over TCP: двухбайтовая длина сообщения
+    if len(data) < off + 12 or _DNS_HDR.unpack_from(data, off)[2] == 0:
+        return None
+    return _read_qname(data, off + 12)
+
+
+def _read_qname(data, off):
+    labels = []
+    end = len(data)
+    while off < end:
+        n = data[off]
+        if n == 0:
+            break
+        if n & 0xC0 or off + 1 + n > end:
+            return None  # сжатие в вопросе не встречается на практике
+        labels.append(data[off + 1:off + 1 + n].decode(errors="ignore"))
+        off += 1 + n
+    else:
+        return None
+    return ".".join(labels) or None
+
+
+def parse_dns_answers(rec):
+    """A/AAAA из DNS-ответа: [(адрес, имя)].
+
+    Имя берется из вопроса, а не из владельца записи: после цепочки CNAME
+    владельцем оказывается имя CDN, а пользователь спрашивал другое.
+    """
+    if rec.l4_payload < 0 or rec.sport not in DNS_PORTS:
+        return []
+    data = rec.frame
+    off = rec.l4_payload
+    if rec.proto == IPPROTO_TCP:
+        off += 2
+    if len(data) < off + 12:
+        return []
+    _, flags, qdcount, ancount, _, _ = _DNS_HDR.unpack_from(data, off)
+    if not flags & 0x8000 or flags & 0x000F or not ancount:
+        return []
+    base = off
+    off += 12
+    question = None
+    for _ in range(qdcount):
+        name, off = _dns_name(data, off, base)
+        question = question or name
+        off += 4
+    answers = []
+    end = len(data)
+    for _ in range(ancount):
+        name, off = _dns_name(data, off, base)
+        if name is None or off + 10 > end:
+            break
+        rtype, _, _, rdlen = struct.unpack_from("!HHIH", data, off)
+        off += 10
+        if off + rdlen > end:
+            break
+        if rtype == 1 and rdlen == 4:
+            answers.append((socket.inet_ntoa(data[off:off + 4]), question or name))
+        elif rtype == 28 and rdlen == 16:
+            answers.append((socket.inet_ntop(socket.AF_INET6, data[off:off + 16]), question or name))
+        off += rdlen
+    return answers
+
+
+def _dns_name(data, off, base):
+    # -> (имя, смещение за именем) с учетом сжатия (указатели от base)
+    labels = []
+    end = len(data)
+    next_off = None
+    for _ in range(64):  # защита от петель указателей
+        if off >= end:
+            return None, end
+        n = data[off]
+        if n & 0xC0 == 0xC0:
+            if off + 1 >= end:
+                return None, end
+            if next_off is None:
+                next_off = off + 2
+            off = base + (((n & 0x3F) << 8) | data[off + 1])
+            continue
+        if n == 0:
+            return ".".join(labels), next_off if next_off is not None else off + 1
+        labels.append(data[off + 1:off + 1 + n].decode(errors="ignore"))
+        off += 1 + n
+    return None, end
+
+
+def _mac_str(raw):
+    return raw.hex(":")
+
+
+def parse_host_hints(rec):
+    """Пассивные наблюдения о хостах из ARP, DHCP и mDNS.
+
+    -> [(mac или None, ip или None, имя или None, источник)]
+    """
+    frame = rec.frame
+    if rec.ethertype == ETH_P_ARP:
+        if len(frame) < rec.l3_offset + _ARP.size:
+            return []
+        _, ptype, _, _, _op, sha, spa, _, _ = _ARP.unpack_from(frame, rec.l3_offset)
+        if ptype != ETH_P_IP or spa == bytes(4):  # 0.0.0.0 — ARP probe
+            return []
+        return [(_mac_str(sha), socket.inet_ntoa(spa), None, "arp")]
+    if rec.proto != IPPROTO_UDP or rec.l4_payload < 0:
+        return []
+    off = rec.l4_payload
+    if rec.sport in (67, 68) and rec.dport in (67, 68):
+        return _dhcp_hints(frame, off)
+    if rec.dport == 5353 or rec.sport == 5353:
+        return _mdns_hints(rec, frame, off)
+    return []
+
+
+def _dhcp_hints(frame, off):
+    # BOOTP: op, ..., ciaddr@12, yiaddr@16, chaddr@28, magic cookie@236, опции@240
+    if len(frame) < off + 240 or frame[off + 236:off + 240] != b"\x63\x82\x53\x63":
+        return []
+    op = frame[off]
+    ciaddr = frame[off + 12:off + 16]
+    yiaddr = frame[off + 16:off + 20]
+    mac = _mac_str(frame[off + 28:off + 34])
+    msg_type = hostname = requested = None
+    i = off + 240
+    end = len(frame)
+    while i < end:
+        code = frame[i]
+        if code == 255:
+            break
+        if code == 0:
+            i += 1
+            continue
+        if i + 1 >= end:
+            break
+        length = frame[i + 1]
+        value = frame[i + 2:i + 2 + length]
+        if code == 53 and length:
+            msg_type = value[0]
+        elif code == 12:
+            hostname = value.decode(errors="ignore").strip("\x00") or None
+        elif code == 50 and length == 4:
+            requested = value
+        i += 2 + length
+    if op == 2:
+        if msg_type != 5:  # только DHCPACK подтверждает адрес
+            return []
+        return [(mac, socket.inet_ntoa(yiaddr), None, "dhcp")]
+    addr = ciaddr if ciaddr != bytes(4) else requested
+    return [(mac, socket.inet_ntoa(addr) if addr else None, hostname, "dhcp")]
+
+
+def _mdns_hints(rec, frame, off):
+    # Ответы mDNS: A/AAAA записи "имя.local -> адрес"; отправитель сам по себе тоже хост
+    src_mac = _mac_str(frame[6:12])
+    hints = [(src_mac, rec.src, None, "mdns")] if rec.src else []
+    if len(frame) < off + 12:
+        return hints
+    _, flags, qdcount, ancount, nscount, arcount = _DNS_HDR.unpack_from(frame, off)
+    if not flags & 0x8000:
+        return hints
+    base = off
+    off += 12
+    for _ in range(qdcount):
+        _name, off = _dns_name(frame, off, base)
+        off += 4
+    for _ in range(ancount + nscount + arcount):
+        name, off = _dns_name(frame, off, base)
+        if name is None or off + 10 > len(frame):
+            break
+        rtype, _, _, rdlen = struct.unpack_from("!HHIH", frame, off)
+        off += 10
+        rdata = frame[off:off + rdlen]
+        off += rdlen
+        if rtype == 1 and rdlen == 4:
+            ip = socket.inet_ntoa(rdata)
+        elif rtype == 28 and rdlen == 16:
+            ip = socket.inet_ntop(socket.AF_INET6, rdata)
+        else:
+            continue
+        host = name[:-6] if name.endswith(".local") else name
+        hints.append((src_mac if ip == rec.src else None, ip, host, "mdns"))
+    return hints
+
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),  # наносекундный вариант
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_PB = 2  # устаревший Packet Block
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_BOM = 0x1A2B3C4D
+PCAPNG_OPT_TSRESOL = 9
+LINKTYPE_ETHERNET = 1
+CAPTURE_READ_BUFFER = 1 << 20
+_PCAP_GLOBAL_HDR = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, RAW_RECV_SIZE, LINKTYPE_ETHERNET)
+_PCAP_REC = struct.Struct("<IIII")
+
+
+class CaptureFileReader:
+    """Потоковое чтение pcap/pcapng: (ts, frame, wirelen) без загрузки файла в память."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.skipped = 0  # кадры не-Ethernet интерфейсов
+        self._f = None
+        self._pos = 0
+
+    def tell(self):
+        if self._f is not None and not self._f.closed:
+            self._pos = self._f.tell()
+        return self._pos
+
+    def progress(self):
+        return self.tell() / self.size if self.size else 1.0
+
+    def __iter__(self):
+        with open(self.path, "rb", buffering=CAPTURE_READ_BUFFER) as f:
+            self._f = f
+            magic = f.read(4)
+            f.seek(0)
+            if magic in PCAP_MAGIC:
+                yield from self._iter_pcap(f)
+            elif magic == struct.pack("<I", PCAPNG_SHB):
+                yield from self._iter_pcapng(f)
+            else:
+                raise ValueError(f"{self.path}: not a pcap/pcapng file")
+        self._pos = self.size
+
+    def _iter_pcap(self, f):
+        header = f.read(24)
+        endian, scale = PCAP_MAGIC[header[:4]]
+        linktype = struct.unpack(endian + "I", header[20:24])[0] & 0xFFFF
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError(f"{self.path}: unsupported linktype {linktype}")
+        rec_hdr = struct.Struct(endian + "IIII")
+        while True:
+            raw = f.read(16)
+            if len(raw) < 16:
+                return
+            sec, frac, caplen, wirelen = rec_hdr.unpack(raw)
+            frame = f.read(caplen)
+            if len(frame) < caplen:
+                return
+            yield sec + frac * scale, frame, wirelen
+
+    def _iter_pcapng(self, f):
+        endian = "<"
+        ifaces = []  # (linktype, ts_scale) в порядке IDB текущей секции
+        last_ts = 0.0
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return
+            btype = struct.unpack("<I", head[:4])[0]
+            if btype == PCAPNG_SHB:
+                bom = f.read(4)
+                endian = "<" if struct.unpack("<I", bom)[0] == PCAPNG_BOM else ">"
+                blen = struct.unpack(endian + "I", head[4:])[0]
+                body = bom + f.read(blen - 12)
+                ifaces = []
+            else:
+                blen = struct.unpack(endian + "I", head[4:])[0]
+                body = f.read(blen - 8)
+            if blen < 12 or len(body) < blen - 8:
+                return
+            body = body[:-4]  # завершающая копия длины блока
+
+            if btype == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + "H", body, 0)[0]
+                ifaces.append((linktype, self._pcapng_tsresol(body[8:], endian)))
+            elif btype in (PCAPNG_EPB, PCAPNG_PB):
+                if btype == PCAPNG_EPB:
+                    iface, ts_hi, ts_lo, caplen, wirelen = struct.unpack_from(endian + "IIIII", body, 0)
+                else:
+                    iface, _drops, ts_hi, ts_lo, caplen, wirelen = struct.unpack_from(endian + "HHIIII", body, 0)
+                if iface >= len(ifaces) or ifaces[iface][0] != LINKTYPE_ETHERNET:
+                    self.skipped += 1
+                    continue
+                last_ts = ((ts_hi << 32) | ts_lo) * ifaces[iface][1]
+                yield last_ts, body[20:20 + caplen], wirelen
+            elif btype == PCAPNG_SPB:
+                # SPB без метки времени: берем время предыдущего пакета
+                if not ifaces or ifaces[0][0] != LINKTYPE_ETHERNET:
+                    self.skipped += 1
+                    continue
+                wirelen = struct.unpack_from(endian + "I", body, 0)[0]
+                yield last_ts, body[4:4 + wirelen], wirelen
+
+    @staticmethod
+    def _pcapng_tsresol(options, endian):
+        off = 0
+        while off + 4 <= len(options):
+            code, length = struct.unpack_from(endian + "HH", options, off)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_TSRESOL and length >= 1:
+                value = options[off + 4]
+                if value & 0x80:
+                    return 2.0 ** -(value & 0x7F)
+                return 10.0 ** -value
+            off += 4 + ((length + 3) & ~3)
+        return 1e-6
+
+
+# --- КОЛЬЦЕВАЯ ЗАПИСЬ PCAP НА ДИСК ---
+# --- ИНДЕКС ПАКЕТОВ ---
+_INDEX_MAGIC = b"NAIDX001"
+# смещение в pcap, время, длина, src, dst (16 байт, IPv4 как ::ffff:a.b.c.d), порты, ethertype, proto
+_INDEX_REC = struct.Struct("<QdI16s16sHHHB")
+_V4_MAPPED = bytes(10) + b"\xff\xff"
+_NO_ADDR = bytes(16)
+
+
+def _pack_addr(addr):
+    if not addr:
+        return _NO_ADDR
+    if ":" in addr:
+        return socket.inet_pton(socket.AF_INET6, addr)
+    return _V4_MAPPED + socket.inet_aton(addr)
+
+
+def _unpack_addr(raw):
+    if raw == _NO_ADDR:
+        return ""
+    if raw[:12] == _V4_MAPPED:
+        return socket.inet_ntoa(raw[12:])
+    return socket.inet_ntop(socket.AF_INET6, raw)
+
+
+def _proto_label(ethertype, proto):
+    if ethertype == ETH_P_ARP:
+        return "ARP"
+    if ethertype not in (ETH_P_IP, ETH_P_IPV6):
+        return f"0x{ethertype:04x}"
+    return PROTO_NAMES.get(proto, str(proto))
+
+
+class PacketIndex:
+    """Колоночный индекс пакетов: смещение, время, 5-кортеж, длина, протокол.
+
+    Адреса интернируются: колонки src/dst хранят номера, поэтому фильтр по
+    IP/подсети проверяет только уникальные адреса, а строки сравниваются
+    как целые числа. Колонки только дописываются, так что читать их можно
+    без блокировки писателя.
+    """
+
+    def __init__(self):
+        self.offset = array("Q")
+        self.ts = array("d")
+        self.length = array("I")
+        self.src = array("I")
+        self.dst = array("I")
+        self.sport = array("H")
+        self.dport = array("H")
+        self.ethertype = array("H")
+        self.proto = array("B")
+        self.addrs = []
+        self._packed = []
+        self._addr_ids = {}
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _intern(self, addr, packed=None):
+        i = self._addr_ids.get(addr)
+        if i is None:
+            i = self._addr_ids[addr] = len(self.addrs)
+            self.addrs.append(addr)
+            self._packed.append(packed or _pack_addr(addr))
+        return i
+
+    def _add(self, offset, ts, length, src, dst, sport, dport, ethertype, proto):
+        self.offset.append(offset)
+        self.ts.append(ts)
+        self.length.append(length)
+        self.src.append(src)
+        self.dst.append(dst)
+        self.sport.append(sport)
+        self.dport.append(dport)
+        self.ethertype.append(ethertype)
+        self.proto.append(proto)
+
+    def append(self, offset, rec):
+        # -> запись _INDEX_REC для файла .idx
+        src = self._intern(rec.src or "")
+        dst = self._intern(rec.dst or "")
+        self._add(offset, rec.ts, rec.wirelen, src, dst, rec.sport, rec.dport, rec.ethertype, rec.proto)
+        return _INDEX_REC.pack(offset, rec.ts, rec.wirelen, self._packed[src], self._packed[dst],
+                               rec.sport, rec.dport, rec.ethertype, rec.proto)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, "rb") as f:
+            if f.read(len(_INDEX_MAGIC)) != _INDEX_MAGIC:
+                raise ValueError(f"{path}: not a packet index")
+            data = f.read()
+        data = data[:len(data) - len(data) % _INDEX_REC.size]  # хвост недописанной записи
+        for offset, ts, length, src, dst, sport, dport, ethertype, proto in _INDEX_REC.iter_unpack(data):
+            index._add(offset, ts, length, index._intern(_unpack_addr(src), src),
+                       index._intern(_unpack_addr(dst), dst), sport, dport, ethertype, proto)
+        return index
+
+    def row(self, i):
+        return (self.ts[i], self.addrs[self.src[i]], self.addrs[self.dst[i]],
+                _proto_label(self.ethertype[i], self.proto[i]), self.sport[i], self.dport[i], self.length[i])
+
+    def select(self, flt):
+        # -> array позиций, подходящих под PacketFilter (None — все)
+        n = len(self.proto)  # колонка, дописываемая последней
+        if flt is None:
+            return array("Q", range(n))
+        pred = flt.bind(self.addrs[:])  # адреса строк < n уже интернированы
+        cols = [col[:n] for col in (self.src, self.dst, self.sport, self.dport,
+                                    self.proto, self.ethertype, self.length)]
+        return array("Q", compress(range(n), map(pred, *cols)))
+
+
+_FILTER_TOKEN = re.compile(r"\s*(==|!=|<=|>=|&&|\|\||[()<>!]|[\w.:/-]+)")
+
+
+# Сборщики предикатов фильтра: узел разбора — функция sets -> предикат строки
+# (s, d, sp, dp, p, et, ln); sets — множества номеров адресов для подсетей фильтра
+def _filter_leaf(pred):
+    return lambda sets: pred
+
+
+def _filter_all(left, right):
+    def build(sets):
+        a, b = left(sets), right(sets)
+        return lambda s, d, sp, dp, p, et, ln: a(s, d, sp, dp, p, et, ln) and b(s, d, sp, dp, p, et, ln)
+    return build
+
+
+def _filter_any(left, right):
+    def build(sets):
+        a, b = left(sets), right(sets)
+        return lambda s, d, sp, dp, p, et, ln: a(s, d, sp, dp, p, et, ln) or b(s, d, sp, dp, p, et, ln)
+    return build
+
+
+def _filter_not(inner):
+    def build(sets):
+        a = inner(sets)
+        return lambda s, d, sp, dp, p, et, ln: not a(s, d, sp, dp, p, et, ln)
+    return build
+
+
+def _filter_addr(slot, cols):
+    def build(sets):
+        ids = sets[slot]
+        if cols == ("s",):
+            return lambda s, d, sp, dp, p, et, ln: s in ids
+        if cols == ("d",):
+            return lambda s, d, sp, dp, p, et, ln: d in ids
+        return lambda s, d, sp, dp, p, et, ln: s in ids or d in ids
+    return build
+
+
+def _filter_port(cmp, port, cols):
+    if cols == ("sp",):
+        return _filter_leaf(lambda s, d, sp, dp, p, et, ln: cmp(sp, port))
+    if cols == ("dp",):
+        return _filter_leaf(lambda s, d, sp, dp, p, et, ln: cmp(dp, port))
+    return _filter_leaf(lambda s, d, sp, dp, p, et, ln: cmp(sp, port) or cmp(dp, port))
+
+
+def _filter_proto(values):
+    return _filter_leaf(lambda s, d, sp, dp, p, et, ln: p in values)
+
+
+def _filter_ethertype(value):
+    return _filter_leaf(lambda s, d, sp, dp, p, et, ln: et == value)
+
+
+class PacketFilter:
+    """Фильтр отображения над колонками PacketIndex.
+
+    Пример: "ip==10.0.0.5 and tcp.port==443". Поля: ip/ip.addr/host,
+    ip.src, ip.dst (адрес или подсеть), port/tcp.port/udp.port,
+    tcp.srcport/tcp.dstport/udp.srcport/udp.dstport, len/frame.len, proto;
+    голые tcp/udp/icmp/arp/ip/ipv6; and/or/not (&&, ||, !) и скобки.
+    Выражение собирается из замыканий в один предикат строки, полезная
+    нагрузка пакетов не читается.
+    """
+
+    OPS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+           ">": operator.gt, ">=": operator.ge}
+    BARE = {
+        "tcp": _filter_proto((IPPROTO_TCP,)), "udp": _filter_proto((IPPROTO_UDP,)), "icmp": _filter_proto((1, 58)),
+        "arp": _filter_ethertype(ETH_P_ARP), "ip": _filter_ethertype(ETH_P_IP), "ipv6": _filter_ethertype(ETH_P_IPV6),
+    }
+    ADDR_FIELDS = {"ip": ("s", "d"), "ip.addr": ("s", "d"), "host": ("s", "d"),
+                   "ip.src": ("s",), "ip.dst": ("d",)}
+    # поле -> (протокол или None, колонки портов)
+    PORT_FIELDS = {
+        "port": (None, ("sp", "dp")),
+        "tcp.port": (IPPROTO_TCP, ("sp", "dp")),
+        "udp.port": (IPPROTO_UDP, ("sp", "dp")),
+        "tcp.srcport": (IPPROTO_TCP, ("sp",)),
+        "tcp.dstport": (IPPROTO_TCP, ("dp",)),
+        "udp.srcport": (IPPROTO_UDP, ("sp",)),
+        "udp.dstport": (IPPROTO_UDP, ("dp",)),
+    }
+    PROTO_VALUES = {"tcp": IPPROTO_TCP, "udp": IPPROTO_UDP, "icmp": 1, "icmpv6": 58}
+
+    def __init__(self, text):
+        self.text = text.strip()
+        self._tokens = self._tokenize(self.text)
+        self._pos = 0
+        self._nets = []
+        self._build = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise ValueError(f"unexpected '{self._tokens[self._pos]}'")
+
+    @staticmethod
+    def _tokenize(text):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _FILTER_TOKEN.match(text, pos)
+            if not m:
+                raise ValueError(f"bad filter syntax near '{text[pos:]}'")
+            tokens.append(m.group(1))
+            pos = m.end()
+        return tokens
+
+    def bind(self, addrs):
+        # -> предикат строки для таблицы адресов конкретного индекса
+        sets = []
+        for net in self._nets:
+            ids = set()
+            for i, addr in enumerate(addrs):
+                if addr and ipaddress.ip_address(addr) in net:
+                    ids.add(i)
+            sets.append(frozenset(ids))
+        return self._build(sets)
+
+    def matches(self, rec):
+        pred = self.bind([rec.src or "", rec.dst or ""])
+        return pred(0, 1, rec.sport, rec.dport, rec.proto, rec.ethertype, rec.wirelen)
+
+    def _peek(self):
+        return self._tokens[self._pos].lower() if self._pos < len(self._tokens) else None
+
+    def _next(self):
+        if self._pos >= len(self._tokens):
+            raise ValueError("unexpected end of filter")
+        self._pos += 1
+        return self._tokens[self._pos - 1]
+
+    def _parse_or(self):
+        build = self._parse_and()
+        while self._peek() in ("or", "||"):
+            self._next()
+            build = _filter_any(build, self._parse_and())
+        return build
+
+    def _parse_and(self):
+        build = self._parse_not()
+        while self._peek() in ("and", "&&"):
+            self._next()
+            build = _filter_all(build, self._parse_not())
+        return build
+
+    def _parse_not(self):
+        tok = self._peek()
+        if tok in ("not", "!"):
+            self._next()
+            return _filter_not(self._parse_not())
+        if tok == "(":
+            self._next()
+            expr = self._parse_or()
+            if self._next() != ")":
+                raise ValueError("missing ')'")
+            return expr
+        return self._parse_atom()
+
+    def _parse_atom(self):
+        name = self._next().lower()
+        if self._peek() not in self.OPS:
+            if name in self.BARE:
+                return self.BARE[name]
+            raise ValueError(f"unknown filter term '{name}'")
+        op = self._next()
+        cmp = self.OPS[op]
+        value = self._next()
+        if name in self.ADDR_FIELDS:
+            if op not in ("==", "!="):
+                raise ValueError(f"{name} supports only == and !=")
+            try:
+                net = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                raise ValueError(f"bad address '{value}'") from None
+            build = _filter_addr(len(self._nets), self.ADDR_FIELDS[name])
+            self._nets.append(net)
+            return build if op == "==" else _filter_not(build)
+        if name in self.PORT_FIELDS:
+            proto, cols = self.PORT_FIELDS[name]
+            port = self._int(value)
+            if op == "!=":
+                build = _filter_not(_filter_port(operator.eq, port, cols))  # ни один из портов
+            else:
+                build = _filter_port(cmp, port, cols)
+            return _filter_all(_filter_proto((proto,)), build) if proto is not None else build
+        if name in ("len", "frame.len"):
+            length = self._int(value)
+            return _filter_leaf(lambda s, d, sp, dp, p, et, ln: cmp(ln, length))
+        if name in ("proto", "ip.proto"):
+            proto = self.PROTO_VALUES.get(value.lower())
+            proto = self._int(value) if proto is None else proto
+            return _filter_leaf(lambda s, d, sp, dp, p, et, ln: cmp(p, proto))
+        raise ValueError(f"unknown filter field '{name}'")
+
+    @staticmethod
+    def _int(value):
+        try:
+            return int(value, 0)
+        except ValueError:
+            raise ValueError(f"expected a number, got '{value}'") from None
+
+
+class MemoryPacketStore:
+    """Пакеты в памяти с тем же интерфейсом, что у PcapRingWriter (span/rows/query/read)."""
+
+    def __init__(self, records):
+        self.records = records
+        self.index = PacketIndex()
+        for rec in records:
+            self.index.append(0, rec)
+
+    def span(self):
+        return 0, len(self.records)
+
+    def rows(self, seqs):
+        n = len(self.records)
+        return [(seq,) + self.index.row(seq) if seq < n else None for seq in seqs]
+
+    def query(self, flt):
+        return self.index.select(flt)
+
+    def read(self, seq):
+        rec = self.records[seq]
+        return rec.ts, rec.frame
+
+
+class _RingSegment:
+    __slots__ = ("path", "first_seq", "index", "started", "size", "file", "index_path", "index_file")
+
+    def __init__(self, path, first_seq, started):
+        self.path = path
+        self.first_seq = first_seq
+        self.index = PacketIndex()  # строка i — пакет first_seq + i
+        self.started = started
+        self.size = 0
+        self.file = None
+        self.index_path = os.path.splitext(path)[0] + ".idx"
+        self.index_file = None
+
+
+class PcapRingWriter:
+    """Фоновая запись кадров в кольцо pcap-файлов (N файлов x M байт / T секунд).
+
+    submit() не блокирует: при переполнении очереди кадр отбрасывается и
+    учитывается в dropped. Кадр адресуется порядковым номером (seq).
+    Ошибка записи (OSError, например, диск полон) останавливает поток; она
+    поднимается один раз — из ближайшего submit() или из close(), — после
+    чего кадры только отбрасываются.
+    Рядом с каждым сегментом пишется индекс (.idx, см. PacketIndex), по
+    которому query() отбирает пакеты без чтения pcap.
+    """
+
+    def __init__(self, directory, max_files=RING_MAX_FILES, max_bytes=RING_FILE_MB << 20,
+                 rotate_sec=RING_ROTATE_SEC, queue_size=RING_QUEUE_SIZE):
+        self.directory = directory
+        self.max_files = max(1, max_files)
+        self.max_bytes = max_bytes
+        self.rotate_sec = rotate_sec
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self._error_raised = False
+        self._next_seq = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segments = deque()
+        self._lock = threading.Lock()  # сегменты/файл: writer vs. чтение из GUI
+        self._prefix = datetime.now().strftime("ring_%Y%m%d_%H%M%S")
+        self._file_no = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, rec):
+        if self.error is not None:
+            self.dropped += 1
+            self._raise_error()
+            return None
+        try:
+            self._queue.put_nowait((self._next_seq, rec))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        self._next_seq += 1
+        return self._next_seq - 1
+
+    def close(self):
+        # После ошибки очередь никто не разбирает: блокирующий put(None) повис бы
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=RING_CLOSE_POLL_SEC)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        if self.error is not None:
+            self._raise_error()
+
+    def _raise_error(self):
+        if not self._error_raised:
+            self._error_raised = True
+            raise self.error
+
+    @property
+    def file_count(self):
+        return len(self._segments)
+
+    def _segment_of(self, seq):
+        for seg in reversed(self._segments):
+            if seg.first_seq <= seq:
+                return seg if seq - seg.first_seq < len(seg.index) else None
+        return None
+
+    def span(self):
+        # -> (первый seq в кольце, число проиндексированных пакетов)
+        with self._lock:
+            if not self._segments:
+                return 0, 0
+            first, last = self._segments[0], self._segments[-1]
+            return first.first_seq, last.first_seq + len(last.index) - first.first_seq
+
+    def rows(self, seqs):
+        # -> [(seq, ts, src, dst, proto, sport, dport, len) или None, если вытеснен]
+        with self._lock:
+            out = []
+            for seq in seqs:
+                seg = self._segment_of(seq)
+                out.append((seq,) + seg.index.row(seq - seg.first_seq) if seg else None)
+            return out
+
+    def query(self, flt):
+        # -> array номеров пакетов под фильтром; читаются только колонки индекса
+        with self._lock:
+            segments = list(self._segments)
+        out = array("Q")
+        for seg in segments:
+            out.extend(map(seg.first_seq.__add__, seg.index.select(flt)))
+        return out
+
+    def read(self, seq):
+        # -> (ts, frame) или None, если пакет уже вытеснен из кольца
+        with self._lock:
+            seg = self._segment_of(seq)
+            if seg is None:
+                return None
+            offset = seg.index.offset[seq - seg.first_seq]
+            if seg.file is not None:
+                seg.file.flush()
+            with open(seg.path, "rb") as f:
+                f.seek(offset)
+                sec, usec, caplen, _ = _PCAP_REC.unpack(f.read(16))
+                return sec + usec * 1e-6, f.read(caplen)
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while item is not None and len(batch) < RING_BATCH:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                with self._lock:
+                    for entry in batch:
+                        if entry is None:
+                            self._close_current()
+                            return
+                        self._write(*entry)
+        except OSError as e:
+            self.error = e
+            with self._lock:
+                self._close_current()
+
+    def _write(self, seq, rec):
+        ts, frame = rec.ts, rec.frame
+        seg = self._segments[-1] if self._segments else None
+        if seg is None or seg.file is None or seg.size >= self.max_bytes or (
+                self.rotate_sec and ts - seg.started >= self.rotate_sec):
+            seg = self._rotate(seq, ts)
+        sec = int(ts)
+        seg.index_file.write(seg.index.append(seg.size, rec))
+        seg.file.write(_PCAP_REC.pack(sec, int((ts - sec) * 1e6), len(frame), rec.wirelen))
+        seg.file.write(frame)
+        seg.size += 16 + len(frame)
+        self.written += 1
+
+    def _rotate(self, seq, ts):
+        self._close_current()
+        self._file_no += 1
+        path = os.path.join(self.directory, f"{self._prefix}_{self._file_no:05d}.pcap")
+        seg = _RingSegment(path, seq, ts)
+        seg.file = open(path, "wb", buffering=RING_WRITE_BUFFER)
+        seg.file.write(_PCAP_GLOBAL_HDR)
+        seg.size = len(_PCAP_GLOBAL_HDR)
+        seg.index_file = open(seg.index_path, "wb", buffering=RING_WRITE_BUFFER)
+        seg.index_file.write(_INDEX_MAGIC)
+        self._segments.append(seg)
+        while len(self._segments) > self.max_files:
+            old = self._segments.popleft()
+            for path in (old.path, old.index_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return seg
+
+    def _close_current(self):
+        if self._segments and self._segments[-1].file is not None:
+            seg = self._segments[-1]
+            seg.file.close()
+            seg.file = None
+            if seg.index_file is not None:
+                seg.index_file.close()
+                seg.index_file = None
+
+
+def _parse_ring_spec(text):
+    # "10x100,300" -> (10 файлов, 100 МБ, ротация раз в 300 с); время опционально
+    size_part, _, sec_part = text.replace(" ", "").partition(",")
+    files, _, mb = size_part.lower().partition("x")
+    return int(files), int(mb), float(sec_part) if sec_part else 0.0
+
+
+# --- АГРЕГАЦИЯ АНАЛИТИКИ ---
+class RateMeter:
+    """Скользящие окна (1/10/60 с) поверх кольца корзин фиксированного размера.
+
+    Память не зависит от скорости трафика. add() и rates() — O(1): суммы окон
+    ведутся инкрементально, при сдвиге головы вычитается выпавшая корзина.
+    """
+
+    def __init__(self, bucket_sec=RATE_BUCKET_SEC, windows=RATE_WINDOWS_SEC):
+        self.bucket_sec = bucket_sec
+        self.windows = windows
+        self.spans = [max(1, round(w / bucket_sec)) for w in windows]
+        self.size = max(self.spans)
+        self.bytes = [0] * self.size
+        self.packets = [0] * self.size
+        self.win_bytes = [0] * len(windows)
+        self.win_packets = [0] * len(windows)
+        self.head = None  # номер самой новой корзины
+        self.first = None
+        self.peak_bps = 0.0  # по самому короткому окну
+        self.peak_pps = 0.0
+
+    def bucket(self, ts):
+        return int(ts / self.bucket_sec)
+
+    def add(self, ts, size, packets=1):
+        self.add_bucket(int(ts / self.bucket_sec), size, packets)
+
+    def add_bucket(self, idx, size, packets):
+        if self.head is None:
+            self.head = self.first = idx
+        elif idx > self.head:
+            self._advance(idx)
+        elif idx <= self.head - self.size:
+            return  # старше самого длинного окна
+        slot = idx % self.size
+        self.bytes[slot] += size
+        self.packets[slot] += packets
+        age = self.head - idx
+        for i, span in enumerate(self.spans):
+            if age < span:
+                self.win_bytes[i] += size
+                self.win_packets[i] += packets
+        short = self.windows[0]
+        self.peak_bps = max(self.peak_bps, self.win_bytes[0] / short)
+        self.peak_pps = max(self.peak_pps, self.win_packets[0] / short)
+
+    def _advance(self, idx):
+        size = self.size
+        if idx - self.head >= size:
+            self.bytes = [0] * size
+            self.packets = [0] * size
+            self.win_bytes = [0] * len(self.spans)
+            self.win_packets = [0] * len(self.spans)
+            self.head = idx
+            return
+        for h in range(self.head + 1, idx + 1):
+            for i, span in enumerate(self.spans):
+                old = (h - span) % size
+                self.win_bytes[i] -= self.bytes[old]
+                self.win_packets[i] -= self.packets[old]
+            slot = h % size
+            self.bytes[slot] = 0
+            self.packets[slot] = 0
+        self.head = idx
+
+    def rates(self, now=None):
+        # -> {окно_сек: (байт/с, пакетов/с)}; now сдвигает окна без трафика
+        if self.head is None:
+            return {w: (0.0, 0.0) for w in self.windows}
+        if now is not None:
+            idx = int(now / self.bucket_sec)
+            if idx > self.head:
+                self._advance(idx)
+        seen = (self.head - self.first + 1) * self.bucket_sec
+        out = {}
+        for w, b, p in zip(self.windows, self.win_bytes, self.win_packets):
+            elapsed = min(w, seen)
+            out[w] = (b / elapsed, p / elapsed)
+        return out
+
+
+class SpaceSaving:
+    """Top-K тяжелых ключей (Space-Saving) в фиксированной памяти.
+
+    Для каждого ключа хранится [count, err, payload]: истинный вес лежит в
+    [count - err, count], а err <= total / capacity. Вытесняется ключ с
+    минимальным count (ленивая куча: устаревшие записи обновляются при pop).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        self.total = 0
+        self._heap = []  # (count, key), count может отставать от entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def offer(self, key, weight=1, err=0):
+        self.total += weight
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += weight
+            entry[1] += err
+            return entry
+        if len(self.entries) < self.capacity:
+            entry = self.entries[key] = [weight, err, None]
+            heapq.heappush(self._heap, (weight, key))
+            return entry
+        heap = self._heap
+        entries = self.entries
+        while True:
+            count, victim = heap[0]
+            actual = entries[victim][0]
+            if actual == count:
+                break
+            heapq.heapreplace(heap, (actual, victim))
+        del entries[victim]
+        entry = entries[key] = [count + weight, count + err, None]
+        heapq.heapreplace(heap, (count + weight, key))
+        return entry
+
+    def top(self, k):
+        return heapq.nlargest(k, self.entries.items(), key=lambda item: item[1][0])
+
+    @property
+    def max_error(self):
+        return self.total // self.capacity if len(self.entries) >= self.capacity else 0
+
+
+# --- КЛАССИФИКАЦИЯ ПРИЛОЖЕНИЙ ---
+# Порт сервера -> приложение, если сигнатуры полезной нагрузки промолчали
+APP_PORTS = (
+    ("HTTP", IPPROTO_TCP, (80, 8000, 8008, 8080, 8888)),
+    ("TLS", IPPROTO_TCP, (443, 465, 563, 636, 853, 989, 990, 992, 993, 994, 995, 5061, 8443)),
+    ("SSH", IPPROTO_TCP, (22,)),
+    ("DNS", IPPROTO_TCP, (53,)),
+    ("DNS", IPPROTO_UDP, (53,)),
+    ("mDNS", IPPROTO_UDP, (5353,)),
+    ("QUIC", IPPROTO_UDP, (443,)),
+    ("DHCP", IPPROTO_UDP, (67, 68)),
+    ("NTP", IPPROTO_UDP, (123,)),
+    ("SSDP", IPPROTO_UDP, (1900,)),
+    ("NetBIOS", IPPROTO_UDP, (137, 138)),
+    ("SMB", IPPROTO_TCP, (139, 445)),
+    ("RDP", IPPROTO_TCP, (3389,)),
+    ("SMTP", IPPROTO_TCP, (25, 587)),
+    ("IMAP", IPPROTO_TCP, (143,)),
+    ("POP3", IPPROTO_TCP, (110,)),
+    ("FTP", IPPROTO_TCP, (20, 21)),
+    ("MySQL", IPPROTO_TCP, (3306,)),
+    ("PostgreSQL", IPPROTO_TCP, (5432,)),
+    ("SNMP", IPPROTO_UDP, (161, 162)),
+    ("Syslog", IPPROTO_UDP, (514,)),
+)
+_HTTP_STARTS = (b"GET ", b"POST ", b"HEAD ", b"PUT ", b"DELETE ", b"OPTIONS ", b"PATCH ", b"CONNECT ", b"HTTP/1.")
+_QUIC_VERSIONS = (0x00000001, 0x6B3343CF)  # v1, v2; черновики — 0xff0000xx
+_TLS_EXT = struct.Struct("!HH")
+
+
+def _compile_port_table(spec):
+    # Список на 65536 портов для TCP и UDP: индексация без хэширования кортежей
+    tables = {IPPROTO_TCP: [None] * 65536, IPPROTO_UDP: [None] * 65536}
+    for app, proto, ports in spec:
+        for port in ports:
+            tables[proto][port] = app
+    return tables
+
+
+APP_PORT_TABLE = _compile_port_table(APP_PORTS)
+
+
+def port_app(proto, server_port, client_port):
+    table = APP_PORT_TABLE.get(proto)
+    if table is None:
+        return PROTO_NAMES.get(proto, "OTHER")
+    return table[server_port] or table[client_port] or f"{PROTO_NAMES[proto]}/other"
+
+
+def tls_sni(data):
+    # server_name из ClientHello; пусто, если ClientHello не целиком в первых байтах
+    if len(data) < 44 or data[5] != 1:
+        return ""
+    off = 43  # запись (5) + заголовок handshake (4) + версия (2) + random (32)
+    try:
+        off += 1 + data[off]  # session id
+        off += 2 + int.from_bytes(data[off:off + 2], "big")  # cipher suites
+        off += 1 + data[off]  # compression
+        end = min(len(data), off + 2 + int.from_bytes(data[off:off + 2], "big"))
+        off += 2
+        while off + 4 <= end:
+            ext_type, ext_len = _TLS_EXT.unpack_from(data, off)
+            off += 4
+            if ext_type == 0:
+                # список: длина (2), тип имени (1), длина имени (2), имя
+                if off + 5 <= end and data[off + 2] == 0:
+                    n = int.from_bytes(data[off + 3:off + 5], "big")
+                    return data[off + 5:off + 5 + n].decode("ascii", "replace")
+                return ""
+            off += ext_len
+    except IndexError:
+        pass
+    return ""
+
+
+def _header_line(data, name):
+    # Значение заголовка HTTP без разбора всего запроса
+    i = data.lower().find(b"\r\n" + name + b":")
+    if i < 0:
+        return ""
+    start = i + len(name) + 3
+    end = data.find(b"\r\n", start)
+    return data[start:end if end >= 0 else len(data)].strip().decode("ascii", "replace")
+
+
+def _looks_like_dns(data):
+    # DNS на нестандартном порту: один вопрос, opcode QUERY, правдоподобные счетчики
+    if len(data) < 17:
+        return None
+    _txid, flags, qd, an, ns, ar = _DNS_HDR.unpack_from(data, 0)
+    if qd != 1 or flags & 0x7840 or an > 64 or ns > 64 or ar > 64:
+        return None
+    return _read_qname(data, 12)
+
+
+def match_signature(data, proto):
+    """(приложение, подробность) по началу полезной нагрузки потока или None."""
+    if proto == IPPROTO_TCP:
+        if len(data) >= 6 and data[1] == 3 and data[2] <= 4:
+            if data[0] == 0x16:
+                return "TLS", tls_sni(data)
+            if 0x14 <= data[0] <= 0x17:
+                return "TLS", ""  # поток пойман посередине, после рукопожатия
+        if data.startswith(b"SSH-"):
+            return "SSH", data.split(b"\r\n", 1)[0][:48].decode("ascii", "replace")
+        if data.startswith(_HTTP_STARTS):
+            return "HTTP", _header_line(data, b"host")
+        qname = _looks_like_dns(data[2:])  # DNS over TCP: двухбайтовая длина
+        if qname:
+            return "DNS", qname
+    elif proto == IPPROTO_UDP:
+        if len(data) >= 5 and data[0] & 0xC0 == 0xC0:
+            version = int.from_bytes(data[1:5], "big")
+            if version in _QUIC_VERSIONS or version >> 8 == 0xFF0000:
+                return "QUIC", ""
+        qname = _looks_like_dns(data)
+        if qname:
+            return "DNS", qname
+    return None
+
+
+def classify_flow(flow, rec):
+    # Сигнатуры видят только первую полезную нагрузку потока (до APP_INSPECT_BYTES):
+    # дальше приложение берется из кэша в Flow, и стоимость пакета постоянна.
+    # Совпадение в середине потока было бы случайным, поэтому решение окончательное
+    start = rec.l4_payload
+    data = rec.frame[start:start + APP_INSPECT_BYTES]
+    if not data:
+        return  # SYN/ACK без данных
+    flow.classified = True
+    hit = match_signature(data, flow.proto)
+    if hit is not None:
+        flow.app, flow.app_detail = hit
+
+
+# --- ТАБЛИЦА ПОТОКОВ ---
+class TimerWheel:
+    """Колесо таймеров: слот на тик, элемент живет ровно в одном слоте."""
+
+    def __init__(self, slots=FLOW_WHEEL_SLOTS, tick=FLOW_WHEEL_TICK_SEC):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.current = None
+
+    def schedule(self, key, item, when):
+        n = len(self.slots)
+        t = int(when / self.tick)
+        if self.current is not None:
+            # Дальше горизонта колеса — перепроверим при срабатывании слота
+            t = min(max(t, self.current + 1), self.current + n - 1)
+        slot = t % n
+        self.slots[slot][key] = item
+        return slot
+
+    def remove(self, key, slot):
+        self.slots[slot].pop(key, None)
+
+    def advance(self, now):
+        # -> элементы из слотов, чье время наступило
+        t = int(now / self.tick)
+        if self.current is None or t <= self.current:
+            if self.current is None:
+                self.current = t
+            return []
+        n = len(self.slots)
+        due = []
+        for step in range(1, min(t - self.current, n) + 1):
+            slot = (self.current + step) % n
+            if self.slots[slot]:
+                due.extend(self.slots[slot].values())
+                self.slots[slot] = {}
+        self.current = t
+        return due
+
+
+class Flow:
+    __slots__ = ("key", "proto", "client", "cport", "server", "sport", "client_ep", "server_ep",
+                 "first", "last", "c_pkts", "c_bytes", "s_pkts", "s_bytes",
+                 "state", "syn_ts", "rtt", "fins", "slot", "app", "app_detail", "classified")
+
+    def __init__(self, key, rec, client_is_src):
+        self.key = key
+        self.proto = rec.proto
+        if client_is_src:
+            self.client, self.cport, self.server, self.sport = rec.src, rec.sport, rec.dst, rec.dport
+        else:
+            self.client, self.cport, self.server, self.sport = rec.dst, rec.dport, rec.src, rec.sport
+        self.client_ep = _endpoint(self.client, self.cport, self.proto)
+        self.server_ep = _endpoint(self.server, self.sport, self.proto)
+        self.first = self.last = rec.ts
+        self.c_pkts = self.c_bytes = self.s_pkts = self.s_bytes = 0
+        self.state = "NEW" if self.proto == IPPROTO_TCP else "ACTIVE"
+        self.syn_ts = None
+        self.rtt = None
+        self.fins = 0  # бит 1 — FIN клиента, бит 2 — FIN сервера
+        self.slot = None
+        # Догадка по порту, пока сигнатуры не нашли ничего точнее
+        self.app = port_app(self.proto, self.sport, self.cport)
+        self.app_detail = ""
+        self.classified = self.proto not in (IPPROTO_TCP, IPPROTO_UDP)
+
+    def row(self):
+        # Кортеж для вкладки Flows; приложение — последним, см. FLOW_COLUMNS
+        return (self.client_ep, self.server_ep, PROTO_NAMES.get(self.proto, str(self.proto)), self.state,
+                self.c_pkts, self.c_bytes, self.s_pkts, self.s_bytes, self.c_bytes + self.s_bytes,
+                self.rtt * 1000 if self.rtt is not None else -1.0, self.first, self.last,
+                f"{self.app} {self.app_detail}" if self.app_detail else self.app)
+
+
+def _endpoint(ip, port, proto):
+    if proto not in (IPPROTO_TCP, IPPROTO_UDP):
+        return ip
+    return f"[{ip}]:{port}" if ":" in ip else f"{ip}:{port}"
+
+
+class FlowTable:
+    """Двунаправленная таблица 5-tuple потоков с состоянием TCP.
+
+    Простаивающие потоки вытесняются колесом таймеров, при переполнении
+    max_flows — самые старые по времени создания. Публикуются только
+    изменения (changes): строки тронутых потоков и ключи вытесненных.
+    """
+
+    def __init__(self, max_flows=FLOW_TABLE_MAX, idle_sec=FLOW_IDLE_SEC, closed_sec=FLOW_CLOSED_IDLE_SEC):
+        self.max_flows = max_flows
+        self.idle_sec = idle_sec
+        self.closed_sec = closed_sec
+        self.flows = OrderedDict()
+        self.wheel = TimerWheel()
+        self.evicted_idle = 0
+        self.evicted_full = 0
+        self.changed = {}  # ключ -> поток, тронутый после прошлой публикации
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.flows)
+
+    def update(self, rec):
+        src, dst, sp, dp, proto = rec.src, rec.dst, rec.sport, rec.dport, rec.proto
+        if (src, sp) <= (dst, dp):
+            key = (src, sp, dst, dp, proto)
+        else:
+            key = (dst, dp, src, sp, proto)
+        flow = self.flows.get(key)
+        flags = rec.tcp_flags
+        if flow is None:
+            if len(self.flows) >= self.max_flows:
+                _, old = self.flows.popitem(last=False)
+                self.wheel.remove(old.key, old.slot)
+                self.evicted_full += 1
+                self._forget(old.key)
+            # Первым пойман SYN-ACK: клиент — получатель
+            flow = Flow(key, rec, not (flags is not None and "S" in flags and "A" in flags))
+            self.flows[key] = flow
+            flow.slot = self.wheel.schedule(key, flow, rec.ts + self.idle_sec)
+
+        from_client = src == flow.client and sp == flow.cport
+        if from_client:
+            flow.c_pkts += 1
+            flow.c_bytes += rec.wirelen
+        else:
+            flow.s_pkts += 1
+            flow.s_bytes += rec.wirelen
+        flow.last = rec.ts
+        if not flow.classified and rec.l4_payload >= 0:
+            classify_flow(flow, rec)
+        if flags is not None:
+            was_open = flow.state not in ("CLOSED", "RESET")
+            self._tcp_update(flow, flags, from_client, rec.ts)
+            if was_open and flow.state in ("CLOSED", "RESET"):
+                # Закрытый поток держим только closed_sec
+                self.wheel.remove(key, flow.slot)
+                flow.slot = self.wheel.schedule(key, flow, rec.ts + self.closed_sec)
+        self.changed[key] = flow
+        return flow
+
+    @staticmethod
+    def _tcp_update(flow, flags, from_client, ts):
+        if "R" in flags:
+            flow.state = "RESET"
+        elif "S" in flags:
+            if "A" not in flags:
+                if flow.syn_ts is None:
+                    flow.syn_ts = ts
+                if flow.state == "NEW":
+                    flow.state = "SYN_SENT"
+            elif not from_client:
+                # RTT по SYN -> SYN-ACK, как его видит точка захвата
+                if flow.syn_ts is not None and flow.rtt is None:
+                    flow.rtt = ts - flow.syn_ts
+                if flow.state in ("NEW", "SYN_SENT"):
+                    flow.state = "SYN_RCVD"
+        elif "F" in flags:
+            flow.fins |= 1 if from_client else 2
+            flow.state = "CLOSED" if flow.fins == 3 else "FIN_WAIT"
+        elif flow.state == "SYN_RCVD" and from_client:
+            flow.state = "ESTABLISHED"
+        elif flow.state == "NEW":
+            flow.state = "MIDSTREAM"  # поток начался до захвата
+
+    def expire(self, now):
+        for flow in self.wheel.advance(now):
+            timeout = self.closed_sec if flow.state in ("CLOSED", "RESET") else self.idle_sec
+            deadline = flow.last + timeout
+            if deadline <= now:
+                del self.flows[flow.key]
+                self.evicted_idle += 1
+                self._forget(flow.key)
+            else:
+                flow.slot = self.wheel.schedule(flow.key, flow, deadline)
+
+    def _forget(self, key):
+        self.changed.pop(key, None)
+        self.removed.add(key)
+
+    def changes(self):
+        # -> ({ключ: строка} тронутых потоков, [вытесненные ключи]); накопленное сбрасывается.
+        # Получатель сначала удаляет, потом обновляет: ключ мог уйти и появиться снова.
+        rows = {key: flow.row() for key, flow in self.changed.items()}
+        removed = list(self.removed)
+        self.changed.clear()
+        self.removed.clear()
+        return rows, removed
+
+
+# --- DNS-ТРАНЗАКЦИИ ---
+# Статистика DNS — плоский список: счетчики, затем гистограмма задержек;
+# дельты и состояние складываются поэлементно
+DNS_QUERIES, DNS_ANSWERED, DNS_NXDOMAIN, DNS_SERVFAIL, DNS_LOST = range(5)
+_DNS_HIST = 5
+_DNS_STAT_LEN = _DNS_HIST + len(DNS_LATENCY_EDGES_MS) + 1
+
+
+def new_dns_stats():
+    return [0] * _DNS_STAT_LEN
+
+
+def dns_percentile(stats, q):
+    # Квантиль задержки (мс) по гистограмме, линейно внутри корзины; None без ответов
+    hist = stats[_DNS_HIST:]
+    total = sum(hist)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    edges = DNS_LATENCY_EDGES_MS
+    for i, count in enumerate(hist):
+        if count and seen + count >= rank:
+            lo = edges[i - 1] if i else 0.0
+            hi = edges[i] if i < len(edges) else edges[-1] * 2
+            return lo + (hi - lo) * (rank - seen) / count
+        seen += count
+    return edges[-1]
+
+
+def _merge_dns_stats(table, key, stats, limit):
+    row = table.get(key)
+    if row is None:
+        if len(table) >= limit:
+            key = "(other)"
+            row = table.get(key)
+        if row is None:
+            row = table[key] = new_dns_stats()
+    for i, value in enumerate(stats):
+        if value:
+            row[i] += value
+
+
+class DnsTransactions:
+    """Пары запрос/ответ DNS по (клиент, порт, сервер, порт, протокол, txid).
+
+    Открытые запросы лежат в OrderedDict в порядке поступления, так что
+    истекшие по DNS_TX_TIMEOUT_SEC снимаются с головы, а при переполнении
+    вытесняется самый старый. Статистика интервала ведется по серверам и по
+    запрошенным именам и сбрасывается после каждой публикации; открытые
+    запросы переживают интервалы.
+    """
+
+    def __init__(self, timeout=DNS_TX_TIMEOUT_SEC, max_pending=DNS_TX_PENDING_MAX):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # ключ -> (время запроса, имя)
+        self.overflow = 0
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.resolvers = {}
+        self.domains = {}
+
+    def _stats(self, server, qname):
+        resolver = self.resolvers.get(server)
+        if resolver is None:
+            resolver = self.resolvers[server] = new_dns_stats()
+        domain = self.domains.get(qname)
+        if domain is None:
+            if len(self.domains) >= DELTA_SKETCH_CAPACITY:
+                qname = "(other)"
+            domain = self.domains.get(qname)
+            if domain is None:
+                domain = self.domains[qname] = new_dns_stats()
+        return resolver, domain
+
+    def observe(self, rec, qname):
+        off = rec.l4_payload
+        if rec.proto == IPPROTO_TCP:
+            off += 2
+        if len(rec.frame) < off + 12:
+            return
+        txid, flags = struct.unpack_from("!HH", rec.frame, off)
+        if rec.dport == 53 and not flags & 0x8000:
+            key = (rec.src, rec.sport, rec.dst, rec.dport, rec.proto, txid)
+            if key in self.pending:
+                return  # повтор запроса: задержка считается от первой отправки
+            if len(self.pending) >= self.max_pending:
+                self._lost(*self.pending.popitem(last=False))
+                self.overflow += 1
+            self.pending[key] = (rec.ts, qname)
+            for stats in self._stats(rec.dst, qname):
+                stats[DNS_QUERIES] += 1
+        elif rec.sport == 53 and flags & 0x8000:
+            key = (rec.dst, rec.dport, rec.src, rec.sport, rec.proto, txid)
+            sent = self.pending.pop(key, None)
+            if sent is None:
+                return  # ответ на запрос до начала захвата или уже вытесненный
+            bucket = _DNS_HIST + bisect.bisect_left(DNS_LATENCY_EDGES_MS, (rec.ts - sent[0]) * 1000)
+            rcode = flags & 0x000F
+            for stats in self._stats(rec.src, sent[1]):
+                stats[DNS_ANSWERED] += 1
+                stats[bucket] += 1
+                if rcode == 3:
+                    stats[DNS_NXDOMAIN] += 1
+                elif rcode == 2:
+                    stats[DNS_SERVFAIL] += 1
+
+    def _lost(self, key, sent):
+        for stats in self._stats(key[2], sent[1]):
+            stats[DNS_LOST] += 1
+
+    def expire(self, now):
+        pending = self.pending
+        deadline = now - self.timeout
+        while pending:
+            key, sent = next(iter(pending.items()))
+            if sent[0] > deadline:
+                break
+            del pending[key]
+            self._lost(key, sent)
+
+
+# --- ДЕТЕКТОР АНОМАЛИЙ ---
+# Флаги по _TCP_FLAG_STR: SYN открытия соединения (с ECN — ECE+CWR) и ответный SYN-ACK
+SYN_FLAGS = frozenset(("S", "SEC"))
+SYN_ACK_FLAGS = frozenset(("SA", "SAE"))
+_HLL_POW = tuple(2.0 ** -i for i in range(34))
+
+
+def hll_hash(data):
+    # Стабильный между процессами 32-битный хэш: скетчи воркеров конвейера сливаются
+    return int.from_bytes(hashlib.blake2b(data, digest_size=4).digest(), "little")
+
+
+class HyperLogLog:
+    """Оценка числа различных значений на 2^p байтах; ошибка ~1.04/sqrt(2^p)."""
+
+    __slots__ = ("registers",)
+
+    def __init__(self, p=HLL_PRECISION):
+        self.registers = bytearray(1 << p)
+
+    def add(self, h):
+        # Младшие p бит хэша выбирают регистр, по остальным — позиция первой единицы
+        regs = self.registers
+        p = len(regs).bit_length() - 1
+        idx = h & (len(regs) - 1)
+        rank = 33 - p - (h >> p).bit_length()
+        if rank > regs[idx]:
+            regs[idx] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        regs = self.registers
+        m = len(regs)
+        est = 0.7213 / (1 + 1.079 / m) * m * m / sum(map(_HLL_POW.__getitem__, regs))
+        zeros = regs.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)  # линейный счет для малых значений
+        return est
+
+
+class ScanTracker:
+    """Попытки соединений по инициаторам за интервал публикации потока захвата.
+
+    Считаются только новые потоки (TCP — с SYN), так что на пакеты
+    установленных соединений приходится одна проверка в агрегаторе.
+    """
+
+    def __init__(self, limit=DETECT_TRACK_MAX):
+        self.limit = limit
+        self.sources = {}  # инициатор -> [порты HLL, хосты HLL, SYN]
+        self.answered = defaultdict(int)  # инициатор -> полученных SYN-ACK
+        self.arp_replies = defaultdict(int)  # адрес отправителя -> ARP-ответов
+
+    def __bool__(self):
+        return bool(self.sources or self.answered or self.arp_replies)
+
+    def attempt(self, flow, flags):
+        proto = flow.proto
+        syn = proto == IPPROTO_TCP
+        if syn and flags not in SYN_FLAGS:
+            return  # поток пойман с середины
+        row = self.sources.get(flow.client)
+        if row is None:
+            if len(self.sources) >= self.limit:
+                return
+            row = self.sources[flow.client] = [HyperLogLog(), HyperLogLog(), 0]
+        if proto == IPPROTO_TCP or proto == IPPROTO_UDP:
+            row[0].add(hll_hash(_PORTS.pack(flow.sport, proto)))
+        row[1].add(hll_hash(flow.server.encode()))
+        if syn:
+            row[2] += 1
+
+    def syn_ack(self, client):
+        if client in self.sources or len(self.answered) < self.limit:
+            self.answered[client] += 1
+
+    def arp_reply(self, rec):
+        if len(rec.frame) >= rec.l3_offset + _ARP.size:
+            _, ptype, _, _, op, _, spa, _, _ = _ARP.unpack_from(rec.frame, rec.l3_offset)
+            if op == 2 and ptype == ETH_P_IP and len(self.arp_replies) < self.limit:
+                self.arp_replies[socket.inet_ntoa(spa)] += 1
+
+
+class AnomalyDetector:
+    """Потоковый детектор сканов, ARP-штормов и всплесков полосы поверх дельт.
+
+    Вызывается владельцем состояния (drain). Сканы и ARP считаются в окнах
+    window секунд по времени пакетов: скетчи HyperLogLog из дельт сливаются,
+    память ограничена DETECT_TRACK_MAX инициаторами. Граница окна проходит по
+    дельтам, поэтому при воспроизведении на максимальной скорости окно не
+    короче интервала публикации. Всплеск полосы — z-оценка
+    посекундного трафика против EWMA среднего и дисперсии.
+    observe(delta) -> тексты новых тревог.
+    """
+
+    def __init__(self, window=DETECT_WINDOW_SEC):
+        self.window = window
+        self.counts = dict.fromkeys(ALERT_KINDS, 0)
+        self.recent = deque(maxlen=DETECT_RECENT_ALERTS)  # (время пакета, вид, текст)
+        self._open_window(None)
+        self.seconds = defaultdict(int)  # незакрытая секунда -> байты
+        self.bw_closed = None  # последняя закрытая секунда
+        self.bw_mean = None
+        self.bw_var = 0.0
+        self.bw_seen = 0
+
+    def _open_window(self, start):
+        self.window_start = start
+        self.sources = {}  # инициатор -> [порты HLL, хосты HLL, SYN, SYN-ACK]
+        self.arp_replies = defaultdict(int)
+        self.alerted = set()  # (вид, ключ) — одна тревога за окно
+
+    def _alert(self, alerts, kind, key, ts, text):
+        if (kind, key) in self.alerted:
+            return
+        self.alerted.add((kind, key))
+        self.counts[kind] += 1
+        self.recent.append((ts, kind, text))
+        alerts.append(text)
+
+    def observe(self, delta):
+        alerts = []
+        ts = delta["ts"]
+        if ts:
+            if self.window_start is None:
+                self.window_start = ts
+            elif ts - self.window_start >= self.window:
+                self._close_window(alerts, ts)
+                self._open_window(ts)
+        scans = delta.get("scans")
+        if scans is not None:
+            self._merge_scans(alerts, ts, *scans)
+        self._observe_bandwidth(alerts, delta["bandwidth"])
+        if delta.get("final"):
+            self._close_window(alerts, ts)
+            self._open_window(None)
+        return alerts
+
+    def _merge_scans(self, alerts, ts, sources, answered, arp_replies):
+        window = self.window
+        rows = self.sources
+        for client, (ports, hosts, syns) in sources.items():
+            row = rows.get(client)
+            if row is None:
+                if len(rows) >= DETECT_TRACK_MAX:
+                    continue
+                row = rows[client] = [ports, hosts, syns, 0]
+            else:
+                row[0].merge(ports)
+                row[1].merge(hosts)
+                row[2] += syns
+            # Оценки в окне только растут: проверка сразу, без ожидания конца окна
+            if ("port_scan", client) not in self.alerted:
+                n = row[0].count()
+                if n >= DETECT_SCAN_PORTS:
+                    self._alert(alerts, "port_scan", client, ts,
+                                f"Port scan suspected: {client} tried ~{n:.0f} distinct ports in {window}s")
+            if ("host_sweep", client) not in self.alerted:
+                n = row[1].count()
+                if n >= DETECT_SCAN_HOSTS:
+                    self._alert(alerts, "host_sweep", client, ts,
+                                f"Host sweep suspected: {client} contacted ~{n:.0f} distinct hosts in {window}s")
+        for client, count in answered.items():
+            row = rows.get(client)
+            if row is not None:
+                row[3] += count
+        storms = self.arp_replies
+        for ip, count in arp_replies.items():
+            storms[ip] += count
+            if storms[ip] >= DETECT_ARP_REPLIES:
+                self._alert(alerts, "arp_storm", ip, ts,
+                            f"ARP reply storm: {ip} sent {storms[ip]} ARP replies in {window}s")
+
+    def _close_window(self, alerts, ts):
+        # Доля SYN без ответа — только по целому окну: SYN-ACK приходят на RTT позже
+        for client, (_, _, syns, answered) in self.sources.items():
+            if syns >= DETECT_SYN_MIN and syns - answered >= syns * DETECT_SYN_UNANSWERED:
+                self._alert(alerts, "syn_unanswered", client, ts,
+                            f"SYN without ACK: {client} sent {syns} SYNs, "
+                            f"{(syns - answered) / syns:.0%} unanswered in {self.window}s")
+
+    def _observe_bandwidth(self, alerts, buckets):
+        per_sec = round(1 / RATE_BUCKET_SEC)
+        seconds = self.seconds
+        closed = self.bw_closed
+        for idx, (size, _) in buckets.items():
+            sec = idx // per_sec
+            if closed is None or sec > closed:
+                seconds[sec] += size  # опоздавшие к закрытой секунде байты отбрасываются
+        if not seconds:
+            return
+        upto = max(seconds) - DETECT_BW_LAG_SEC
+        for sec in sorted(s for s in seconds if s <= upto):
+            if closed is not None and sec - closed > 1:
+                # Пауза без трафика — нули, но не больше DETECT_BW_GAP_MAX секунд
+                for i in range(min(sec - closed - 1, DETECT_BW_GAP_MAX)):
+                    self._close_second(alerts, closed + 1 + i, 0)
+            self._close_second(alerts, sec, seconds.pop(sec))
+            closed = sec
+        self.bw_closed = closed
+
+    def _close_second(self, alerts, sec, value):
+        mean = self.bw_mean
+        if mean is None:
+            self.bw_mean = value
+            self.bw_seen = 1
+            return
+        diff = value - mean
+        z = diff / max(math.sqrt(self.bw_var), 1.0)
+        if self.bw_seen >= DETECT_BW_WARMUP_SEC and value >= DETECT_BW_MIN_BPS and z >= DETECT_BW_Z:
+            # Ключ — секунда: отдельные всплески в одном окне не глушат друг друга
+            self._alert(alerts, "bandwidth_spike", sec, sec,
+                        f"Bandwidth spike: {fmt_bytes(value)}/s vs mean {fmt_bytes(mean)}/s (z={z:.1f})")
+        incr = DETECT_BW_ALPHA * diff
+        self.bw_mean = mean + incr
+        self.bw_var = (1 - DETECT_BW_ALPHA) * (self.bw_var + diff * incr)
+        self.bw_seen += 1
+
+    def status(self):
+        return {"total": dict(self.counts),
+                "recent": [{"time": ts, "kind": kind, "text": text} for ts, kind, text in self.recent]}
+
+
+def new_analytics_state():
+    return {
+        "total_packets": 0,
+        "total_bytes": 0,
+        "protocols": defaultdict(int),
+        "tcp_flags": defaultdict(int),
+        # Приложения по классификатору потоков: пакеты и байты
+        "app_packets": defaultdict(int),
+        "app_bytes": defaultdict(int),
+        "dns_queries": SpaceSaving(DNS_SKETCH_CAPACITY),
+        # вес — байты; payload: [packets, to_target, from_target, via_router]
+        "peers": SpaceSaving(PEER_SKETCH_CAPACITY),
+        "bandwidth": RateMeter(),
+        # Таблицы потоков по источникам (поток захвата/воркер): ключ -> строка Flow.row()
+        "flows": {},
+        "flow_stats": {},
+        "flows_version": 0,
+        # DNS: статистика по серверам и по именам (вес в скетче — запросы)
+        "dns_resolvers": {},
+        "dns_domains": SpaceSaving(DNS_SKETCH_CAPACITY),
+        "dns_pending": {},
+        "dns_overflow": 0,
+        # Захват с нескольких интерфейсов: имя -> [packets, bytes, {proto: packets}]
+        "ifaces": {},
+    }
+
+
+def merge_analytics_delta(a, delta):
+    # Вызывается только владельцем состояния (Tk-поток), блокировка не нужна
+    a["total_packets"] += delta["packets"]
+    a["total_bytes"] += delta["bytes"]
+    for key in ("protocols", "tcp_flags", "app_packets", "app_bytes"):
+        target = a[key]
+        for name, count in delta[key].items():
+            target[name] += count
+    dns = a["dns_queries"]
+    for name, (count, err, _) in delta["dns_queries"].entries.items():
+        dns.offer(name, count, err)
+    peers = a["peers"]
+    for ip, (size, err, counters) in delta["peers"].entries.items():
+        entry = peers.offer(ip, size, err)
+        if entry[2] is None:
+            entry[2] = list(counters)
+        else:
+            row = entry[2]
+            for i, value in enumerate(counters):
+                row[i] += value
+    meter = a["bandwidth"]
+    for idx, (size, packets) in sorted(delta["bandwidth"].items()):
+        meter.add_bucket(idx, size, packets)
+    if "dns_tx" in delta:
+        resolvers, domains, pending, overflow = delta["dns_tx"]
+        for server, stats in resolvers.items():
+            _merge_dns_stats(a["dns_resolvers"], server, stats, DNS_RESOLVERS_MAX)
+        sketch = a["dns_domains"]
+        for name, stats in domains.items():
+            entry = sketch.offer(name, stats[DNS_QUERIES]) if stats[DNS_QUERIES] else sketch.entries.get(name)
+            if entry is None:
+                continue  # ответы на имя, уже вытесненное из скетча
+            if entry[2] is None:
+                entry[2] = new_dns_stats()
+            row = entry[2]
+            for i, value in enumerate(stats):
+                if value:
+                    row[i] += value
+        a["dns_pending"][delta["source"]] = pending
+        a["dns_overflow"] += overflow
+    if "flows" in delta:
+        rows, removed = delta["flows"]
+        table = a["flows"].get(delta["source"])
+        if table is None:
+            table = a["flows"][delta["source"]] = {}
+        for key in removed:
+            table.pop(key, None)
+        table.update(rows)
+        a["flow_stats"][delta["source"]] = delta["flow_stats"]
+        if rows or removed:
+            a["flows_version"] += 1
+    if "iface" in delta:
+        row = a["ifaces"].get(delta["iface"])
+        if row is None:
+            row = a["ifaces"][delta["iface"]] = [0, 0, defaultdict(int)]
+        row[0] += delta["packets"]
+        row[1] += delta["bytes"]
+        for name, count in delta["protocols"].items():
+            row[2][name] += count
+
+
+class TrafficAggregator:
+    """Счетчики одного потока захвата.
+
+    Работает без блокировок: поток захвата копит интервал локально и раз в
+    publish_sec отдает в sink готовую дельту, после чего начинает новую.
+    """
+
+    def __init__(self, target_ip, router_ip, sink, source="local", wall_clock=True,
+                 publish_sec=ANALYTICS_PUBLISH_SEC, discovery=True, iface=None):
+        self.discovery = discovery
+        self.iface = iface  # метка дельт для разбивки по интерфейсам; None — без разбивки
+        self.target_ip = target_ip
+        self.router_ip = router_ip
+        self.sink = sink
+        self.source = source
+        self.wall_clock = wall_clock  # False при воспроизведении: время берется из пакетов
+        self.publish_sec = publish_sec
+        self.relevant_total = 0
+        self.flows = FlowTable()
+        self.dns_tx = DnsTransactions()
+        self._dns_overflow = 0
+        self.clock = 0.0
+        self._next_publish = time.monotonic() + publish_sec
+        self._next_flow_publish = 0.0
+        self._clear()
+
+    def _clear(self):
+        self.packets = 0
+        self.bytes = 0
+        self.protocols = defaultdict(int)
+        self.protocol_bytes = defaultdict(int)
+        self.tcp_flags = defaultdict(int)
+        self.app_packets = defaultdict(int)
+        self.app_bytes = defaultdict(int)
+        self.dns_queries = SpaceSaving(DELTA_SKETCH_CAPACITY)
+        self.peers = SpaceSaving(DELTA_SKETCH_CAPACITY)
+        self.bandwidth = {}  # корзина RateMeter -> [байты, пакеты]
+        self._bw_idx = None
+        self._bw_bucket = None
+        self.hosts = {}  # (mac, ip, источник) -> [имя, первое, последнее время]
+        self.dns_answers = {}  # адрес -> имя из перехваченных ответов DNS
+        self.scans = ScanTracker()
+
+    def add(self, rec):
+        if self.discovery and (rec.ethertype == ETH_P_ARP or (
+                rec.proto == IPPROTO_UDP and (rec.sport in DISCOVERY_PORTS or rec.dport in DISCOVERY_PORTS))):
+            self._observe_hosts(rec)
+        src = rec.src
+        dst = rec.dst
+        if src is None:
+            if rec.ethertype == ETH_P_ARP:
+                self.clock = rec.ts
+                self.scans.arp_reply(rec)
+            return False
+        target_ip = self.target_ip
+        router_ip = self.router_ip
+        if not (target_ip in (src, dst) or router_ip in (src, dst)):
+            return False
+
+        size = rec.wirelen
+        self.relevant_total += 1
+        self.clock = rec.ts
+        flow = self.flows.update(rec)
+        if flow.c_pkts + flow.s_pkts == 1:
+            self.scans.attempt(flow, rec.tcp_flags)
+        elif rec.tcp_flags in SYN_ACK_FLAGS:
+            self.scans.syn_ack(dst)
+        app = flow.app
+        self.app_packets[app] += 1
+        self.app_bytes[app] += size
+        self.packets += 1
+        self.bytes += size
+        self.protocols[rec.proto_name] += 1
+        self.protocol_bytes[rec.proto_name] += size
+        idx = int(rec.ts / RATE_BUCKET_SEC)
+        if idx != self._bw_idx:
+            self._bw_idx = idx
+            self._bw_bucket = self.bandwidth.get(idx)
+            if self._bw_bucket is None:
+                self._bw_bucket = self.bandwidth[idx] = [0, 0]
+        self._bw_bucket[0] += size
+        self._bw_bucket[1] += 1
+        if rec.tcp_flags is not None:
+            self.tcp_flags[rec.tcp_flags] += 1
+        qname = parse_dns_qname(rec)
+        if qname:
+            self.dns_queries.offer(qname)
+            if 53 in (rec.sport, rec.dport):
+                self.dns_tx.observe(rec, qname)
+            if rec.sport in DNS_PORTS and len(self.dns_answers) < DELTA_SKETCH_CAPACITY:
+                self.dns_answers.update(parse_dns_answers(rec))
+
+        # payload: [packets, to_target, from_target, via_router]
+        if src == target_ip:
+            peer_ip, direction = dst, 2
+        elif dst == target_ip:
+            peer_ip, direction = src, 1
+        elif src == router_ip:
+            peer_ip, direction = dst, None
+        else:
+            peer_ip, direction = src, None
+        entry = self.peers.offer(peer_ip, size)
+        peer = entry[2]
+        if peer is None:
+            peer = entry[2] = [0, 0, 0, 0]
+        peer[0] += 1
+        if direction is not None:
+            peer[direction] += 1
+        if router_ip in (src, dst):
+            peer[3] += 1
+        return True
+
+    def _observe_hosts(self, rec):
+        for mac, ip, name, source in parse_host_hints(rec):
+            key = (mac, ip, source)
+            seen = self.hosts.get(key)
+            if seen is None:
+                self.hosts[key] = [name, rec.ts, rec.ts]
+            else:
+                seen[0] = name or seen[0]
+                seen[2] = rec.ts
+
+    def maybe_publish(self):
+        now = time.monotonic()
+        if now >= self._next_publish:
+            self._next_publish = now + self.publish_sec
+            self.publish()
+
+    def publish(self, final=False):
+        now = time.monotonic()
+        flows_due = final or now >= self._next_flow_publish
+        if not self.packets and not flows_due and not self.hosts and not self.scans:
+            return
+        delta = {
+            "source": self.source,
+            "ts": self.clock,  # время последнего пакета интервала
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "protocols": self.protocols,
+            "protocol_bytes": self.protocol_bytes,
+            "tcp_flags": self.tcp_flags,
+            "app_packets": self.app_packets,
+            "app_bytes": self.app_bytes,
+            "dns_queries": self.dns_queries,
+            "peers": self.peers,
+            "bandwidth": self.bandwidth,
+        }
+        if self.iface is not None:
+            delta["iface"] = self.iface
+        if final:
+            delta["final"] = True  # конец захвата или файла: детектор закрывает окно
+        if flows_due:
+            # Конец файла при воспроизведении: ответов на открытые запросы уже не будет
+            self.dns_tx.expire(time.time() if self.wall_clock else float("inf") if final else self.clock)
+        dns_tx = self.dns_tx
+        if dns_tx.resolvers or dns_tx.overflow != self._dns_overflow:
+            delta["dns_tx"] = (dns_tx.resolvers, dns_tx.domains, len(dns_tx.pending),
+                               dns_tx.overflow - self._dns_overflow)
+            self._dns_overflow = dns_tx.overflow
+            dns_tx.clear_stats()
+        if self.dns_answers:
+            delta["dns_answers"] = self.dns_answers
+        scans = self.scans
+        if scans:
+            delta["scans"] = (scans.sources, scans.answered, scans.arp_replies)
+        if self.hosts:
+            delta["hosts"] = [(mac, ip, name, first, last, source)
+                              for (mac, ip, source), (name, first, last) in self.hosts.items()]
+        if flows_due:
+            self._next_flow_publish = now + FLOW_PUBLISH_SEC
+            self.flows.expire(time.time() if self.wall_clock else self.clock)
+            delta["flows"] = self.flows.changes()
+            delta["flow_stats"] = (len(self.flows), self.flows.evicted_idle, self.flows.evicted_full)
+        self._clear()
+        self.sink(delta)
+
+
+# --- ПАССИВНОЕ ОБНАРУЖЕНИЕ ХОСТОВ ---
+_OUI_CACHE = {}
+_OUI_TABLE = None
+
+
+def _load_oui_table(path=OUI_FILE):
+    # IEEE MA-L CSV: Registry,Assignment,Organization Name,Organization Address
+    table = {}
+    try:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                parts = line.split(",", 3)
+                if len(parts) >= 3 and len(parts[1]) == 6:
+                    table[parts[1].upper()] = parts[2].strip().strip('"')
+    except OSError:
+        pass
+    return table
+
+
+def lookup_vendor(mac):
+    """Производитель по OUI: manuf-база scapy, затем необязательный OUI_FILE.
+
+    scapy ради вендора не импортируется: его manuf-база используется, только
+    если scapy уже загружен (сокеты, инспектор), иначе — один OUI_FILE.
+    """
+    global _OUI_TABLE
+    oui = mac[:8].upper()
+    vendor = _OUI_CACHE.get(oui)
+    if vendor is not None:
+        return vendor
+    if int(mac[:2], 16) & 0x02:
+        vendor = "(random MAC)"  # локально администрируемый адрес
+    else:
+        vendor = ""
+        scapy = _scapy
+        db = getattr(scapy.conf, "manufdb", None) if scapy is not None else None
+        if db is not None:
+            try:
+                name = db._get_manuf(mac)
+            except Exception:
+                name = None
+            if name and name.upper() != mac.upper():
+                vendor = name
+        if not vendor:
+            if _OUI_TABLE is None:
+                _OUI_TABLE = _load_oui_table()
+            vendor = _OUI_TABLE.get(oui.replace(":", ""), "")
+        if not vendor and scapy is None:
+            return vendor  # не кэшируем: после загрузки scapy найдется в manuf-базе
+    _OUI_CACHE[oui] = vendor
+    return vendor
+
+
+class HostRecord:
+    __slots__ = ("mac", "ip", "hostname", "vendor", "first_seen", "last_seen", "sources")
+
+    def __init__(self, mac, ip, first_seen):
+        self.mac = mac
+        self.ip = ip
+        self.hostname = None
+        self.vendor = lookup_vendor(mac)
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.sources = set()
+
+
+class HostInventory:
+    """Инвентарь IP <-> MAC <-> имя из пассивных наблюдений (ARP, DHCP, mDNS).
+
+    Владелец — Tk-поток; наблюдения приходят в дельтах TrafficAggregator.
+    Имена, увиденные раньше, чем MAC для этого IP, ждут в _names.
+    """
+
+    def __init__(self):
+        self.hosts = {}  # mac -> HostRecord
+        self.by_ip = {}  # ip -> mac
+        self._names = {}  # ip -> имя, пока MAC неизвестен
+        self.version = 0
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def merge(self, observations):
+        for mac, ip, name, first, last, source in observations:
+            if mac is None:
+                mac = self.by_ip.get(ip)
+                if mac is None:
+                    if ip and name:
+                        self._names[ip] = name
+                    continue
+            host = self.hosts.get(mac)
+            if host is None:
+                host = self.hosts[mac] = HostRecord(mac, ip, first)
+                self.version += 1
+            # mDNS объявляет и IPv6 того же хоста — основной адрес берем из ARP/DHCP
+            if ip and host.ip != ip and (host.ip is None or source != "mdns"):
+                host.ip = ip
+                self.version += 1
+            if ip and (source != "mdns" or ip not in self.by_ip):
+                self.by_ip[ip] = mac
+            name = name or self._names.pop(ip, None)
+            if name and host.hostname != name:
+                host.hostname = name
+                self.version += 1
+            host.first_seen = min(host.first_seen, first)
+            host.last_seen = max(host.last_seen, last)
+            host.sources.add(source)
+
+    def nodes(self):
+        # Узлы для NET VISUALIZER
+        return [{"ip": h.ip, "mac": h.mac, "name": h.hostname, "vendor": h.vendor}
+                for h in self.hosts.values() if h.ip]
+
+
+# --- ОФЛАЙН GEOIP / ASN ---
+GEO_UNKNOWN = ("", "", 0, "")  # (страна, город, ASN, организация)
+
+
+class GeoIpDb:
+    """Офлайн GeoIP/ASN по локальным базам диапазонов, без сети.
+
+    Диапазоны из CSV/TSV хранятся отсортированными массивами целых
+    начал/концов (отдельно IPv4 и IPv6), поиск — бисекция, результаты
+    кэшируются в LRU под собственной блокировкой: lookup() зовут и Tk-поток,
+    и поток отчета. Файлы *.mmdb читаются через maxminddb, если он есть.
+
+    CSV с заголовком: колонки start/end (или ip_start/ip_end, range_start/
+    range_end) и любые из country, city, asn, org. Файл без заголовка
+    читается как ip2asn TSV: start, end, asn, country, описание.
+    """
+
+    FIELDS = {
+        "start": ("start", "start_ip", "ip_start", "range_start", "network_start"),
+        "end": ("end", "end_ip", "ip_end", "range_end", "network_end"),
+        "country": ("country", "country_code", "country_iso_code", "cc"),
+        "city": ("city", "city_name"),
+        "asn": ("asn", "as_number", "autonomous_system_number"),
+        "org": ("org", "organization", "isp", "as_name", "as_description", "autonomous_system_organization"),
+    }
+    IP2ASN_COLUMNS = {"start": 0, "end": 1, "asn": 2, "country": 3, "org": 4}
+
+    def __init__(self, cache_size=GEOIP_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.errors = []
+        self._ranges = {4: [], 6: []}  # при загрузке: (start, end, номер записи)
+        self._starts = {4: array("I"), 6: []}
+        self._ends = {4: array("I"), 6: []}
+        self._ids = {4: array("I"), 6: array("I")}
+        self._values = []
+        self._value_ids = {}
+        self._mmdb = []
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    @property
+    def loaded(self):
+        return bool(len(self) or self._mmdb)
+
+    def load_dir(self, directory=GEOIP_DIR):
+        if not os.path.isdir(directory):
+            return self
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            try:
+                if name.endswith((".csv", ".tsv")):
+                    self.load_csv(path)
+                elif name.endswith(".mmdb"):
+                    if maxminddb is None:
+                        self.errors.append(f"{name}: module 'maxminddb' not installed")
+                    else:
+                        self._mmdb.append(maxminddb.open_database(path))
+            except (OSError, ValueError) as e:
+                self.errors.append(f"{name}: {e}")
+        self.build()
+        return self
+
+    def load_csv(self, path):
+        delimiter = "\t" if path.endswith(".tsv") else ","
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            first = f.readline().rstrip("\r\n").split(delimiter)
+            columns = self._header_columns(first)
+            rows = f if columns else chain([delimiter.join(first)], f)
+            columns = columns or self.IP2ASN_COLUMNS
+            for line in rows:
+                parts = [p.strip().strip('"') for p in line.rstrip("\r\n").split(delimiter)]
+                try:
+                    start, version = self._parse_ip(parts[columns["start"]])
+                    end, _ = self._parse_ip(parts[columns["end"]])
+                except (ValueError, IndexError):
+                    continue
+                value = tuple(parts[columns[k]] if k in columns and columns[k] < len(parts) else ""
+                              for k in ("country", "city", "asn", "org"))
+                asn = value[2].upper()
+                asn = asn[2:] if asn.startswith("AS") else asn
+                value = (value[0], value[1], int(asn) if asn.isdigit() else 0, value[3])
+                if value == GEO_UNKNOWN or value[3] == "Not routed":
+                    continue
+                self._ranges[version].append((start, end, self._value_id(value)))
+
+    def _header_columns(self, header):
+        names = [h.strip().strip('"').lower() for h in header]
+        columns = {}
+        for field, aliases in self.FIELDS.items():
+            for i, name in enumerate(names):
+                if name in aliases:
+                    columns[field] = i
+                    break
+        return columns if "start" in columns and "end" in columns else None
+
+    @staticmethod
+    def _parse_ip(text):
+        if text.isdigit():
+            value = int(text)
+            return value, 4 if value <= 0xFFFFFFFF else 6
+        addr = ipaddress.ip_address(text)
+        return int(addr), addr.version
+
+    def _value_id(self, value):
+        i = self._value_ids.get(value)
+        if i is None:
+            i = self._value_ids[value] = len(self._values)
+            self._values.append(value)
+        return i
+
+    def build(self):
+        # Сортировка диапазонов в колонки для бисекции
+        for version, ranges in self._ranges.items():
+            ranges.extend(zip(self._starts[version], self._ends[version], self._ids[version]))
+            ranges.sort()
+            starts = [r[0] for r in ranges]
+            ends = [r[1] for r in ranges]
+            self._starts[version] = array("I", starts) if version == 4 else starts
+            self._ends[version] = array("I", ends) if version == 4 else ends
+            self._ids[version] = array("I", [r[2] for r in ranges])
+            self._ranges[version] = []
+        with self._lock:
+            self._cache.clear()
+
+    def lookup(self, ip):
+        # -> (страна, город, ASN, организация); GEO_UNKNOWN, если адреса нет в базах
+        with self._lock:
+            cached = self._cache.get(ip)
+            if cached is not None:
+                self._cache.move_to_end(ip)
+                return cached
+        result = self._lookup(ip)
+        with self._lock:
+            self._cache[ip] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _lookup(self, ip):
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return GEO_UNKNOWN
+        if addr.is_multicast:
+            return ("", "", 0, "multicast")
+        if addr.is_private or addr.is_link_local or addr.is_loopback:
+            return ("", "", 0, "private network")
+        value = int(addr)
+        starts = self._starts[addr.version]
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= self._ends[addr.version][i]:
+            return self._values[self._ids[addr.version][i]]
+        for reader in self._mmdb:
+            record = reader.get(ip)
+            if record:
+                return self._from_mmdb(record)
+        return GEO_UNKNOWN
+
+    @staticmethod
+    def _from_mmdb(record):
+        country = (record.get("country") or {}).get("iso_code", "")
+        city = ((record.get("city") or {}).get("names") or {}).get("en", "")
+        return (country, city, record.get("autonomous_system_number", 0) or 0,
+                record.get("autonomous_system_organization", "") or "")
+
+    def describe(self, ip):
+        country, city, asn, org = self.lookup(ip)
+        return " ".join(filter(None, (country, city, f"AS{asn}" if asn else "", org)))
+
+
+# --- ОБРАТНЫЙ DNS ---
+def ptr_lookup(ip):
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except (socket.herror, socket.gaierror, OSError):
+        return None
+
+
+class ReverseDnsResolver:
+    """Имена пиров без блокировки вызывающего потока.
+
+    name() отвечает только из кэша; промах ставит адрес в очередь, которую
+    разбирают не больше workers фоновых потоков (PTR-запросы через resolve).
+    Имена из перехваченных ответов DNS (learn) важнее PTR и запроса не
+    требуют. Записи живут ttl секунд, отрицательные — negative_ttl.
+    resolve подменяется, например, локальной заглушкой для проверок.
+    """
+
+    def __init__(self, resolve=ptr_lookup, workers=RDNS_WORKERS, ttl=RDNS_TTL_SEC,
+                 negative_ttl=RDNS_NEGATIVE_TTL_SEC, cache_size=RDNS_CACHE_SIZE, clock=time.monotonic):
+        self.resolve = resolve
+        self.workers = workers
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_size = cache_size
+        self.clock = clock
+        self._cache = OrderedDict()  # ip -> (имя или None, истекает, из DNS-ответа)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(RDNS_QUEUE_MAX)
+        self._pending = set()
+        self._threads = []
+        self.queries = 0
+        self.learned = 0
+        self.dropped = 0
+
+    def learn(self, ip, name):
+        with self._lock:
+            self._store(ip, name, self.ttl, True)
+            self.learned += 1
+
+    def name(self, ip, query=True):
+        with self._lock:
+            entry = self._cache.get(ip)
+            if entry is not None:
+                self._cache.move_to_end(ip)
+                if entry[1] > self.clock():
+                    return entry[0]
+            if not query or ip in self._pending or not self._resolvable(ip):
+                return entry[0] if entry else None
+            self._pending.add(ip)
+        try:
+            self._queue.put_nowait(ip)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._pending.discard(ip)
+        else:
+            with self._lock:
+                # Умерший поток не должен занимать место в пуле навсегда
+                self._threads = [t for t in self._threads if t.is_alive()]
+                if len(self._threads) < self.workers:
+                    thread = threading.Thread(target=self._worker, daemon=True)
+                    self._threads.append(thread)
+                    thread.start()
+        return entry[0] if entry else None
+
+    @staticmethod
+    def _resolvable(ip):
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return not (addr.is_multicast or addr.is_unspecified or ip == "255.255.255.255")
+
+    def _store(self, ip, name, ttl, learned):
+        old = self._cache.get(ip)
+        now = self.clock()
+        if not learned and old is not None and old[2] and old[1] > now:
+            return  # имя из DNS-ответа еще действительно
+        self._cache[ip] = (name, now + ttl, learned)
+        self._cache.move_to_end(ip)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _worker(self):
+        while True:
+            ip = self._queue.get()
+            if ip is None:
+                return
+            with self._lock:
+                self.queries += 1
+            name = None
+            try:
+                name = self.resolve(ip)
+            except Exception:
+                pass  # например, UnicodeError на битом PTR: считаем промахом
+            finally:
+                with self._lock:
+                    self._pending.discard(ip)
+                    self._store(ip, name, self.ttl if name else self.negative_ttl, False)
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+
+# --- ИСТОРИЯ: КОЛОНОЧНОЕ ХРАНИЛИЩЕ ВРЕМЕННЫХ РЯДОВ ---
+class _ColumnSet:
+    """Колонки одинаковой длины, по файлу array на колонку; только дозапись.
+
+    readonly — читатель рядом с пишущим процессом: недописанный хвост
+    отрезается только в памяти, файлы не трогаются.
+    """
+
+    def __init__(self, prefix, columns, readonly=False):
+        self.columns = []
+        for name, code in columns:
+            path = f"{prefix}.{name}"
+            col = array(code)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                col.frombytes(data[:len(data) - len(data) % col.itemsize])
+            self.columns.append((col, path))
+        # После аварийного завершения (или посреди дозаписи) колонки могут разойтись по длине
+        n = min(len(col) for col, _ in self.columns)
+        for col, path in self.columns:
+            if len(col) > n:
+                del col[n:]
+                if not readonly:
+                    os.truncate(path, n * col.itemsize)
+
+    def __len__(self):
+        return len(self.columns[0][0])
+
+    def append(self, rows):
+        for i, (col, path) in enumerate(self.columns):
+            new = array(col.typecode, [row[i] for row in rows])
+            with open(path, "ab") as f:
+                new.tofile(f)
+            col.extend(new)
+
+
+class TimeSeriesStore:
+    """Долговременная история аналитики на диске.
+
+    Дельты TrafficAggregator копятся по интервалам уровней HISTORY_TIERS
+    (1 с / 1 мин / 1 ч) и после закрытия интервала дописываются в колонки
+    (ts, bytes, packets) рядов "total" и "proto.<имя>". Для грубых уровней
+    дополнительно пишется top-K пиров и DNS-имен интервала. Файлы разбиты на
+    чанки по HISTORY_CHUNK_ROWS интервалов, так что запрос читает только
+    нужные чанки и ищет границы бисекцией по колонке ts.
+    """
+
+    DENSE = (("ts", "q"), ("bytes", "Q"), ("packets", "Q"))
+    TOP = (("ts", "q"), ("kind", "B"), ("key", "I"), ("bytes", "Q"), ("packets", "Q"))
+    KINDS = ("peer", "dns")
+
+    def __init__(self, directory=HISTORY_DIR, tiers=HISTORY_TIERS, readonly=False):
+        self.directory = directory
+        self.tiers = tiers
+        self.readonly = readonly
+        self._pending = {tier: {} for tier in tiers}  # начало интервала -> {ряд: [bytes, packets]}
+        self._pending_top = {tier: {} for tier in tiers if tier in HISTORY_TOP_TIERS}
+        self._cache = OrderedDict()  # (tier, chunk, ряд) -> _ColumnSet
+        self._keys = {}  # (tier, chunk) -> (список ключей top-K, ключ -> номер)
+        for tier in tiers:
+            if not readonly:
+                os.makedirs(self._tier_dir(tier), exist_ok=True)
+
+    def reader(self):
+        """Отдельный экземпляр для запросов из другого потока: свои кэши, без записи.
+
+        Видит то, что уже сброшено на диск (flush); ключи top-K пишутся раньше
+        строк, так что прочитанные строки всегда ссылаются на известные ключи.
+        """
+        return TimeSeriesStore(self.directory, self.tiers, readonly=True)
+
+    # --- запись ---
+    def add_delta(self, delta):
+        if not delta["packets"]:
+            return
+        for idx, (size, packets) in delta["bandwidth"].items():
+            self.add("total", idx * RATE_BUCKET_SEC, size, packets)
+        ts = delta["ts"]
+        protocol_bytes = delta.get("protocol_bytes", {})
+        for name, count in delta["protocols"].items():
+            self.add(f"proto.{name}", ts, protocol_bytes.get(name, 0), count)
+        for ip, (size, _err, counters) in delta["peers"].entries.items():
+            self.add_top("peer", ts, ip, size, counters[0] if counters else 0)
+        for name, (count, _err, _) in delta["dns_queries"].entries.items():
+            self.add_top("dns", ts, name, 0, count)
+
+    def add(self, series, ts, size, packets):
+        for tier, pending in self._pending.items():
+            start = int(ts // tier) * tier
+            bucket = pending.get(start)
+            if bucket is None:
+                bucket = pending[start] = {}
+            acc = bucket.get(series)
+            if acc is None:
+                bucket[series] = [size, packets]
+            else:
+                acc[0] += size
+                acc[1] += packets
+
+    def add_top(self, kind, ts, key, size, packets):
+        for tier, pending in self._pending_top.items():
+            start = int(ts // tier) * tier
+            sketches = pending.get(start)
+            if sketches is None:
+                sketches = pending[start] = {k: SpaceSaving(PEER_SKETCH_CAPACITY) for k in self.KINDS}
+            # пиры ранжируются по байтам, DNS-имена — по числу запросов
+            entry = sketches[kind].offer(key, packets if kind == "dns" else size)
+            entry[2] = (entry[2] or 0) + packets
+
+    def flush(self, now, final=False):
+        # Дописывает закрытые интервалы (final — все, например при выходе)
+        for tier, pending in self._pending.items():
+            closed = [s for s in pending if final or s + tier + HISTORY_GRACE_SEC <= now]
+            rows = defaultdict(list)
+            for start in sorted(closed):
+                for series, (size, packets) in pending.pop(start).items():
+                    rows[(self._chunk(tier, start), series)].append((start, size, packets))
+            for (chunk, series), chunk_rows in rows.items():
+                self._dense(tier, chunk, series).append(chunk_rows)
+        for tier, pending in self._pending_top.items():
+            for start in sorted(s for s in pending if final or s + tier + HISTORY_GRACE_SEC <= now):
+                chunk = self._chunk(tier, start)
+                top_rows = []
+                for kind_id, kind in enumerate(self.KINDS):
+                    for key, (weight, _err, packets) in pending[start][kind].top(HISTORY_TOPK):
+                        size = 0 if kind == "dns" else weight
+                        top_rows.append((start, kind_id, self._key_id(tier, chunk, key), size, packets))
+                del pending[start]
+                if top_rows:
+                    self._top(tier, chunk).append(top_rows)
+        self._expire(now)
+
+    def _expire(self, now):
+        for tier, keep in HISTORY_RETENTION_SEC.items():
+            if tier not in self.tiers:
+                continue
+            oldest = self._chunk(tier, now - keep)
+            for chunk in self._chunks(tier):
+                if chunk < oldest:
+                    path = self._chunk_dir(tier, chunk)
+                    for name in os.listdir(path):
+                        os.remove(os.path.join(path, name))
+                    os.rmdir(path)
+                    for key in [k for k in self._cache if k[:2] == (tier, chunk)]:
+                        del self._cache[key]
+                    self._keys.pop((tier, chunk), None)
+
+    # --- чтение ---
+    def pick_tier(self, start, end, max_points=HISTORY_MAX_POINTS):
+        for tier in self.tiers:
+            if (end - start) / tier <= max_points:
+                return tier
+        return self.tiers[-1]
+
+    def series_names(self, tier=None):
+        tier = tier or self.tiers[-1]
+        names = set()
+        for chunk in self._chunks(tier):
+            for name in os.listdir(self._chunk_dir(tier, chunk)):
+                if name.startswith("s_") and name.endswith(".ts"):
+                    names.add(name[2:-3])
+        return sorted(names)
+
+    def series(self, name, start, end, tier=None):
+        # -> [(начало интервала, bytes, packets)] в [start, end)
+        tier = tier or self.pick_tier(start, end)
+        out = []
+        for chunk in self._chunks(tier, start, end):
+            cols = self._dense(tier, chunk, name, create=False)
+            if cols is None:
+                continue
+            (ts, _), (size, _), (packets, _) = cols.columns
+            lo = bisect.bisect_left(ts, start)
+            hi = bisect.bisect_left(ts, end)
+            for t, b, p in zip(ts[lo:hi], size[lo:hi], packets[lo:hi]):
+                if out and out[-1][0] == t:  # поздняя дельта уже закрытого интервала
+                    out[-1] = (t, out[-1][1] + b, out[-1][2] + p)
+                else:
+                    out.append((t, b, p))
+        return out
+
+    def top(self, kind, start, end, k=TOP_PEERS, tier=None):
+        # -> [(ключ, bytes, packets)] по сумме за [start, end); dns сортируется по packets
+        tier = tier or max(HISTORY_TOP_TIERS[0], self.pick_tier(start, end))
+        kind_id = self.KINDS.index(kind)
+        totals = defaultdict(lambda: [0, 0])
+        for chunk in self._chunks(tier, start, end):
+            cols = self._top(tier, chunk, create=False)
+            if cols is None:
+                continue
+            (ts, _), (kinds, _), (keys, _), (size, _), (packets, _) = cols.columns
+            names = self._load_keys(tier, chunk)[0]
+            lo = bisect.bisect_left(ts, start)
+            hi = bisect.bisect_left(ts, end)
+            for i in range(lo, hi):
+                if kinds[i] == kind_id:
+                    acc = totals[names[keys[i]]]
+                    acc[0] += size[i]
+                    acc[1] += packets[i]
+        order = 1 if kind == "dns" else 0
+        ranked = sorted(totals.items(), key=lambda kv: kv[1][order], reverse=True)[:k]
+        return [(key, b, p) for key, (b, p) in ranked]
+
+    # --- файлы ---
+    def _tier_dir(self, tier):
+        return os.path.join(self.directory, f"{tier}s")
+
+    def _chunk_dir(self, tier, chunk):
+        return os.path.join(self._tier_dir(tier), f"{chunk:06d}")
+
+    @staticmethod
+    def _chunk(tier, ts):
+        return int(ts // (tier * HISTORY_CHUNK_ROWS))
+
+    def _chunks(self, tier, start=None, end=None):
+        chunks = sorted(int(name) for name in os.listdir(self._tier_dir(tier)) if name.isdigit())
+        if start is None:
+            return chunks
+        first, last = self._chunk(tier, start), self._chunk(tier, end)
+        return [c for c in chunks if first <= c <= last]
+
+    def _columns(self, tier, chunk, name, layout, create):
+        key = (tier, chunk, name)
+        cols = self._cache.get(key)
+        if cols is not None:
+            self._cache.move_to_end(key)
+            return cols
+        prefix = os.path.join(self._chunk_dir(tier, chunk), name)
+        if not create and not os.path.exists(f"{prefix}.ts"):
+            return None
+        if not self.readonly:
+            os.makedirs(self._chunk_dir(tier, chunk), exist_ok=True)
+        cols = self._cache[key] = _ColumnSet(prefix, layout, self.readonly)
+        if len(self._cache) > HISTORY_CACHE_CHUNKS:
+            self._cache.popitem(last=False)
+        return cols
+
+    def _dense(self, tier, chunk, series, create=True):
+        return self._columns(tier, chunk, "s_" + re.sub(r"[^\w.-]", "_", series), self.DENSE, create)
+
+    def _top(self, tier, chunk, create=True):
+        return self._columns(tier, chunk, "top", self.TOP, create)
+
+    def _load_keys(self, tier, chunk):
+        keys = self._keys.get((tier, chunk))
+        if keys is None:
+            names = []
+            path = os.path.join(self._chunk_dir(tier, chunk), "top.keys")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8", newline="") as f:
+                    lines = f.read().split("\n")
+                # Ключ — JSON-строка: qname из сети может содержать \n, \x1c, \u2028 и т.п.
+                # Последний элемент — "" или недописанная строка (читатель рядом с писателем).
+                names = [json.loads(line) if line.startswith('"') else line for line in lines[:-1]]
+            keys = self._keys[(tier, chunk)] = (names, {name: i for i, name in enumerate(names)})
+        return keys
+
+    def _key_id(self, tier, chunk, key):
+        names, ids = self._load_keys(tier, chunk)
+        i = ids.get(key)
+        if i is None:
+            os.makedirs(self._chunk_dir(tier, chunk), exist_ok=True)
+            with open(os.path.join(self._chunk_dir(tier, chunk), "top.keys"), "a", encoding="utf-8", newline="") as f:
+                f.write(json.dumps(key) + "\n")
+            i = ids[key] = len(names)
+            names.append(key)
+        return i
+
+
+# --- ОТЧЕТ: ПОТОКОВАЯ ЗАПИСЬ HTML/JSON/CSV ---
+REPORT_HTML_HEAD = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+body { background: black; color: #00FF00; font-family: monospace; margin: 20px; }
+h1, h2 { color: #00FFFF; }
+table { border-collapse: collapse; margin: 6px 0; }
+td, th { border: 1px solid #033; padding: 2px 8px; text-align: left; white-space: nowrap; }
+th { color: #00FFFF; background: #001a1a; cursor: pointer; }
+td.n { text-align: right; }
+.pager { margin: 4px 0; color: #88ff88; }
+.pager button, .pager input, .pager select { background: #111; color: #00FF00; border: 1px solid #033; font-family: monospace; }
+.note { color: orange; }
+svg { background: #050505; border: 1px solid #033; margin: 6px 0; }
+svg text { fill: #88ff88; font: 11px monospace; }
+</style>
+<script>
+var R = {t: {}, size: $page_rows};
+R.table = function (name, cols) {
+  R.t[name] = {cols: cols, rows: [], view: null, page: 0, sort: -1, desc: true, total: 0, shown: 0};
+};
+R.add = function (name, rows) { Array.prototype.push.apply(R.t[name].rows, rows); };
+R.done = function (name, total, csv) {
+  var t = R.t[name];
+  t.total = total; t.csv = csv; t.view = t.rows;
+  R.render(name);
+};
+R.fmt = function (kind, v) {
+  if (v === null || v === undefined) return "-";
+  if (kind === "bytes") {
+    var u = ["B", "KB", "MB", "GB", "TB"], i = 0;
+    while (Math.abs(v) >= 1024 && i < u.length - 1) { v /= 1024; i++; }
+    return v.toFixed(1) + " " + u[i];
+  }
+  if (kind === "time") return new Date(v * 1000).toISOString().replace("T", " ").slice(0, 23);
+  return String(v);
+};
+R.filter = function (name, text) {
+  var t = R.t[name];
+  text = text.toLowerCase();
+  t.view = text ? t.rows.filter(function (r) { return r.join(" ").toLowerCase().indexOf(text) >= 0; }) : t.rows;
+  t.page = 0;
+  R.render(name);
+};
+R.sortBy = function (name, col) {
+  var t = R.t[name];
+  t.desc = t.sort === col ? !t.desc : true;
+  t.sort = col;
+  var d = t.desc ? -1 : 1;
+  t.view = t.view.slice().sort(function (a, b) { return a[col] < b[col] ? -d : a[col] > b[col] ? d : 0; });
+  t.page = 0;
+  R.render(name);
+};
+R.go = function (name, page) {
+  var t = R.t[name], pages = Math.max(1, Math.ceil(t.view.length / R.size));
+  t.page = Math.min(Math.max(0, page), pages - 1);
+  R.render(name);
+};
+R.render = function (name) {
+  var t = R.t[name], el = document.getElementById("t-" + name);
+  if (!el) return;
+  var pages = Math.max(1, Math.ceil(t.view.length / R.size)), start = t.page * R.size;
+  var h = ["<div class='pager'><button onclick='R.go(\\"" + name + "\\",0)'>&laquo;</button> ",
+           "<button onclick='R.go(\\"" + name + "\\"," + (t.page - 1) + ")'>&lsaquo;</button> ",
+           "page " + (t.page + 1) + " / " + pages + " ",
+           "<button onclick='R.go(\\"" + name + "\\"," + (t.page + 1) + ")'>&rsaquo;</button> ",
+           "<button onclick='R.go(\\"" + name + "\\"," + (pages - 1) + ")'>&raquo;</button> ",
+           " filter: <input onchange='R.filter(\\"" + name + "\\",this.value)'> ",
+           t.view.length + " of " + t.total + " rows"];
+  if (t.rows.length < t.total) h.push(" <span class='note'>(first " + t.rows.length + " embedded, full table in " + t.csv + ")</span>");
+  h.push("</div><table><tr>");
+  t.cols.forEach(function (c, i) { h.push("<th onclick='R.sortBy(\\"" + name + "\\"," + i + ")'>" + c[0] + "</th>"); });
+  h.push("</tr>");
+  t.view.slice(start, start + R.size).forEach(function (r) {
+    h.push("<tr>");
+    r.forEach(function (v, i) {
+      var kind = t.cols[i][1], s = R.fmt(kind, v).replace(/&/g, "&amp;").replace(/</g, "&lt;");
+      h.push(typeof v === "number" ? "<td class='n'>" + s + "</td>" : "<td>" + s + "</td>");
+    });
+    h.push("</tr>");
+  });
+  h.push("</table>");
+  el.innerHTML = h.join("");
+};
+</script>
+</head>
+<body>
+<h1>PASHCHENKO SECURITY REPORT</h1>
+<hr>
+$summary
+<hr>
+$charts
+""")
+REPORT_HTML_TAIL = Template("""<hr>
+<p>Machine-readable export: $exports</p>
+<p>Generated by Pashchenko Cyber Suite v7.0</p>
+</body>
+</html>
+""")
+REPORT_COLORS = ("#00FF00", "#00FFFF", "orange", "#ff4444", "#ff66ff", "#ffff66", "#6699ff", "#aaaaaa")
+
+
+def _report_json(value):
+    # Внутри <script> нельзя закрывающий тег
+    return json.dumps(value, separators=(",", ":"), default=str).replace("</", "<\\/")
+
+
+def svg_stacked_chart(title, times, layers, step, width=REPORT_CHART_WIDTH, height=REPORT_CHART_HEIGHT):
+    """Inline SVG: сложенные площади layers = [(имя, байты за интервал step в каждый момент times)]."""
+    pad_l, pad_r, pad_t, pad_b = 70, 10, 20, 30
+    w, h = width - pad_l - pad_r, height - pad_t - pad_b
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+           f'<text x="{pad_l}" y="14">{html.escape(title)}</text>']
+    if not times or not layers:
+        out.append(f'<text x="{pad_l}" y="{pad_t + h // 2}">No data</text></svg>')
+        return "".join(out)
+    stacked = [0.0] * len(times)
+    tops = []
+    for _name, values in layers:
+        stacked = [a + v / step for a, v in zip(stacked, values)]
+        tops.append(stacked)
+    peak = max(stacked) or 1.0
+    t0, span = times[0], max(times[-1] - times[0], step)
+
+    def x(t):
+        return pad_l + (t - t0) / span * w
+
+    def y(v):
+        return pad_t + h - v / peak * h
+
+    below = [pad_t + h] * len(times)
+    for i, (top, (name, _)) in enumerate(zip(tops, layers)):
+        upper = [f"{x(t):.1f},{y(v):.1f}" for t, v in zip(times, top)]
+        lower = [f"{x(t):.1f},{b:.1f}" for t, b in zip(reversed(times), reversed(below))]
+        color = REPORT_COLORS[i % len(REPORT_COLORS)]
+        out.append(f'<polygon points="{" ".join(upper + lower)}" fill="{color}" fill-opacity="0.45" '
+                   f'stroke="{color}" stroke-width="1"/>')
+        below = [y(v) for v in top]
+        if len(layers) > 1:
+            out.append(f'<rect x="{pad_l + w - 150}" y="{pad_t + 4 + i * 14}" width="10" height="10" fill="{color}"/>'
+                       f'<text x="{pad_l + w - 135}" y="{pad_t + 13 + i * 14}">{html.escape(name)}</text>')
+    peak_label = fmt_bytes(peak) + "/s"
+    out.append(f'<line x1="{pad_l}" y1="{pad_t}" x2="{pad_l}" y2="{pad_t + h}" stroke="#033"/>'
+               f'<line x1="{pad_l}" y1="{pad_t + h}" x2="{pad_l + w}" y2="{pad_t + h}" stroke="#033"/>'
+               f'<text x="4" y="{pad_t + 10}">{peak_label}</text><text x="4" y="{pad_t + h}">0</text>'
+               f'<text x="{pad_l}" y="{height - 8}">{datetime.fromtimestamp(times[0]):%Y-%m-%d %H:%M}</text>'
+               f'<text x="{pad_l + w - 110}" y="{height - 8}">{datetime.fromtimestamp(times[-1]):%Y-%m-%d %H:%M}</text>'
+               '</svg>')
+    return "".join(out)
+
+
+def history_charts(store, start, end, top_protocols=REPORT_CHART_PROTOCOLS):
+    """Графики полосы и протоколов за [start, end) из TimeSeriesStore."""
+    tier = store.pick_tier(start, end)
+    first = int(start) // tier * tier
+    times = list(range(first, int(end), tier))
+    slot = {t: i for i, t in enumerate(times)}
+
+    def dense(name):
+        values = [0] * len(times)
+        for t, size, _packets in store.series(name, start, end, tier):
+            i = slot.get(t)
+            if i is not None:
+                values[i] += size
+        return values
+
+    total = dense("total")
+    protocols = [(name[6:], dense(name)) for name in store.series_names(tier) if name.startswith("proto.")]
+    protocols.sort(key=lambda layer: sum(layer[1]), reverse=True)
+    if len(protocols) > top_protocols:
+        rest = [sum(column) for column in zip(*(v for _, v in protocols[top_protocols:]))]
+        protocols = protocols[:top_protocols] + [("other", rest)]
+    protocols = [layer for layer in protocols if any(layer[1])]
+    # Пустые ряды не рисуются, чтобы ось не строилась по нулям
+    if not any(total):
+        times, total = [], []
+    return [svg_stacked_chart(f"Bandwidth, last {(end - start) / 3600:.0f} h ({tier}s buckets)",
+                              times, [("total", total)] if total else [], tier),
+            svg_stacked_chart(f"Bytes per protocol ({tier}s buckets)", times if total else [], protocols, tier)]
+
+
+class ReportWriter:
+    """Потоковый отчет: report.html, report.json и <таблица>.csv в одном каталоге.
+
+    Каждая таблица проходится один раз блоками по REPORT_CHUNK_ROWS строк:
+    блок дописывается в CSV, в массив JSON и в <script> HTML, где его листает и
+    фильтрует клиентский пейджер. В памяти держится только текущий блок, а в
+    HTML встраивается не больше REPORT_HTML_MAX_ROWS строк таблицы — полная
+    таблица всегда есть в CSV/JSON.
+    """
+
+    def __init__(self, directory, title="Pashchenko Security Report"):
+        self.directory = directory
+        self.title = title
+        self.tables = []
+        os.makedirs(directory, exist_ok=True)
+        self.html_path = os.path.join(directory, "report.html")
+        self._html = open(self.html_path, "w", encoding="utf-8")
+        self._json = open(os.path.join(directory, "report.json"), "w", encoding="utf-8")
+
+    def begin(self, summary, charts=()):
+        rows = "".join(f"<tr><th>{html.escape(str(k))}</th><td>{html.escape(self._summary_value(v))}</td></tr>"
+                       for k, v in summary.items())
+        self._html.write(REPORT_HTML_HEAD.substitute(
+            title=html.escape(self.title), page_rows=REPORT_PAGE_ROWS,
+            summary=f"<table>{rows}</table>", charts="\n".join(charts)))
+        self._json.write('{"summary":' + json.dumps(summary, default=str) + ',"tables":{')
+
+    @staticmethod
+    def _summary_value(value):
+        if isinstance(value, dict):
+            return ", ".join(f"{k}={v}" for k, v in value.items()) or "-"
+        return str(value)
+
+    def table(self, name, title, columns, rows, html_limit=REPORT_HTML_MAX_ROWS):
+        # columns: [(заголовок, вид)], вид "" / "bytes" / "time" — только для отображения
+        csv_name = f"{name}.csv"
+        self._html.write(f"<h2>{html.escape(title)}</h2><div id=\"t-{name}\"></div>\n"
+                         f"<script>R.table({_report_json(name)},{_report_json(columns)});</script>\n")
+        self._json.write(("," if self.tables else "") + json.dumps(name)
+                         + ':{"columns":' + json.dumps([c for c, _ in columns]) + ',"rows":[')
+        total = 0
+        encode = json.JSONEncoder(default=str).encode
+        with open(os.path.join(self.directory, csv_name), "w", newline="", encoding="utf-8") as f:
+            out = csv.writer(f)
+            out.writerow([c for c, _ in columns])
+            rows = iter(rows)
+            while True:
+                chunk = list(islice(rows, REPORT_CHUNK_ROWS))
+                if not chunk:
+                    break
+                out.writerows(chunk)
+                self._json.write(("," if total else "") + ",".join(map(encode, chunk)))
+                if total < html_limit:
+                    self._write_chunk(name, chunk[:html_limit - total])
+                total += len(chunk)
+        self._json.write("]}")
+        self._html.write(f"<script>R.done({_report_json(name)},{total},{_report_json(csv_name)});</script>\n")
+        self.tables.append((name, total))
+        return total
+
+    def _write_chunk(self, name, rows):
+        self._html.write(f"<script>R.add({_report_json(name)},{_report_json(rows)});</script>\n")
+
+    def close(self):
+        exports = " ".join(f'<a href="{name}.csv">{name}.csv</a>' for name, _ in self.tables)
+        self._html.write(REPORT_HTML_TAIL.substitute(exports='<a href="report.json">report.json</a> ' + exports))
+        self._json.write("}}\n")
+        self._html.close()
+        self._json.close()
+
+
+REPORT_FLOW_COLUMNS = [("client", ""), ("server", ""), ("proto", ""), ("app", ""), ("state", ""), ("c_pkts", ""),
+                       ("c_bytes", "bytes"), ("s_pkts", ""), ("s_bytes", "bytes"), ("total", "bytes"),
+                       ("rtt_ms", ""), ("first", "time"), ("last", "time")]
+REPORT_PEER_COLUMNS = [("ip", ""), ("host", ""), ("bytes", "bytes"), ("packets", ""), ("to_target", ""), ("from_target", ""),
+                       ("via_router", ""), ("max_error", "bytes"), ("geo", "")]
+REPORT_DNS_COLUMNS = [("name", ""), ("queries", ""), ("max_error", ""), ("p50_ms", ""), ("p95_ms", ""),
+                      ("p99_ms", ""), ("answered", ""), ("nxdomain", ""), ("servfail", ""), ("unanswered", "")]
+REPORT_RESOLVER_COLUMNS = [("resolver", ""), ("queries", "")] + REPORT_DNS_COLUMNS[3:]
+REPORT_PACKET_COLUMNS = [("no", ""), ("time", "time"), ("src", ""), ("dst", ""), ("proto", ""), ("sport", ""),
+                         ("dport", ""), ("len", "")]
+REPORT_HISTORY_COLUMNS = [("series", ""), ("bytes", "bytes"), ("packets", "")]
+REPORT_HISTORY_PEER_COLUMNS = [("ip", ""), ("bytes", "bytes"), ("packets", ""), ("geo", "")]
+REPORT_IFACE_COLUMNS = [("iface", ""), ("packets", ""), ("bytes", "bytes"), ("delivered", ""), ("kernel_recv", ""),
+                        ("kernel_drops", ""), ("protocols", "")]
+
+
+def report_dns_stats(stats):
+    # -> (p50, p95, p99, answered, nxdomain, servfail, unanswered) для таблиц отчета
+    if stats is None:
+        return (None,) * 7
+    latency = tuple(None if v is None else round(v, 2) for v in (dns_percentile(stats, q) for q in (0.5, 0.95, 0.99)))
+    return latency + (stats[DNS_ANSWERED], stats[DNS_NXDOMAIN], stats[DNS_SERVFAIL], stats[DNS_LOST])
+
+
+def report_packet_rows(store, chunk=REPORT_CHUNK_ROWS):
+    # Индекс читается блоками; пакеты, вытесненные из кольца, пропускаются
+    first, total = store.span()
+    for lo in range(first, first + total, chunk):
+        for row in store.rows(range(lo, min(first + total, lo + chunk))):
+            if row is not None:
+                yield row[:1] + (round(row[1], 6),) + row[2:]
+
+
+def report_flow_rows(flows):
+    # Самые объемные первыми; сортирует тот поток, что читает генератор (поток отчета)
+    for client, server, proto, state, c_pkts, c_bytes, s_pkts, s_bytes, total, rtt, first, last, app in sorted(
+            flows, key=operator.itemgetter(8), reverse=True):
+        yield (client, server, proto, app, state, c_pkts, c_bytes, s_pkts, s_bytes, total,
+               round(rtt, 1) if rtt >= 0 else None, round(first, 3), round(last, 3))
+
+
+# --- МНОГОПРОЦЕССНЫЙ КОНВЕЙЕР: захват -> кольца в shared memory -> воркеры ---
+_U64 = struct.Struct("Q")
+_SLOT_HDR = struct.Struct("IId")  # длина кадра, wirelen, ts
+_SLOT_WRAP = 0xFFFFFFFF
+
+
+class ShmFrameRing:
+    """SPSC-кольцо кадров в разделяемой памяти: один писатель, один читатель.
+
+    Заголовок — две 64-байтные кэш-линии: в первой head (пишет производитель)
+    и емкость, во второй tail (пишет потребитель). Сегмент shared memory
+    выровнен по странице, так что запись одной стороны не сбрасывает линию
+    другой. Позиции только растут.
+    """
+
+    HEAD = 0
+    CAPACITY = 8
+    TAIL = 64
+    HEADER = 128
+
+    def __init__(self, name=None, size=PIPELINE_RING_BYTES):
+        if name is None:
+            size = (size + 15) & ~15
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER + size)
+            _U64.pack_into(self.shm.buf, self.CAPACITY, size)
+            self.owner = True
+        else:
+            # Воркеры (spawn) делят resource_tracker с родителем, поэтому
+            # повторная регистрация безвредна, а удаляет кольцо только владелец
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.capacity = _U64.unpack_from(self.buf, self.CAPACITY)[0]
+
+    def push(self, frame, ts, wirelen):
+        buf = self.buf
+        cap = self.capacity
+        head = _U64.unpack_from(buf, self.HEAD)[0]
+        tail = _U64.unpack_from(buf, self.TAIL)[0]
+        n = len(frame)
+        need = (_SLOT_HDR.size + n + 15) & ~15
+        off = head % cap
+        pad = cap - off if off + need > cap else 0
+        if head + pad + need - tail > cap:
+            return False
+        base = self.HEADER
+        if pad:
+            _SLOT_HDR.pack_into(buf, base + off, _SLOT_WRAP, 0, 0.0)
+            off = 0
+        start = base + off + _SLOT_HDR.size
+        _SLOT_HDR.pack_into(buf, base + off, n, wirelen, ts)
+        buf[start:start + n] = frame
+        _U64.pack_into(buf, self.HEAD, head + pad + need)  # публикуем после записи данных
+        return True
+
+    def pop(self):
+        # -> (ts, frame, wirelen) или None, если кольцо пусто
+        buf = self.buf
+        tail = _U64.unpack_from(buf, self.TAIL)[0]
+        if tail == _U64.unpack_from(buf, self.HEAD)[0]:
+            return None
+        cap = self.capacity
+        base = self.HEADER
+        off = tail % cap
+        n, wirelen, ts = _SLOT_HDR.unpack_from(buf, base + off)
+        if n == _SLOT_WRAP:
+            tail += cap - off
+            off = 0
+            n, wirelen, ts = _SLOT_HDR.unpack_from(buf, base)
+        start = base + off + _SLOT_HDR.size
+        frame = bytes(buf[start:start + n])
+        _U64.pack_into(buf, self.TAIL, tail + ((_SLOT_HDR.size + n + 15) & ~15))
+        return ts, frame, wirelen
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def flow_shard(frame, shards):
+    # Симметричный хэш 5-tuple: оба направления потока попадают в один шард
+    if shards == 1 or len(frame) < 34:
+        return 0
+    ethertype = frame[12:14]
+    off = 14
+    if ethertype in (b"\x81\x00", b"\x88\xa8"):
+        ethertype = frame[16:18]
+        off = 18
+    if ethertype == b"\x08\x00":
+        a = frame[off + 12:off + 16]
+        b = frame[off + 16:off + 20]
+        proto = frame[off + 9]
+        l4 = off + (frame[off] & 0x0F) * 4
+    elif ethertype == b"\x86\xdd":
+        a = frame[off + 8:off + 24]
+        b = frame[off + 24:off + 40]
+        proto = frame[off + 6]
+        l4 = off + 40
+    else:
+        return 0
+    if proto in (IPPROTO_TCP, IPPROTO_UDP):
+        a += frame[l4:l4 + 2]
+        b += frame[l4 + 2:l4 + 4]
+    if a > b:
+        a, b = b, a
+    return zlib.crc32(a + b) % shards
+
+
+def _pipeline_worker(ring_name, target_ip, router_ip, out_queue, stop_event, shard, iface=None):
+    ring = ShmFrameRing(ring_name)
+    agg = TrafficAggregator(target_ip, router_ip, lambda delta: out_queue.put(("DELTA", delta)),
+                            source=f"{iface}/worker{shard}" if iface else f"worker{shard}", iface=iface)
+    out_queue.put(("READY", shard))
+    processed = 0
+    first = last = None  # границы занятости воркера, для бенчмарка
+    try:
+        while True:
+            item = ring.pop()
+            if item is None:
+                if stop_event.is_set():
+                    break
+                agg.maybe_publish()
+                time.sleep(PIPELINE_IDLE_SEC)
+                continue
+            if first is None:
+                first = time.time()
+            ts, frame, wirelen = item
+            agg.add(decode_frame(frame, ts, wirelen))
+            agg.maybe_publish()
+            processed += 1
+        last = time.time()
+        agg.publish(final=True)
+    finally:
+        ring.close()
+        out_queue.put(("DONE", (shard, processed, first, last)))
+
+
+def _pipeline_capture(ring_names, bpf, out_queue, stop_event, counters, iface=None):
+    # counters: delivered, kernel_recv, kernel_drops, ring_full; iface=None — интерфейс scapy по умолчанию
+    rings = [ShmFrameRing(name) for name in ring_names]
+    shards = len(rings)
+    listen = {"iface": iface} if iface else {}
+    on_iface = f" on {iface}" if iface else ""
+    sock = None
+    try:
+        conf = scapy_all().conf
+        try:
+            sock = conf.L2listen(filter=bpf, **listen)
+        except Exception as e:
+            if not bpf:
+                raise
+            out_queue.put(("LOG", (f"Kernel BPF unavailable{on_iface} ({e}), capturing unfiltered.", "ALERT")))
+            sock = conf.L2listen(**listen)
+        drops = KernelDropCounter(sock)
+        delivered = ring_full = 0
+        next_poll = time.time() + SNIFF_POLL_SEC
+        while not stop_event.is_set():
+            if sock.select([sock], PIPELINE_POLL_SEC):
+                _cls, frame, ts = sock.recv_raw(RAW_RECV_SIZE)
+                if frame:
+                    delivered += 1
+                    if not rings[flow_shard(frame, shards)].push(frame, ts or time.time(), len(frame)):
+                        ring_full += 1
+            now = time.time()
+            if now >= next_poll:
+                next_poll = now + SNIFF_POLL_SEC
+                drops.poll()
+                counters[0], counters[1], counters[2], counters[3] = (
+                    delivered, drops.received, drops.dropped, ring_full)
+        drops.poll()
+        counters[0], counters[1], counters[2], counters[3] = delivered, drops.received, drops.dropped, ring_full
+    except Exception as e:
+        out_queue.put(("LOG", (f"Capture process error{on_iface}: {e}. Try running as Administrator.", "ALERT")))
+    finally:
+        if sock is not None:
+            sock.close()
+        for ring in rings:
+            ring.close()
+
+
+class CapturePipeline:
+    """Процесс захвата + пул воркеров, шардированных по хэшу потока.
+
+    Воркеры отдают дельты TrafficAggregator; on_message получает их в
+    отдельном потоке-ретрансляторе вместе с сообщениями LOG. iface выбирает
+    интерфейс захвата; tag_iface помечает им дельты для разбивки по интерфейсам.
+    """
+
+    def __init__(self, workers, target_ip, router_ip, bpf, on_message, ring_bytes=PIPELINE_RING_BYTES,
+                 iface=None, tag_iface=False):
+        ctx = multiprocessing.get_context("spawn")
+        self.rings = [ShmFrameRing(size=ring_bytes) for _ in range(workers)]
+        self.stop_event = ctx.Event()
+        self.out_queue = ctx.Queue()
+        self.counters = ctx.RawArray("Q", 4)
+        self.on_message = on_message
+        self.workers = [
+            ctx.Process(target=_pipeline_worker, daemon=True,
+                        args=(ring.name, target_ip, router_ip, self.out_queue, self.stop_event, i,
+                              iface if tag_iface else None))
+            for i, ring in enumerate(self.rings)
+        ]
+        self.capture = ctx.Process(target=_pipeline_capture, daemon=True,
+                                   args=([r.name for r in self.rings], bpf, self.out_queue,
+                                         self.stop_event, self.counters, iface))
+        self._relay = threading.Thread(target=self._relay_loop, daemon=True)
+        self._done = 0
+
+    def start(self, with_capture=True):
+        for proc in self.workers:
+            proc.start()
+        if with_capture:
+            self.capture.start()
+        self._relay.start()
+
+    def stats(self):
+        delivered, recv, drops, ring_full = self.counters
+        return {"delivered": delivered, "kernel_recv": recv, "kernel_drops": drops, "ring_full": ring_full}
+
+    def stop(self, timeout=PIPELINE_JOIN_SEC):
+        # Воркеры дочитывают свои кольца и только потом завершаются
+        self.stop_event.set()
+        if self.capture.pid is not None:
+            self.capture.join(timeout)
+        for proc in self.workers:
+            proc.join(timeout)
+        self._relay.join(timeout)
+        for ring in self.rings:
+            ring.close()
+
+    def _relay_loop(self):
+        while self._done < len(self.workers):
+            try:
+                kind, data = self.out_queue.get(timeout=PIPELINE_POLL_SEC)
+            except queue.Empty:
+                if not any(proc.is_alive() for proc in self.workers):
+                    return
+                continue
+            if kind == "DONE":
+                self._done += 1
+            self.on_message(kind, data)
+
+
+
+
+# --- ДВИЖОК: ЗАХВАТ И АНАЛИТИКА БЕЗ GUI ---
+def fmt_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def fmt_duration(sec):
+    sec = int(sec)
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h}h {m}m {s}s"
+    if m:
+        return f"{m}m {s}s"
+    return f"{s}s"
+
+
+def print_event(kind, data):
+    # emit по умолчанию для headless-режима: только сообщения, без DATA-строк, и в stderr —
+    # stdout остается за JSON-итогом (--replay ... | jq)
+    if kind == "LOG" and data[1] != "DATA":
+        print(f"{datetime.now():[%H:%M:%S]} {data[1]}: {data[0]}", file=sys.stderr, flush=True)
+
+
+class AnalyzerEngine:
+    """Захват, воспроизведение и аналитика без GUI.
+
+    Потоки захвата копят интервалы в TrafficAggregator и кладут дельты в
+    analytics_deltas; состояние аналитики меняет только drain() — из Tk-потока
+    GUI или из цикла headless-режима. drain() и snapshot() держат state_lock,
+    так что HTTP- и Unix-сокет серверы читают согласованный снимок.
+    Сообщения для пользователя уходят в emit(kind, data): LOG (текст, тег),
+    PROGRESS (доля файла) и REPLAY_DONE (число пакетов). Тревоги детектора
+    аномалий — LOG с тегом ALERT.
+    """
+
+    def __init__(self, emit=print_event, history_dir=HISTORY_DIR, geoip_dir=GEOIP_DIR, resolve=ptr_lookup):
+        self.emit = emit
+        self.is_sniffing = False
+        self.is_replaying = False
+        self.replay_clock = None  # время последнего пакета при офлайн-воспроизведении
+        self.sniff_start_time = None
+        self.captured_packets = deque(maxlen=MAX_CAPTURED_PACKETS)
+        self.pcap_ring = None
+        self.analytics = new_analytics_state()
+        self.analytics_deltas = queue.SimpleQueue()
+        self.epoch = 0
+        self.state_lock = threading.RLock()
+        self._ingest_lock = threading.Lock()
+        # ifaces: счетчики по интерфейсам при захвате с нескольких сразу
+        self.capture_stats = {"delivered": 0, "kernel_recv": 0, "kernel_drops": 0, "ring_full": 0, "bpf": None,
+                              "ifaces": {}}
+        # Офлайн GeoIP грузится в фоне; до этого аннотации просто пустые
+        self.geoip = GeoIpDb()
+        threading.Thread(target=self._load_geoip, args=(geoip_dir,), daemon=True).start()
+        self.rdns = ReverseDnsResolver(resolve)
+        # Пассивный инвентарь хостов не сбрасывается вместе с аналитикой
+        self.host_inventory = HostInventory()
+        # Детектор видит все дельты, включая отброшенные сбросом аналитики
+        self.detector = AnomalyDetector()
+        # История живого захвата переживает RESET и перезапуск
+        self.history = None
+        if history_dir:
+            try:
+                self.history = TimeSeriesStore(history_dir)
+            except OSError as e:
+                self.log(f"History store disabled: {e}", "ALERT")
+
+    def log(self, message, tag="INFO"):
+        self.emit("LOG", (message, tag))
+
+    def _load_geoip(self, directory):
+        started = time.perf_counter()
+        db = GeoIpDb().load_dir(directory)
+        self.geoip = db
+        for err in db.errors:
+            self.log(f"GeoIP: {err}", "ALERT")
+        if db.loaded:
+            self.log(f"GeoIP: {len(db)} ranges, {len(db._mmdb)} mmdb loaded from ./{directory}"
+                     f" in {time.perf_counter() - started:.1f}s", "INFO")
+
+    # --- живой захват ---
+    def start_sniffer(self, target_ip, router_ip, extra_bpf="", workers=0, ring_spec=RING_SPEC_DEFAULT,
+                      discovery=True, ifaces=None):
+        # ring_spec=None — без записи на диск; workers > 0 — многопроцессный конвейер;
+        # ifaces — имена интерфейсов (пусто — интерфейс scapy по умолчанию)
+        self.replay_clock = None
+        self.is_sniffing = True
+        self.detector = AnomalyDetector()  # окна и базовая полоса — по новой шкале времени
+        thread = threading.Thread(target=self._sniffer_thread,
+                                  args=(target_ip, router_ip, extra_bpf, workers, ring_spec, discovery,
+                                        list(ifaces or ())), daemon=True)
+        thread.start()
+        return thread
+
+    def stop_sniffer(self):
+        self.is_sniffing = False
+
+    def _sniffer_thread(self, target_ip, router_ip, extra_bpf, workers, ring_spec, discovery, ifaces):
+        self.log("Sniffer started...", "INFO")
+        self.log(f"Analytics filter: TARGET={target_ip} ROUTER={router_ip}", "INFO")
+
+        self.sniff_start_time = time.time()
+        stats = self.capture_stats
+        stats.update(delivered=0, kernel_recv=0, kernel_drops=0, ring_full=0, bpf=None, ifaces={})
+
+        # Опечатка в адресе — не проблема прав доступа: сообщаем до открытия сокетов
+        try:
+            _build_bpf_filter(target_ip, router_ip, extra_bpf, discovery)
+        except ValueError as e:
+            self.log(f"Invalid TARGET/ROUTER IP: {e}", "ALERT")
+            self.log("Sniffer stopped.", "INFO")
+            return
+
+        if workers:
+            self._run_pipeline(workers, target_ip, router_ip, extra_bpf, discovery, ifaces)
+            self.log("Sniffer stopped.", "INFO")
+            return
+
+        try:
+            self._start_ring(ring_spec)
+            if len(ifaces) > 1:
+                self._capture_ifaces(ifaces, target_ip, router_ip, extra_bpf, discovery)
+            else:
+                self._capture(ifaces[0] if ifaces else None, target_ip, router_ip, extra_bpf, discovery, stats)
+        except Exception as e:
+            self.log(f"Sniffer error: {e}. Try running as Administrator.", "ALERT")
+        finally:
+            if self.pcap_ring is not None:
+                try:
+                    self.pcap_ring.close()
+                except OSError as e:
+                    self.log(f"Ring writer error: {e}", "ALERT")
+        self.log("Sniffer stopped.", "INFO")
+
+    def _capture(self, iface, target_ip, router_ip, extra_bpf, discovery, counters, per_iface=False):
+        # Один сокет и свой агрегатор; per_iface — один из нескольких параллельных захватов
+        if per_iface:
+            agg = self._new_aggregator(target_ip, router_ip, source=iface, iface=iface)
+            ingest = self._ingest_shared
+        else:
+            agg = self._new_aggregator(target_ip, router_ip)
+            ingest = self._ingest
+        sock = None
+        try:
+            sock = self._open_filtered_socket(target_ip, router_ip, extra_bpf, discovery, iface)
+            drops = KernelDropCounter(sock)
+            next_poll = time.time() + SNIFF_POLL_SEC
+            # Сырые кадры без диссекции scapy; select с таймаутом, чтобы
+            # остановка не ждала следующего пакета
+            while self.is_sniffing:
+                if sock.select([sock], SNIFF_POLL_SEC):
+                    _cls, frame, ts = sock.recv_raw(RAW_RECV_SIZE)
+                    if frame:
+                        counters["delivered"] += 1
+                        ingest(decode_frame(frame, ts or time.time()), agg)
+                agg.maybe_publish()
+                now = time.time()
+                if now >= next_poll:
+                    next_poll = now + SNIFF_POLL_SEC
+                    drops.poll()
+                    counters["kernel_recv"] = drops.received
+                    counters["kernel_drops"] = drops.dropped
+        finally:
+            agg.publish(final=True)
+            if sock is not None:
+                sock.close()
+
+    def _capture_ifaces(self, ifaces, target_ip, router_ip, extra_bpf, discovery):
+        # По потоку на интерфейс; ошибка одного интерфейса не останавливает остальные
+        stats = self.capture_stats
+        per_iface = stats["ifaces"]
+
+        def run(iface, counters):
+            try:
+                self._capture(iface, target_ip, router_ip, extra_bpf, discovery, counters, per_iface=True)
+            except Exception as e:
+                self.log(f"Sniffer error on {iface}: {e}", "ALERT")
+
+        threads = []
+        for iface in ifaces:
+            counters = per_iface[iface] = {"delivered": 0, "kernel_recv": 0, "kernel_drops": 0, "ring_full": 0}
+            thread = threading.Thread(target=run, args=(iface, counters), daemon=True)
+            thread.start()
+            threads.append(thread)
+        # Общие итоги пересчитываются раз в SNIFF_POLL_SEC, а не на каждый пакет
+        while threads:
+            threads[0].join(SNIFF_POLL_SEC)
+            threads = [t for t in threads if t.is_alive()]
+            for key in ("delivered", "kernel_recv", "kernel_drops"):
+                stats[key] = sum(c[key] for c in per_iface.values())
+
+    def _run_pipeline(self, workers, target_ip, router_ip, extra_bpf, discovery, ifaces):
+        bpf = _build_bpf_filter(target_ip, router_ip, extra_bpf, discovery)
+        self.capture_stats["bpf"] = bpf
+        self.pcap_ring = None
+
+        def on_message(kind, data):
+            if kind == "DELTA":
+                self.analytics_deltas.put((self.epoch, data))
+            elif kind == "LOG":
+                self.emit("LOG", data)
+
+        # Несколько интерфейсов: свой процесс захвата и свои воркеры на каждый
+        tag = len(ifaces) > 1
+        pipelines = {iface: CapturePipeline(workers, target_ip, router_ip, bpf, on_message, iface=iface, tag_iface=tag)
+                     for iface in (ifaces or [None])}
+        for pipeline in pipelines.values():
+            pipeline.start()
+        on = f" on {', '.join(ifaces)}" if ifaces else ""
+        self.log(f"Pipeline: {len(pipelines)} capture process(es) + {workers} workers each{on},"
+                 f" BPF: {bpf or '<none>'}", "INFO")
+        self.log("Pcap ring and PACKET INSPECTOR are not fed in pipeline mode.", "INFO")
+
+        def collect():
+            rows = {iface: pipeline.stats() for iface, pipeline in pipelines.items()}
+            if tag:
+                self.capture_stats["ifaces"] = rows
+            for key in ("delivered", "kernel_recv", "kernel_drops", "ring_full"):
+                self.capture_stats[key] = sum(row[key] for row in rows.values())
+
+        try:
+            while self.is_sniffing:
+                time.sleep(SNIFF_POLL_SEC)
+                collect()
+        finally:
+            for pipeline in pipelines.values():
+                pipeline.stop()
+            collect()
+
+    def _start_ring(self, ring_spec):
+        self.pcap_ring = None
+        if ring_spec is None:
+            self.captured_packets = deque(maxlen=MAX_CAPTURED_PACKETS)
+            return
+        files, mb, rotate_sec = _parse_ring_spec(ring_spec)
+        self.captured_packets = deque(maxlen=MAX_CAPTURED_INDEX)
+        self.pcap_ring = PcapRingWriter(RING_DIR, files, mb << 20, rotate_sec)
+        rotate = f", rotate every {rotate_sec:g}s" if rotate_sec else ""
+        self.log(f"Pcap ring: {files} x {mb} MB in ./{RING_DIR}{rotate}", "INFO")
+
+    def _open_filtered_socket(self, target_ip, router_ip, extra_bpf, discovery, iface=None):
+        bpf = _build_bpf_filter(target_ip, router_ip, extra_bpf, discovery)
+        conf = scapy_all().conf
+        listen = {"iface": iface} if iface else {}
+        on_iface = f" on {iface}" if iface else ""
+        try:
+            sock = conf.L2listen(filter=bpf, **listen)
+        except Exception as e:
+            if not bpf:
+                raise
+            # Нет tcpdump/libpcap для компиляции фильтра -> фильтруем в Python
+            self.log(f"Kernel BPF unavailable{on_iface} ({e}), falling back to Python-side filtering.", "ALERT")
+            bpf = None
+            sock = conf.L2listen(**listen)
+        self.capture_stats["bpf"] = bpf
+        self.log(f"Kernel BPF{on_iface}: {bpf or '<none>'}", "INFO")
+        return sock
+
+    # --- воспроизведение файла ---
+    def start_replay(self, path, target_ip, router_ip, realtime=False):
+        self.is_replaying = True
+        self.pcap_ring = None
+        self.detector = AnomalyDetector()
+        self.captured_packets = deque(maxlen=MAX_CAPTURED_PACKETS)
+        thread = threading.Thread(target=self._replay_thread, args=(path, target_ip, router_ip, realtime),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def stop_replay(self):
+        self.is_replaying = False
+
+    def _replay_thread(self, path, target_ip, router_ip, realtime):
+        mode = "real-time" if realtime else "max speed"
+        self.log(f"Replaying {os.path.basename(path)} ({mode})...", "INFO")
+
+        count = 0
+        try:
+            reader = CaptureFileReader(path)
+        except (OSError, ValueError) as e:
+            self.log(f"Replay error: {e}", "ALERT")
+            self.is_replaying = False
+            self.emit("REPLAY_DONE", count)
+            return
+        agg = self._new_aggregator(target_ip, router_ip, wall_clock=False)
+        first_ts = None
+        wall_start = time.perf_counter()
+        next_progress = 0.0
+        try:
+            for ts, frame, wirelen in reader:
+                if not self.is_replaying:
+                    break
+                if first_ts is None:
+                    first_ts = ts
+                    self.sniff_start_time = ts
+                if realtime:
+                    # Ждем момента пакета относительно начала файла
+                    while self.is_replaying:
+                        delay = (ts - first_ts) - (time.perf_counter() - wall_start)
+                        if delay <= 0:
+                            break
+                        time.sleep(min(delay, REPLAY_MAX_SLEEP_SEC))
+                self.replay_clock = ts
+                self._ingest(decode_frame(frame, ts, wirelen), agg)
+                agg.maybe_publish()
+                count += 1
+                now = time.perf_counter()
+                if now >= next_progress:
+                    next_progress = now + REPLAY_PROGRESS_SEC
+                    self.emit("PROGRESS", reader.progress())
+        except Exception as e:
+            self.log(f"Replay error: {e}", "ALERT")
+        agg.publish(final=True)
+
+        elapsed = time.perf_counter() - wall_start
+        pps = count / elapsed if elapsed > 0 else 0
+        note = f", skipped {reader.skipped} non-Ethernet" if reader.skipped else ""
+        self.log(f"Replay finished: {count} packets in {elapsed:.1f}s ({pps:,.0f} pkt/s{note}).", "INFO")
+        self.emit("PROGRESS", reader.progress())
+        self.is_replaying = False
+        self.emit("REPLAY_DONE", count)
+
+    def _new_aggregator(self, target_ip, router_ip, wall_clock=True, source="local", iface=None):
+        deltas = self.analytics_deltas
+
+        def sink(delta):
+            deltas.put((self.epoch, delta))
+
+        return TrafficAggregator(target_ip, router_ip, sink, source=source, wall_clock=wall_clock, iface=iface)
+
+    def _ingest(self, rec, agg):
+        ring = self.pcap_ring
+        if ring is not None and self.is_sniffing:
+            try:
+                seq = ring.submit(rec)
+            except OSError as e:
+                self.log(f"Ring writer error: {e}. Packets are no longer saved to the ring.", "ALERT")
+                seq = None
+            if seq is not None:
+                self.captured_packets.append(seq)
+        else:
+            self.captured_packets.append(rec)
+        if agg.add(rec) and agg.relevant_total % 20 == 0:
+            self.emit("LOG", (f"{rec.src} -> {rec.dst} : {rec.summary()}", "DATA"))
+
+    def _ingest_shared(self, rec, agg):
+        # Несколько потоков захвата: нумерация в кольце pcap не потокобезопасна
+        with self._ingest_lock:
+            self._ingest(rec, agg)
+
+    # --- состояние аналитики ---
+    def reset(self):
+        # Дельты, посчитанные до сброса, отбрасываются по номеру эпохи
+        with self.state_lock:
+            self.epoch += 1
+            self.analytics = new_analytics_state()
+            self.sniff_start_time = time.time() if self.is_sniffing else None
+            if self.is_replaying:
+                self.sniff_start_time = self.replay_clock
+
+    def now(self):
+        # При воспроизведении "сейчас" — время последнего пакета из файла
+        if self.replay_clock is not None:
+            return self.replay_clock
+        return time.time()
+
+    def drain(self):
+        with self.state_lock:
+            epoch = self.epoch
+            while True:
+                try:
+                    delta_epoch, delta = self.analytics_deltas.get_nowait()
+                except queue.Empty:
+                    return
+                if "hosts" in delta:
+                    self.host_inventory.merge(delta["hosts"])
+                for ip, name in delta.get("dns_answers", {}).items():
+                    self.rdns.learn(ip, name)
+                for text in self.detector.observe(delta):
+                    self.log(text, "ALERT")
+                if delta_epoch == epoch:
+                    merge_analytics_delta(self.analytics, delta)
+                    if self.history is not None and not self.is_replaying:
+                        self.history.add_delta(delta)
+
+    def flush_history(self, final=False):
+        with self.state_lock:
+            if self.history is None:
+                return
+            try:
+                self.history.flush(time.time(), final)
+            except OSError as e:
+                self.history = None
+                self.log(f"History store disabled: {e}", "ALERT")
+
+    def close(self):
+        self.is_sniffing = False
+        self.is_replaying = False
+        self.drain()
+        self.flush_history(final=True)
+        self.rdns.close()
+
+    def packet_store(self):
+        if self.pcap_ring is not None:
+            return self.pcap_ring
+        return MemoryPacketStore([r for r in self.captured_packets if not isinstance(r, int)])
+
+    def snapshot(self):
+        with self.state_lock:
+            self.drain()
+            a = self.analytics
+            dns_sketch = a["dns_queries"]
+            peer_sketch = a["peers"]
+            start_time = self.sniff_start_time
+
+            # Снимок O(K): только top-K из скетчей фиксированного размера
+            top_peers = [
+                (ip, {"packets": row[0], "bytes": size, "err": err, "to_target": row[1],
+                      "from_target": row[2], "via_router": row[3]})
+                for ip, (size, err, row) in peer_sketch.top(TOP_PEERS)
+            ]
+            top_dns = [(name, count) for name, (count, _err, _) in dns_sketch.top(TOP_DNS)]
+            domains = a["dns_domains"].entries
+            dns_latency = {name: domains[name][2] for name, _ in top_dns if name in domains and domains[name][2]}
+            resolvers = sorted(a["dns_resolvers"].items(), key=lambda kv: kv[1][DNS_QUERIES], reverse=True)
+            meter = a["bandwidth"]
+            now = self.now()
+            rates = meter.rates(now)
+
+            return {
+                "total_packets": a["total_packets"],
+                "total_bytes": a["total_bytes"],
+                "protocols": dict(a["protocols"]),
+                "tcp_flags": dict(a["tcp_flags"]),
+                "apps": {app: (a["app_packets"][app], size) for app, size in a["app_bytes"].items()},
+                "top_dns": top_dns,
+                "top_peers": top_peers,
+                "dns_latency": dns_latency,
+                "dns_resolvers": resolvers[:DNS_RESOLVER_ROWS],
+                "dns_pending": sum(a["dns_pending"].values()),
+                "dns_overflow": a["dns_overflow"],
+                "peer_error": peer_sketch.max_error,
+                "dns_error": dns_sketch.max_error,
+                "bandwidth_bps": rates[BANDWIDTH_WINDOW_SEC][0],
+                "rates": rates,
+                "peak_bps": meter.peak_bps,
+                "peak_pps": meter.peak_pps,
+                "uptime": (now - start_time) if start_time else 0,
+                "ifaces": {name: (row[0], row[1], dict(row[2])) for name, row in a["ifaces"].items()},
+                "alerts": dict(self.detector.counts),
+            }
+
+    def status(self):
+        """Снимок для JSON (Unix-сокет) и Prometheus: только простые типы.
+
+        Под state_lock: LRU GeoIP и кэш имен не рассчитаны на параллельных читателей.
+        """
+        with self.state_lock:
+            data = self.snapshot()
+            flows = self.analytics["flow_stats"].values()
+            ring = self.pcap_ring
+            geoip = self.geoip
+            rdns = self.rdns
+            return {
+                "state": "sniffing" if self.is_sniffing else "replaying" if self.is_replaying else "stopped",
+                "time": time.time(),
+                "uptime": data["uptime"],
+                "packets": data["total_packets"],
+                "bytes": data["total_bytes"],
+                "protocols": data["protocols"],
+                "tcp_flags": data["tcp_flags"],
+                "apps": {app: {"packets": packets, "bytes": size} for app, (packets, size) in data["apps"].items()},
+                "rates": {str(window): {"bps": bps, "pps": pps} for window, (bps, pps) in data["rates"].items()},
+                "peak": {"bps": data["peak_bps"], "pps": data["peak_pps"]},
+                "capture": {k: v for k, v in self.capture_stats.items() if k != "ifaces"},
+                "ifaces": [{"iface": name, "packets": packets, "bytes": size, "protocols": protocols,
+                            **self.capture_stats["ifaces"].get(name, {})}
+                           for name, (packets, size, protocols) in sorted(data["ifaces"].items())],
+                "ring": {"files": ring.file_count, "written": ring.written, "dropped": ring.dropped} if ring else None,
+                "flows": {"active": sum(s[0] for s in flows), "evicted_idle": sum(s[1] for s in flows),
+                          "evicted_full": sum(s[2] for s in flows)},
+                "hosts": len(self.host_inventory),
+                "top_peers": [dict(row, ip=ip, host=rdns.name(ip, False), geo=geoip.describe(ip))
+                              for ip, row in data["top_peers"]],
+                "top_dns": [{"name": name, "queries": count} for name, count in data["top_dns"]],
+                "dns_resolvers": [dns_status(ip, stats) for ip, stats in data["dns_resolvers"]],
+                "dns_pending": data["dns_pending"],
+                "alerts": self.detector.status(),
+            }
+
+
+def dns_status(key, stats):
+    return {"key": key, "queries": stats[DNS_QUERIES], "answered": stats[DNS_ANSWERED],
+            "nxdomain": stats[DNS_NXDOMAIN], "servfail": stats[DNS_SERVFAIL], "unanswered": stats[DNS_LOST],
+            "latency_ms": {str(q): dns_percentile(stats, q) for q in (0.5, 0.95, 0.99)}}
+
+
+# --- ЭКСПОРТ МЕТРИК: Prometheus по HTTP и JSON по Unix-сокету ---
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_metrics(status):
+    """Текстовый формат Prometheus 0.0.4 из AnalyzerEngine.status()."""
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP netzwerk_{name} {help_text}")
+        out.append(f"# TYPE netzwerk_{name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join(f'{k}="{_prom_label(v)}"' for k, v in labels.items())
+            out.append(f"netzwerk_{name}{{{label_text}}} {value}" if label_text else f"netzwerk_{name} {value}")
+
+    capture = status["capture"]
+    metric("up", "gauge", "1 while capturing or replaying.", [({}, int(status["state"] != "stopped"))])
+    metric("uptime_seconds", "gauge", "Seconds since capture start.", [({}, round(status["uptime"], 3))])
+    metric("packets_total", "counter", "Packets to/from TARGET or ROUTER.", [({}, status["packets"])])
+    metric("bytes_total", "counter", "Bytes to/from TARGET or ROUTER.", [({}, status["bytes"])])
+    metric("protocol_packets_total", "counter", "Packets by protocol.",
+           [({"proto": p}, n) for p, n in sorted(status["protocols"].items())])
+    metric("tcp_flags_total", "counter", "TCP packets by flag combination.",
+           [({"flags": f}, n) for f, n in sorted(status["tcp_flags"].items())])
+    apps = sorted(status["apps"].items())
+    metric("app_packets_total", "counter", "Packets by application (port table + payload signatures).",
+           [({"app": app}, row["packets"]) for app, row in apps])
+    metric("app_bytes_total", "counter", "Bytes by application (port table + payload signatures).",
+           [({"app": app}, row["bytes"]) for app, row in apps])
+    metric("bandwidth_bytes_per_second", "gauge", "Bandwidth over a sliding window.",
+           [({"window": w}, round(r["bps"], 1)) for w, r in status["rates"].items()])
+    metric("packets_per_second", "gauge", "Packet rate over a sliding window.",
+           [({"window": w}, round(r["pps"], 1)) for w, r in status["rates"].items()])
+    for key, help_text in (("delivered", "Frames delivered to the capture loop."),
+                           ("kernel_recv", "Packets seen by the kernel filter."),
+                           ("kernel_drops", "Packets dropped by the kernel."),
+                           ("ring_full", "Frames dropped by a full pipeline ring.")):
+        metric(f"capture_{key}_total", "counter", help_text, [({}, capture.get(key, 0))])
+    ifaces = status["ifaces"]
+    metric("iface_packets_total", "counter", "Packets to/from TARGET or ROUTER per interface.",
+           [({"iface": i["iface"]}, i["packets"]) for i in ifaces])
+    metric("iface_bytes_total", "counter", "Bytes to/from TARGET or ROUTER per interface.",
+           [({"iface": i["iface"]}, i["bytes"]) for i in ifaces])
+    for key in ("delivered", "kernel_recv", "kernel_drops"):
+        metric(f"iface_{key}_total", "counter", f"Capture counter {key} per interface.",
+               [({"iface": i["iface"]}, i.get(key)) for i in ifaces])
+    ring = status["ring"]
+    if ring:
+        metric("ring_written_total", "counter", "Frames written to the pcap ring.", [({}, ring["written"])])
+        metric("ring_dropped_total", "counter", "Frames the pcap ring writer dropped.", [({}, ring["dropped"])])
+    flows = status["flows"]
+    metric("flows_active", "gauge", "Flows in the flow table.", [({}, flows["active"])])
+    metric("flows_evicted_total", "counter", "Flows evicted from the flow table.",
+           [({"reason": "idle"}, flows["evicted_idle"]), ({"reason": "full"}, flows["evicted_full"])])
+    metric("hosts_seen", "gauge", "Hosts found by passive discovery.", [({}, status["hosts"])])
+    metric("peer_bytes", "gauge", "Bytes per top peer (Space-Saving estimate).",
+           [({"peer": p["ip"]}, p["bytes"]) for p in status["top_peers"]])
+    metric("dns_pending", "gauge", "DNS queries waiting for a response.", [({}, status["dns_pending"])])
+    resolvers = status["dns_resolvers"]
+    for key, help_text in (("queries", "DNS queries sent."), ("answered", "DNS responses matched."),
+                           ("nxdomain", "NXDOMAIN responses."), ("servfail", "SERVFAIL responses."),
+                           ("unanswered", "Queries that timed out.")):
+        metric(f"dns_{key}_total", "counter", f"{help_text[:-1]} per resolver.",
+               [({"resolver": r["key"]}, r[key]) for r in resolvers])
+    metric("dns_latency_ms", "gauge", "DNS response latency quantiles per resolver.",
+           [({"resolver": r["key"], "quantile": q}, None if v is None else round(v, 3))
+            for r in resolvers for q, v in r["latency_ms"].items()])
+    metric("alerts_total", "counter", "Anomaly detector alerts by kind.",
+           [({"kind": kind}, n) for kind, n in status["alerts"]["total"].items()])
+    return "\n".join(out) + "\n"
+
+
+class _ThreadingHTTPServerV6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def serve_metrics(engine, host=METRICS_HOST, port=METRICS_PORT):
+    """GET /metrics (Prometheus) и GET /status (JSON) в фоновом потоке."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body = prometheus_metrics(engine.status()).encode()
+                ctype = "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/status":
+                body = json.dumps(engine.status(), default=str).encode()
+                ctype = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = (_ThreadingHTTPServerV6 if ":" in host else ThreadingHTTPServer)((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_host_port(spec, default_host=METRICS_HOST):
+    # "host:port", "[::1]:port" или ":port" -> (host, port); ValueError при ошибке
+    host, sep, port = spec.rpartition(":")
+    if not sep:
+        raise ValueError(f"expected HOST:PORT, got {spec!r}")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    elif ":" in host:
+        raise ValueError(f"IPv6 address must be in brackets: [{host}]:{port}")
+    return host or default_host, int(port)
+
+
+def remove_stale_socket(path):
+    # Удаляет только Unix-сокет: движок работает от root, чужой файл по ошибочному пути не трогаем
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    os.unlink(path)
+
+
+def serve_status_socket(engine, path):
+    """Unix-сокет: на каждое подключение — одна строка JSON со статусом."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("Unix sockets are not supported on this platform")
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(json.dumps(engine.status(), default=str).encode() + b"\n")
+
+    remove_stale_socket(path)  # сокет от прошлого запуска
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- HEADLESS-РЕЖИМ ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pashchenko network analyzer engine (headless)")
+    parser.add_argument("--target", help="TARGET IP (default: this host's address)")
+    parser.add_argument("--router", help="ROUTER IP (default: .1 of the target's /24)")
+    parser.add_argument("--iface", action="append", metavar="NAME",
+                        help="capture interface; repeat for several (default: scapy's default interface)")
+    parser.add_argument("--bpf", default="", help="extra BPF expression, ANDed with the TARGET/ROUTER filter")
+    parser.add_argument("--workers", type=int, default=0, help="pipeline worker processes (0 = in-process)")
+    parser.add_argument("--ring", default=RING_SPEC_DEFAULT, metavar="FILESxMB,SEC",
+                        help="pcap ring spec, or 'off' to keep packets only in memory")
+    parser.add_argument("--no-discovery", action="store_true", help="do not capture ARP/DHCP/mDNS of other hosts")
+    parser.add_argument("--no-ptr", action="store_true", help="never send PTR queries for peer names")
+    parser.add_argument("--replay", metavar="PCAP", help="analyze a capture file instead of sniffing, then exit")
+    parser.add_argument("--realtime", action="store_true", help="replay at the original packet timing")
+    parser.add_argument("--metrics", default=f"{METRICS_HOST}:{METRICS_PORT}", metavar="HOST:PORT",
+                        help="Prometheus endpoint address ([IPv6]:PORT in brackets), or 'off'")
+    parser.add_argument("--socket", metavar="PATH", help="also serve JSON status on this Unix socket")
+    parser.add_argument("--history-dir", default=HISTORY_DIR, help="time-series store directory, or 'off'")
+    args = parser.parse_args(argv)
+
+    target_ip = args.target or _detect_local_ip()
+    router_ip = args.router or _detect_gateway(target_ip)
+    engine = AnalyzerEngine(history_dir=None if args.history_dir == "off" else args.history_dir,
+                            resolve=(lambda ip: None) if args.no_ptr else ptr_lookup)
+    servers = []
+    try:
+        if args.metrics != "off":
+            host, port = parse_host_port(args.metrics)
+            servers.append(serve_metrics(engine, host, port))
+            shown = f"[{host}]" if ":" in host else host
+            engine.log(f"Metrics: http://{shown}:{port}/metrics", "INFO")
+        if args.socket:
+            servers.append(serve_status_socket(engine, args.socket))
+            engine.log(f"JSON status socket: {args.socket}", "INFO")
+    except (OSError, ValueError) as e:
+        engine.log(f"Cannot start metrics server: {e}", "ALERT")
+        return 1
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    if args.replay:
+        thread = engine.start_replay(args.replay, target_ip, router_ip, args.realtime)
+    else:
+        ring = None if args.ring == "off" else args.ring
+        thread = engine.start_sniffer(target_ip, router_ip, args.bpf, args.workers, ring, not args.no_discovery,
+                                      args.iface)
+    try:
+        while not stop.wait(HEADLESS_TICK_SEC) and thread.is_alive():
+            engine.drain()
+            engine.flush_history()
+    finally:
+        # Сначала дождаться финальной дельты потока захвата, потом слить ее в close()
+        engine.stop_sniffer()
+        engine.stop_replay()
+        thread.join(PIPELINE_JOIN_SEC)
+        engine.close()
+        for server in servers:
+            server.shutdown()
+        if args.socket:
+            try:
+                remove_stale_socket(args.socket)
+            except OSError as e:
+                engine.log(f"Status socket not removed: {e}", "ALERT")
+    if args.replay:
+        print(json.dumps(engine.status(), default=str, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import threading
+import time
+import unittest
+
+from netzwerk_engine import ReverseDnsResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubResolver:
+    """Заглушка PTR: имена из словаря, счетчик вызовов, исключение по запросу."""
+
+    def __init__(self, names=None, fail=()):
+        self.names = names or {}
+        self.fail = set(fail)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, ip):
+        with self.lock:
+            self.calls.append(ip)
+        if ip in self.fail:
+            raise UnicodeError("bad PTR label")
+        return self.names.get(ip)
+
+
+def wait_for(resolver, ip, timeout=2.0):
+    # Ждем, пока фоновый поток запишет адрес в кэш
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with resolver._lock:
+            if ip in resolver._cache and ip not in resolver._pending:
+                return
+        time.sleep(0.005)
+    raise AssertionError(f"{ip} not resolved in {timeout}s")
+
+
+class ReverseDnsResolverTest(unittest.TestCase):
+    def make(self, stub, **kw):
+        kw.setdefault("clock", FakeClock())
+        resolver = ReverseDnsResolver(resolve=stub, **kw)
+        self.addCleanup(resolver.close)
+        return resolver
+
+    def test_cache_hit_skips_second_query(self):
+        stub = StubResolver({"8.8.8.8": "dns.google"})
+        resolver = self.make(stub)
+        self.assertIsNone(resolver.name("8.8.8.8"))
+        wait_for(resolver, "8.8.8.8")
+        self.assertEqual(resolver.name("8.8.8.8"), "dns.google")
+        self.assertEqual(resolver.name("8.8.8.8"), "dns.google")
+        self.assertEqual(stub.calls, ["8.8.8.8"])
+        self.assertEqual(resolver.queries, 1)
+
+    def test_learned_name_needs_no_query_and_beats_ptr(self):
+        stub = StubResolver({"1.1.1.1": "ptr.example"})
+        clock = FakeClock()
+        resolver = self.make(stub, clock=clock, ttl=60)
+        resolver.learn("1.1.1.1", "one.one.one.one")
+        self.assertEqual(resolver.name("1.1.1.1"), "one.one.one.one")
+        self.assertEqual(stub.calls, [])
+        self.assertEqual(resolver.learned, 1)
+        # PTR-ответ не затирает еще действующее имя из DNS
+        resolver._store("1.1.1.1", "ptr.example", 60, False)
+        self.assertEqual(resolver.name("1.1.1.1"), "one.one.one.one")
+
+    def test_ttl_expiry_requeries(self):
+        stub = StubResolver({"9.9.9.9": "dns9.quad9.net"})
+        clock = FakeClock()
+        resolver = self.make(stub, clock=clock, ttl=60)
+        resolver.name("9.9.9.9")
+        wait_for(resolver, "9.9.9.9")
+        clock.now += 61
+        # Устаревшее имя отдается, пока идет новый запрос
+        self.assertEqual(resolver.name("9.9.9.9"), "dns9.quad9.net")
+        wait_for(resolver, "9.9.9.9")
+        self.assertEqual(stub.calls, ["9.9.9.9", "9.9.9.9"])
+
+    def test_negative_ttl(self):
+        stub = StubResolver()
+        clock = FakeClock()
+        resolver = self.make(stub, clock=clock, ttl=600, negative_ttl=30)
+        resolver.name("10.0.0.1")
+        wait_for(resolver, "10.0.0.1")
+        self.assertIsNone(resolver.name("10.0.0.1"))
+        self.assertEqual(len(stub.calls), 1)
+        clock.now += 31
+        resolver.name("10.0.0.1")
+        wait_for(resolver, "10.0.0.1")
+        self.assertEqual(len(stub.calls), 2)
+
+    def test_raising_resolver_keeps_workers_alive(self):
+        ips = [f"192.0.2.{i}" for i in range(1, 9)]
+        stub = StubResolver({ip: f"host{i}.test" for i, ip in enumerate(ips)}, fail=ips[:4])
+        resolver = self.make(stub, workers=2)
+        for ip in ips:
+            resolver.name(ip)
+        for ip in ips:
+            wait_for(resolver, ip)
+        # Ошибка — отрицательная запись, адрес не застревает в _pending
+        for ip in ips[:4]:
+            self.assertIsNone(resolver.name(ip, False))
+        for i, ip in enumerate(ips[4:], 4):
+            self.assertEqual(resolver.name(ip, False), f"host{i}.test")
+        self.assertEqual(resolver._pending, set())
+        self.assertEqual(resolver.queries, len(ips))
+        self.assertLessEqual(len(resolver._threads), 2)
+        self.assertTrue(all(t.is_alive() for t in resolver._threads))
+        # После ошибок пул продолжает отвечать
+        stub.names["192.0.2.100"] = "late.test"
+        resolver.name("192.0.2.100")
+        wait_for(resolver, "192.0.2.100")
+        self.assertEqual(resolver.name("192.0.2.100", False), "late.test")
+
+    def test_dead_worker_is_replaced(self):
+        stub = StubResolver({"203.0.113.5": "five.test"})
+        resolver = self.make(stub, workers=1)
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        resolver._threads.append(dead)
+        resolver.name("203.0.113.5")
+        wait_for(resolver, "203.0.113.5")
+        self.assertEqual(resolver.name("203.0.113.5", False), "five.test")
+        self.assertNotIn(dead, resolver._threads)
+
+    def test_unresolvable_addresses_are_not_queued(self):
+        stub = StubResolver()
+        resolver = self.make(stub)
+        for ip in ("224.0.0.1", "0.0.0.0", "255.255.255.255", "not-an-ip"):
+            self.assertIsNone(resolver.name(ip))
+        self.assertEqual(resolver._pending, set())
+        self.assertEqual(stub.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()